@@ -1,86 +1,792 @@
+import argparse
+import asyncio
+import bisect
+import contextvars
+import functools
+import hashlib
+import http.cookiejar
+import itertools
+import json
+import logging
+import multiprocessing
+import socket
+import sys
 import httpx
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from bs4 import BeautifulSoup, Tag
+from urllib.parse import unquote_plus, unquote_to_bytes, urljoin, urlparse, urlsplit, urlunsplit
 import cv2
+import numpy as np
 import os
-import tempfile
+import sqlite3
+import struct
 import time
 import base64
 import re
+import threading
+import atexit
+import importlib.util
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from selenium import webdriver
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional parser backend
+    LexborHTMLParser = None
+try:
+    import cairosvg
+except (ImportError, OSError):  # optional: rasterizes SVG logos for thumbnails (needs libcairo)
+    cairosvg = None
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 
+logger = logging.getLogger('scraper')
+
+# Instrumentation: per-URL timing breakdown plus process-wide counters and
+# histograms. While disabled every hook returns immediately.
+METRICS_CONFIG = {
+    'enabled': False,
+    'include_in_results': False,      # add a "metrics" field to each result row
+}
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+METRIC_HELP = {
+    'scraper_stage_seconds': 'Time spent per stage of a URL (steps include their image probes)',
+    'scraper_probe_bytes': 'Bytes transferred per image probe',
+    'scraper_pages_total': 'Pages processed by outcome',
+    'scraper_candidates_total': 'Image candidates examined',
+    'scraper_downloads_total': 'Image probes that went to the network',
+    'scraper_download_bytes_total': 'Bytes transferred by image probes',
+    'scraper_fallbacks_total': 'Fallbacks taken, by kind',
+    'scraper_cache_hits_total': 'Cache hits, by cache',
+    'scraper_cache_errors_total': 'SQLite cache reads/writes that failed and were skipped',
+    'scraper_coalesced_total': 'Requests that joined an identical one already in flight',
+    'scraper_rules_total': 'Learned extraction rule events, by kind and outcome',
+    'scraper_partial_pages_total': 'Page bodies read only in part, by reason',
+    'scraper_browser_bytes_total': 'Bytes Selenium page fetches transferred, subresources included',
+    'scraper_escalations_total': 'HTTP pages sent to the browser by classify_page, by verdict',
+    'scraper_fetch_mode_switches_total': 'Domains switched between plain HTTP and the browser',
+    'scraper_browser_sessions_total': 'Browser cookie sessions captured, expired or invalidated',
+    'scraper_thumbnail_sources_total': 'Thumbnail source bodies, by where the bytes came from',
+    'scraper_thumbnails_total': 'Thumbnails rendered, by outcome',
+}
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+            self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def prometheus_text(self):
+        """Render everything in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            for name, group in itertools.groupby(counters, key=lambda item: item[0][0]):
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for (_, labels), value in group:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+            for name, group in itertools.groupby(histograms, key=lambda item: item[0][0]):
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for (_, labels), histogram in group:
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_number(bound))])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write prometheus_text() to path atomically (node_exporter textfile style)."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+METRICS = MetricsRegistry()
+
+class UrlTrace:
+    """Timings, counters and image probes recorded while processing one URL."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.probes = []
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.timings[stage] += seconds
+
+    def add_count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def add_probe(self, probe):
+        with self._lock:
+            self.probes.append(probe)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'timings': {stage: round(seconds, 4) for stage, seconds in self.timings.items()},
+                'counters': dict(self.counters),
+                'probes': list(self.probes),
+            }
+
+_current_trace = contextvars.ContextVar('scraper_url_trace', default=None)
+
+@contextmanager
+def url_trace():
+    """
+    Collect a UrlTrace for the work done in this context; yields None
+    while metrics are disabled. Threads only see the trace through
+    in_context().
+    """
+    if not METRICS_CONFIG['enabled']:
+        yield None
+        return
+    trace = UrlTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+def in_context(fn, *args):
+    """Bind fn(*args) to a copy of the current context for an executor."""
+    if not METRICS_CONFIG['enabled']:
+        return functools.partial(fn, *args)
+    return functools.partial(contextvars.copy_context().run, fn, *args)
+
+class _StageTimer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+_NO_TIMER = nullcontext()
+
+def timed(stage):
+    """Context manager adding its elapsed time to `stage`."""
+    if not METRICS_CONFIG['enabled']:
+        return _NO_TIMER
+    return _StageTimer(stage)
+
+def record_time(stage, seconds):
+    if not METRICS_CONFIG['enabled']:
+        return
+    METRICS.observe('scraper_stage_seconds', seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_time(stage, seconds)
+
+def count(name, value=1, **labels):
+    """
+    Bump counter scraper_<name>_total and the per-URL counter
+    <name>[_<label value>...].
+    """
+    if not METRICS_CONFIG['enabled']:
+        return
+    METRICS.inc(f"scraper_{name}_total", value, **labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_count('_'.join([name] + [str(label) for label in labels.values()]), value)
+
+def record_probe(url, probe, seconds):
+    """Record one image probe (a probe_image_size/measure_image result)."""
+    if not METRICS_CONFIG['enabled']:
+        return
+    record_time('probe', seconds)
+    if probe['method'] not in ('cache', 'shared') and probe['error'] != 'offline':
+        METRICS.inc('scraper_downloads_total')
+        METRICS.inc('scraper_download_bytes_total', probe['bytes'])
+        METRICS.observe('scraper_probe_bytes', probe['bytes'], buckets=BYTES_BUCKETS)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_probe({
+            'url': url,
+            'seconds': round(seconds, 4),
+            'bytes': probe['bytes'],
+            'method': probe['method'],
+            'error': probe['error'],
+        })
+
+def attach_metrics(row, trace):
+    """Add the trace to a result row when include_in_results is set."""
+    if trace is not None and METRICS_CONFIG['include_in_results']:
+        row['metrics'] = trace.as_dict()
+    return row
+
+# Browser identity shared by httpx and Selenium
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+DEFAULT_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+IMAGE_ACCEPT = 'image/webp,image/apng,image/*,*/*;q=0.8'
+
+# Shared HTTP client settings (pool limits, keep-alive, timeouts)
+HTTP_CLIENT_CONFIG = {
+    'http2': True,                    # only used when the h2 package is installed
+    'max_connections': 100,
+    'max_keepalive_connections': 20,
+    'keepalive_expiry': 30.0,
+    'connect_timeout': 10.0,
+    'read_timeout': 30.0,
+    'write_timeout': 10.0,
+    'pool_timeout': 10.0,
+    'page_timeout': 30.0,             # per-request timeout for page fetches
+    'image_timeout': 10.0,            # per-request timeout for image downloads
+    'replay_server': None,            # 'host:port' that receives every request instead (bench.py fixtures)
+}
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def _replay_target(request):
+    # Keep the original Host header so the replay server can tell sites apart
+    host, _, port = HTTP_CLIENT_CONFIG['replay_server'].rpartition(':')
+    request.url = request.url.copy_with(scheme='http', host=host, port=int(port))
+
+async def _replay_target_async(request):
+    _replay_target(request)
+
+def _http_client_kwargs(is_async=False):
+    config = HTTP_CLIENT_CONFIG
+    http2 = config['http2'] and importlib.util.find_spec('h2') is not None
+    hooks = {'request': [], 'response': []}
+    cookies = None
+    if BROWSER_SESSION_CONFIG['enabled']:
+        # Cookies the browser earned, shared by every client (see BrowserSessions)
+        cookies = BROWSER_SESSIONS.jar
+        hooks['request'].append(_apply_browser_session_async if is_async else _apply_browser_session)
+        hooks['response'].append(_check_browser_session_async if is_async else _check_browser_session)
+    if config['replay_server']:
+        http2 = False
+        hooks['request'].append(_replay_target_async if is_async else _replay_target)
+    return {
+        'http2': http2,
+        'event_hooks': hooks,
+        'cookies': cookies,
+        'headers': DEFAULT_HEADERS,
+        'follow_redirects': True,
+        'limits': httpx.Limits(
+            max_connections=config['max_connections'],
+            max_keepalive_connections=config['max_keepalive_connections'],
+            keepalive_expiry=config['keepalive_expiry'],
+        ),
+        'timeout': httpx.Timeout(
+            connect=config['connect_timeout'],
+            read=config['read_timeout'],
+            write=config['write_timeout'],
+            pool=config['pool_timeout'],
+        ),
+    }
+
+def get_http_client():
+    """
+    Return the long-lived httpx.Client shared by page and image fetches.
+    Created on first use so HTTP_CLIENT_CONFIG can be tuned beforehand.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(**_http_client_kwargs())
+    return _http_client
+
+def create_async_http_client():
+    """
+    Build an httpx.AsyncClient with the same pool/timeout/header settings.
+    Async clients are bound to an event loop, so callers own its lifetime.
+    """
+    return httpx.AsyncClient(**_http_client_kwargs(is_async=True))
+
+def close_http_client():
+    global _http_client
+    with _http_client_lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+
+atexit.register(close_http_client)
+
+def image_request_headers(url):
+    parsed = urlparse(url)
+    return {
+        'Accept': IMAGE_ACCEPT,
+        'Referer': parsed.scheme + '://' + parsed.netloc
+    }
+
+# Per-host politeness: minimum seconds between requests to the same host.
+# Zero means no throttling; only hosts that need it should get an interval.
+POLITENESS_CONFIG = {
+    'default_min_interval': 0.0,
+    'host_min_intervals': {},         # e.g. {'www.bestbuy.com': 2.0}
+}
+
+# Readiness waits for browser pages (seconds)
+BROWSER_WAIT_CONFIG = {
+    'page_load_timeout': 10.0,        # body present + document.readyState == complete
+    'network_idle_timeout': 5.0,      # max time to wait for the network to go quiet
+    'network_idle_window': 0.5,       # no new resource entries for this long = idle
+    'image_load_timeout': 3.0,        # max time to wait for <img> elements to complete
+    'popup_close_timeout': 3.0,       # max time to wait for a clicked popup to disappear
+    'poll_interval': 0.1,
+}
+
+class HostScheduler:
+    """
+    Hands out request slots per host so consecutive requests to the same
+    host are at least min_interval apart. Thread-safe; the async wait
+    shares the same slot table.
+    """
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else POLITENESS_CONFIG
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def min_interval(self, host):
+        return self.config['host_min_intervals'].get(host, self.config['default_min_interval'])
+
+    def reserve(self, url):
+        """Reserve the next slot for url's host and return the delay until it."""
+        host = urlparse(url.strip()).netloc
+        interval = self.min_interval(host)
+        if interval <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + interval
+        return slot - now
+
+    def wait(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+HOST_SCHEDULER = HostScheduler()
+
+def wait_for_document_ready(driver, timeout=None, ready_states=('complete',)):
+    timeout = timeout if timeout is not None else BROWSER_WAIT_CONFIG['page_load_timeout']
+    WebDriverWait(driver, timeout, poll_frequency=BROWSER_WAIT_CONFIG['poll_interval']).until(
+        lambda d: d.execute_script("return document.readyState") in ready_states
+    )
+
+def wait_for_network_idle(driver, timeout=None, idle_window=None):
+    """
+    Wait until no new resource timing entries appear for idle_window seconds.
+    Gives up silently after timeout; the page is usable either way.
+    """
+    timeout = timeout if timeout is not None else BROWSER_WAIT_CONFIG['network_idle_timeout']
+    idle_window = idle_window if idle_window is not None else BROWSER_WAIT_CONFIG['network_idle_window']
+    poll = BROWSER_WAIT_CONFIG['poll_interval']
+    deadline = time.monotonic() + timeout
+    last_count = -1
+    quiet_since = time.monotonic()
+    while time.monotonic() < deadline:
+        try:
+            count = driver.execute_script("return performance.getEntriesByType('resource').length")
+        except WebDriverException:
+            return
+        now = time.monotonic()
+        if count != last_count:
+            last_count = count
+            quiet_since = now
+        elif now - quiet_since >= idle_window:
+            return
+        time.sleep(poll)
+
+def wait_for_images_complete(driver, timeout=None):
+    timeout = timeout if timeout is not None else BROWSER_WAIT_CONFIG['image_load_timeout']
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=BROWSER_WAIT_CONFIG['poll_interval']).until(
+            lambda d: d.execute_script("return Array.from(document.images).every(img => img.complete)")
+        )
+    except TimeoutException:
+        pass  # Some images never finish (lazy/broken); don't block on them
+
+# Lean browser mode for page fetches: we only need the DOM and image
+# URLs, so heavy resources and ad/tracker hosts are blocked over the
+# DevTools protocol, pages load with the 'eager' strategy (DOMContentLoaded,
+# not every subresource) and a whole fetch is capped at page_time_cap.
+BROWSER_LEAN_CONFIG = {
+    'enabled': True,
+    'page_load_strategy': 'eager',
+    'page_time_cap': 20.0,            # seconds for load, popups and settling together
+    'blocked_types': ('image', 'media', 'font'),
+    'blocked_domains': (
+        'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'google-analytics.com',
+        'googletagmanager.com', 'adservice.google.com', 'amazon-adsystem.com', 'adnxs.com',
+        'criteo.com', 'criteo.net', 'taboola.com', 'outbrain.com', 'scorecardresearch.com',
+        'facebook.net', 'hotjar.com', 'quantserve.com', 'moatads.com', 'pubmatic.com', 'rubiconproject.com',
+    ),
+}
+
+# URL patterns (Network.setBlockedURLs wildcards) per blockable resource type
+BLOCKED_TYPE_PATTERNS = {
+    'image': ('jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'bmp', 'ico', 'svg'),
+    'media': ('mp4', 'webm', 'm3u8', 'mpd', 'mp3', 'ogg', 'wav'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'stylesheet': ('css',),
+}
+
+def blocked_url_patterns():
+    patterns = []
+    for resource_type in BROWSER_LEAN_CONFIG['blocked_types']:
+        for ext in BLOCKED_TYPE_PATTERNS[resource_type]:
+            patterns += [f'*.{ext}', f'*.{ext}?*']
+    patterns += [f'*{domain}/*' for domain in BROWSER_LEAN_CONFIG['blocked_domains']]
+    return patterns
+
+def set_blocked_urls(driver, patterns):
+    """Block requests matching patterns in this driver ([] lifts the block). False if CDP is unavailable."""
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(patterns)})
+        return True
+    except (AttributeError, WebDriverException):
+        return False
+
+# Closes the first visible popup/modal close button in one round trip and
+# returns it (or null) so the caller can wait for it to disappear
+POPUP_CLOSE_SCRIPT = """
+const selectors = arguments[0];
+for (const selector of selectors) {
+    let button;
+    try { button = document.querySelector(selector); } catch (e) { continue; }
+    if (button && button.getClientRects().length && getComputedStyle(button).visibility !== 'hidden') {
+        try { button.click(); return button; } catch (e) {}
+    }
+}
+return null;
+"""
+
+POPUP_CLOSE_SELECTORS = [
+    "button[aria-label*='close' i]",
+    ".modal-close",
+    ".popup-close",
+    "#close",
+    ".close-button",
+    "[class*='close'][class*='button']",
+]
+
+# Bytes the browser transferred for the page and its subresources
+TRANSFER_SIZE_SCRIPT = """
+return performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'))
+    .reduce((total, entry) => total + (entry.transferSize || 0), 0);
+"""
+
+# Warm headless Chrome instances shared by all Selenium paths
+WEBDRIVER_POOL_CONFIG = {
+    'max_size': 2,                    # max concurrent browsers
+    'max_uses': 50,                   # recycle a driver after this many checkouts
+    'checkout_timeout': 120.0,        # seconds to wait for a free driver
+    'enabled': True,                  # False: every Selenium fallback fails fast
+}
+
+def create_chrome_driver():
+    # Setup Chrome options
+    chrome_options = Options()
+    chrome_options.add_argument('--headless')  # Run in background
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_argument(f'--user-agent={USER_AGENT}')
+    if BROWSER_LEAN_CONFIG['enabled']:
+        chrome_options.page_load_strategy = BROWSER_LEAN_CONFIG['page_load_strategy']
+    return webdriver.Chrome(options=chrome_options)
+
+class WebDriverPool:
+    """
+    Bounded pool of headless Chrome drivers.
+
+    checkout() hands out an idle driver (health-checked first) or starts a
+    new one while under max_size, otherwise blocks until one is checked in.
+    checkin() resets cookies/storage and parks the driver on about:blank,
+    or quits it if it is broken, failed the reset or reached max_uses.
+    """
+
+    def __init__(self, max_size=None, max_uses=None, factory=create_chrome_driver):
+        self.max_size = max_size or WEBDRIVER_POOL_CONFIG['max_size']
+        self.max_uses = max_uses or WEBDRIVER_POOL_CONFIG['max_uses']
+        self.factory = factory
+        self._idle = []
+        self._uses = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def checkout(self, timeout=None):
+        if not WEBDRIVER_POOL_CONFIG['enabled']:
+            raise RuntimeError("Selenium is disabled")
+        timeout = timeout if timeout is not None else WEBDRIVER_POOL_CONFIG['checkout_timeout']
+        deadline = time.monotonic() + timeout
+        while True:
+            driver = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        raise TimeoutError("No WebDriver available within checkout timeout")
+                if self._closed:
+                    raise RuntimeError("WebDriver pool is shut down")
+                if self._idle:
+                    driver = self._idle.pop()
+                else:
+                    self._size += 1  # reserve a slot for a new driver
+
+            if driver is not None:
+                if self._is_healthy(driver):
+                    return driver
+                self._discard(driver)  # crashed while idle; try again
+                continue
+
+            try:
+                driver = self.factory()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._uses[id(driver)] = 0
+            return driver
+
+    def checkin(self, driver, broken=False):
+        with self._cond:
+            uses = self._uses.get(id(driver), 0) + 1
+            self._uses[id(driver)] = uses
+            recycle = broken or self._closed or uses >= self.max_uses
+
+        if recycle or not self._reset(driver):
+            self._discard(driver)
+            return
+
+        with self._cond:
+            if self._closed:
+                recycle = True
+            else:
+                self._idle.append(driver)
+                self._cond.notify()
+        if recycle:
+            self._discard(driver)
+
+    @contextmanager
+    def driver(self, timeout=None):
+        driver = self.checkout(timeout)
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = not self._is_healthy(driver)
+            raise
+        finally:
+            self.checkin(driver, broken=broken)
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for driver in idle:
+            self._discard(driver)
+
+    def _is_healthy(self, driver):
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _reset(self, driver):
+        # Clear per-site state so the next user starts clean. delete_all_cookies()
+        # only reaches the current document's domain; CDP clears every site the
+        # driver visited
+        try:
+            try:
+                driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+                driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': '*', 'storageTypes': 'all'})
+            except (AttributeError, WebDriverException):
+                driver.delete_all_cookies()
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except WebDriverException:
+                pass  # Storage can be unavailable (opaque origins, image documents)
+            driver.get('about:blank')
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._cond:
+            self._uses.pop(id(driver), None)
+            self._size -= 1
+            self._cond.notify()
+
+WEBDRIVER_POOL = WebDriverPool()
+atexit.register(WEBDRIVER_POOL.shutdown)
+
 def get_page_content_selenium(url):
-        # Setup Chrome options
-        chrome_options = Options()
-        chrome_options.add_argument('--headless')  # Run in background
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-        chrome_options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
-        
-        driver = webdriver.Chrome(options=chrome_options)
+        try:
+            driver = WEBDRIVER_POOL.checkout()
+        except (WebDriverException, TimeoutError, RuntimeError) as exc:
+            logger.warning("Selenium error for %s: %s", url, exc)
+            return None
         
+        lean = BROWSER_LEAN_CONFIG['enabled']
+        deadline = time.monotonic() + BROWSER_LEAN_CONFIG['page_time_cap'] if lean else None
+
+        def remaining(timeout):
+            # Every wait shares the page_time_cap budget in lean mode
+            return max(0.0, min(timeout, deadline - time.monotonic())) if lean else timeout
+
+        blocked = lean and set_blocked_urls(driver, blocked_url_patterns())
         try:
-            driver.get(url)
+            HOST_SCHEDULER.wait(url)
+            if lean:
+                driver.set_page_load_timeout(BROWSER_LEAN_CONFIG['page_time_cap'])
+            try:
+                driver.get(url)
+            except TimeoutException:
+                if not lean:
+                    raise
+                # Out of time: keep whatever DOM has been built so far
+                logger.info("  Page time cap reached for %s, stopping the load", url)
+                driver.execute_script("window.stop();")
             
-            # Wait for page to load (wait for body tag)
-            WebDriverWait(driver, 10).until(
+            # Wait for page to load (wait for body tag, then readyState;
+            # 'interactive' is enough with the eager strategy)
+            WebDriverWait(driver, remaining(BROWSER_WAIT_CONFIG['page_load_timeout'])).until(
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
+            wait_for_document_ready(driver, remaining(BROWSER_WAIT_CONFIG['page_load_timeout']),
+                                    ('interactive', 'complete') if lean else ('complete',))
             
-            # Try to close common popups/modals
+            # Try to close common popups/modals, all selectors in one script
             try:
-                popup_selectors = [
-                    "button[aria-label*='close' i]",
-                    "button[aria-label*='Close' i]",
-                    ".modal-close",
-                    ".popup-close",
-                    "#close",
-                    ".close-button",
-                    "[class*='close'][class*='button']"
-                ]
-                
-                for selector in popup_selectors:
+                close_btn = driver.execute_script(POPUP_CLOSE_SCRIPT, POPUP_CLOSE_SELECTORS)
+                if close_btn is not None:
+                    # Wait for the popup to actually disappear
                     try:
-                        close_btn = driver.find_element(By.CSS_SELECTOR, selector)
-                        if close_btn.is_displayed():
-                            close_btn.click()
-                            time.sleep(5)  # Wait for popup to close
-                            break
-                    except:
-                        continue
-            except:
+                        WebDriverWait(driver, remaining(BROWSER_WAIT_CONFIG['popup_close_timeout'])).until(
+                            EC.invisibility_of_element(close_btn)
+                        )
+                    except TimeoutException:
+                        pass
+            except WebDriverException:
                 pass  # If popup handling fails, continue anyway
             
-            # Give page a moment to fully render (especially for lazy-loaded images)
-            time.sleep(2)
+            # Let lazy-loaded images settle: network idle, then <img> complete
+            wait_for_network_idle(driver, remaining(BROWSER_WAIT_CONFIG['network_idle_timeout']))
+            wait_for_images_complete(driver, remaining(BROWSER_WAIT_CONFIG['image_load_timeout']))
             
+            if METRICS_CONFIG['enabled']:
+                count('browser_bytes', driver.execute_script(TRANSFER_SIZE_SCRIPT) or 0)
+            BROWSER_SESSIONS.capture(driver)
             return driver.page_source
         except TimeoutException:
-            print(f"Timeout waiting for page to load: {url}")
+            logger.warning("Timeout waiting for page to load: %s", url)
             return None
         except WebDriverException as exc:
-            print(f"Selenium error for {url}: {exc}")
+            logger.warning("Selenium error for %s: %s", url, exc)
             return None
         finally:
-            driver.quit()
+            if blocked:
+                set_blocked_urls(driver, [])
+            WEBDRIVER_POOL.checkin(driver)
 
 def verify_image(img_url, img_tag):
     img_url_lower = img_url.lower()
     
     # Check if extension is SVG - skip immediately
     if img_url_lower.endswith('.svg') or '.svg' in img_url_lower.split('?')[0]:
-        print(f"    ✗ Skipping SVG image")
+        logger.debug("    ✗ Skipping SVG image")
         return False
     
     # Check if URL contains "150x150" pattern (common thumbnail naming)
     if '150x150' in img_url:
-        print(f"    ✗ Skipping 150x150 thumbnail (detected in URL)")
+        logger.debug("    ✗ Skipping 150x150 thumbnail (detected in URL)")
         return False
     
     # Check if URL contains dimension patterns like "300x200" and extract them
@@ -94,7 +800,7 @@ def verify_image(img_url, img_tag):
                 h = int(dim_match[1])
                 # If dimensions in URL are <= 150x150, skip it
                 if w <= 150 and h <= 150:
-                    print(f"    ✗ Skipping small image (URL shows {w}x{h})")
+                    logger.debug("    ✗ Skipping small image (URL shows %sx%s)", w, h)
                     return False
             except (ValueError, TypeError):
                 pass
@@ -110,37 +816,29 @@ def verify_image(img_url, img_tag):
             
             # If exactly 150x150, skip it
             if w == 150 and h == 150:
-                print(f"    ✗ Skipping 150x150 thumbnail: {w}x{h}")
+                logger.debug("    ✗ Skipping 150x150 thumbnail: %sx%s", w, h)
                 return False
             
             # If smaller than 150x150, skip it
             if w <= 150 or h <= 150:
-                print(f"    ✗ HTML attributes show size: {w}x{h} - Too small")
+                logger.debug("    ✗ HTML attributes show size: %sx%s - Too small", w, h)
                 return False
             
             # If greater than 150x150, use it
             if w > 150 and h > 150:
-                print(f"    ✓ HTML attributes show size: {w}x{h} - Meets requirement")
+                logger.debug("    ✓ HTML attributes show size: %sx%s - Meets requirement", w, h)
                 return True
         except (ValueError, TypeError):
             pass
     
     # No size info in HTML or URL - need to download and check
-    print(f"    ? No size info in URL/HTML - will download to check")
+    logger.debug("    ? No size info in URL/HTML - will download to check")
     return None
                
 def download_image_selenium(url):
     driver = None
     try:
-        # Setup Chrome options
-        chrome_options = Options()
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-        chrome_options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
-        
-        driver = webdriver.Chrome(options=chrome_options)
+        driver = WEBDRIVER_POOL.checkout()
         
         # Method 1: Try JavaScript fetch API
         try:
@@ -175,6 +873,8 @@ def download_image_selenium(url):
             if base64_data and base64_data.startswith('data:'):
                 base64_part = base64_data.split(',', 1)[1]
                 image_bytes = base64.b64decode(base64_part)
+                # Keep whatever cookies the fetch earned for later plain HTTP downloads
+                BROWSER_SESSIONS.capture(driver)
                 return image_bytes
         except:
             pass  # Fall through to method 2
@@ -182,24 +882,21 @@ def download_image_selenium(url):
         # Method 2: Navigate to image URL and get cookies, then use httpx
         try:
             # Navigate to the image URL to establish session
+            HOST_SCHEDULER.wait(url)
             driver.get(url)
-            time.sleep(1)
-            
-            # Get cookies from Selenium session
-            cookies = driver.get_cookies()
+            wait_for_document_ready(driver)
+            wait_for_images_complete(driver)
             
-            # Convert Selenium cookies to httpx format
-            cookie_dict = {cookie['name']: cookie['value'] for cookie in cookies}
-            
-            # Use httpx with cookies
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': urlparse(url).scheme + '://' + urlparse(url).netloc
-            }
+            headers = image_request_headers(url)
+            if BROWSER_SESSION_CONFIG['enabled']:
+                # The shared client sends the captured cookies from now on
+                BROWSER_SESSIONS.capture(driver)
+            else:
+                cookie_dict = {cookie['name']: cookie['value'] for cookie in driver.get_cookies()}
+                if cookie_dict:
+                    headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in cookie_dict.items())
             
-            response = httpx.get(url, headers=headers, cookies=cookie_dict, timeout=15.0, follow_redirects=True)
+            response = get_http_client().get(url, headers=headers, timeout=15.0)
             response.raise_for_status()
             return response.content
         except:
@@ -211,36 +908,30 @@ def download_image_selenium(url):
         return None
     finally:
         if driver:
-            try:
-                driver.quit()
-            except:
-                pass
+            WEBDRIVER_POOL.checkin(driver)
 
 def download_image(url):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': urlparse(url).scheme + '://' + urlparse(url).netloc
-        }
-        response = httpx.get(url, headers=headers, timeout=10.0, follow_redirects=True)
+        HOST_SCHEDULER.wait(url)
+        response = get_http_client().get(url, headers=image_request_headers(url), timeout=HTTP_CLIENT_CONFIG['image_timeout'])
         response.raise_for_status()
         return response.content
     except (httpx.RequestError, httpx.HTTPStatusError, httpx.TimeoutException):
         # Try Selenium fallback
-        print(f"    HTTP download failed, trying Selenium for: {url}")
+        logger.info("    HTTP download failed, trying Selenium for: %s", url)
+        count('fallbacks', kind='image_selenium')
         selenium_result = download_image_selenium(url)
         if selenium_result:
-            print(f"    ✓ Selenium download successful")
+            logger.info("    ✓ Selenium download successful")
             return selenium_result
         return None
     except Exception:
         # Try Selenium fallback
-        print(f"    Exception in HTTP download, trying Selenium for: {url}")
+        logger.info("    Exception in HTTP download, trying Selenium for: %s", url)
+        count('fallbacks', kind='image_selenium')
         selenium_result = download_image_selenium(url)
         if selenium_result:
-            print(f"    ✓ Selenium download successful")
+            logger.info("    ✓ Selenium download successful")
             return selenium_result
         return None
 
@@ -250,639 +941,3706 @@ def bypass_popup(url):
     """
     pass
 
-def check_size(img_url):
-    temp_file = None
+# Dimension probing: read only as many bytes as the header needs
+IMAGE_PROBE_CONFIG = {
+    'probe_bytes': 16 * 1024,          # initial Range request size
+    'max_bytes': 2 * 1024 * 1024,      # hard cap on bytes pulled for one image
+}
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def _jpeg_dimensions(data):
+    i = 2
+    length = len(data)
+    while i + 9 < length:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        if marker in (0xD9, 0xDA):  # end of image / start of scan before any SOF
+            return None
+        segment_length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        i += 2 + segment_length
+    return None
+
+def _webp_dimensions(data):
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and data[20] == 0x2F:
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = 1 + int.from_bytes(data[24:27], 'little')
+        height = 1 + int.from_bytes(data[27:30], 'little')
+        return width, height
+    return None
+
+def _avif_dimensions(data):
+    # ISO-BMFF: take the largest 'ispe' (image spatial extents) property;
+    # grid images carry one per tile plus one for the full canvas
+    best = None
+    idx = data.find(b'ispe')
+    while idx != -1 and idx + 16 <= len(data):
+        width, height = struct.unpack('>II', data[idx + 8:idx + 16])
+        if best is None or width * height > best[0] * best[1]:
+            best = (width, height)
+        idx = data.find(b'ispe', idx + 4)
+    return best
+
+def parse_image_dimensions(data):
+    """
+    Read (width, height) straight from PNG, JPEG, GIF, WebP or AVIF header bytes.
+    Returns None when the format is unknown or the bytes are too short.
+    """
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR' and len(data) >= 24:
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+            return struct.unpack('<HH', data[6:10])
+        if data[:2] == b'\xff\xd8':
+            return _jpeg_dimensions(data)
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return _webp_dimensions(data)
+        if data[4:8] == b'ftyp' and data[8:12] in (b'avif', b'avis', b'mif1', b'msf1'):
+            return _avif_dimensions(data)
+    except (struct.error, IndexError):
+        pass
+    return None
+
+def decode_image_dimensions(data):
+    """Fallback when header parsing fails: decode in memory with OpenCV."""
+    img = cv2.imdecode(np.frombuffer(bytes(data), np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    height, width = img.shape[:2]
+    return width, height
+
+class ProbeCancelled(Exception):
+    pass
+
+def _resource_length(response):
+    """Full size of the resource behind an image response, or None if unknown."""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+    elif 'Content-Encoding' not in response.headers:
+        total = response.headers.get('Content-Length', '')
+    else:
+        return None  # Content-Length counts encoded bytes, buf holds decoded ones
+    return int(total) if total.isdigit() else None
+
+def _stream_image_bytes(url, buf, start, end, cancelled=None):
+    """
+    Stream bytes [start, end] of url into buf, stopping as soon as the
+    header parses. Returns (dimensions, finished) where finished means the
+    whole resource has been read.
+
+    With thumbnails enabled, a resource that ends inside the requested
+    range is read to the end anyway so the thumbnail stage can reuse it.
+    """
+    headers = image_request_headers(url)
+    headers['Range'] = f'bytes={start}-{end}'
+    with get_http_client().stream('GET', url, headers=headers, timeout=HTTP_CLIENT_CONFIG['image_timeout']) as response:
+        response.raise_for_status()
+        if response.status_code != 206 and start > 0:
+            buf.clear()  # Range ignored; the body restarts from byte 0
+        total = _resource_length(response)
+        read_whole = THUMBNAIL_CONFIG['enabled'] and total is not None and total <= end + 1
+        dims = None
+        next_parse = 0
+        for chunk in response.iter_bytes(chunk_size=4096):
+            if cancelled is not None and cancelled.is_set():
+                raise ProbeCancelled()
+            buf.extend(chunk)
+            # Re-parse at doubling sizes so large bodies stay O(n log n)
+            if dims is None and len(buf) >= next_parse:
+                dims = parse_image_dimensions(buf)
+                if dims and not read_whole:
+                    return dims, False
+                next_parse = len(buf) * 2
+            if len(buf) >= IMAGE_PROBE_CONFIG['max_bytes']:
+                return dims, False
+        finished = response.status_code != 206 or (total is not None and len(buf) >= total)
+        return dims or parse_image_dimensions(buf), finished
+
+def probe_image_size(url, cancelled=None):
+    """
+    Measure an image while transferring as few bytes as possible.
+
+    Requests the first probe_bytes with a Range header (or closes a plain
+    200 stream early) and parses the dimensions from the header. If that
+    fails, keeps reading up to max_bytes and decodes with cv2.imdecode.
+    Returns a dict with width, height, bytes read, method and error.
+    Setting the optional `cancelled` event aborts the transfer with
+    error 'cancelled'.
+    """
+    probe_bytes = IMAGE_PROBE_CONFIG['probe_bytes']
+    max_bytes = IMAGE_PROBE_CONFIG['max_bytes']
+    result = {'width': None, 'height': None, 'bytes': 0, 'method': None, 'error': None}
+    buf = bytearray()
+    try:
+        if cancelled is not None and cancelled.is_set():
+            raise ProbeCancelled()
+        HOST_SCHEDULER.wait(url)
+        dims, finished = _stream_image_bytes(url, buf, 0, probe_bytes - 1, cancelled)
+        if not dims and not finished and len(buf) < max_bytes:
+            dims, finished = _stream_image_bytes(url, buf, len(buf), max_bytes - 1, cancelled)
+    except ProbeCancelled:
+        result['bytes'] = len(buf)
+        result['error'] = 'cancelled'
+        return result
+    except (httpx.RequestError, httpx.HTTPStatusError) as exc:
+        logger.info("    HTTP probe failed (%s), trying Selenium for: %s", type(exc).__name__, url)
+        count('fallbacks', kind='image_selenium')
+        selenium_result = download_image_selenium(url)
+        if not selenium_result:
+            result['error'] = 'download failed'
+            return result
+        logger.info("    ✓ Selenium download successful")
+        buf = bytearray(selenium_result[:max_bytes])
+        dims = parse_image_dimensions(buf)
+        finished = len(selenium_result) <= max_bytes
+
+    result['bytes'] = len(buf)
+    if finished:
+        RETAINED_IMAGE_BYTES.put(url, buf)
+    if dims:
+        result['method'] = 'header'
+    elif finished:
+        dims = decode_image_dimensions(buf)
+        result['method'] = 'decode'
+        if not dims:
+            result['error'] = 'undecodable'
+            return result
+    else:
+        result['error'] = 'too large'
+        return result
+
+    result['width'], result['height'] = int(dims[0]), int(dims[1])
+    return result
+
+# Persistent cache shared by the URL-keyed caches (one SQLite file)
+CACHE_CONFIG = {
+    'db_path': os.environ.get('SCRAPER_CACHE_DB', '.scraper_cache.sqlite3'),
+    'busy_timeout': 30.0,             # seconds to wait for a lock held by another process
+}
+
+class SQLiteStore:
+    """
+    One SQLite connection shared across threads behind a lock. Caches
+    create their own tables in it via ensure_table(). WAL mode and a long
+    busy timeout let pipeline workers and queue workers share the file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CACHE_CONFIG['db_path']
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=CACHE_CONFIG['busy_timeout'])
+            self._conn.execute(f"PRAGMA busy_timeout={int(CACHE_CONFIG['busy_timeout'] * 1000)}")
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        return self._conn
+
+    def ensure_table(self, ddl):
+        with self._lock:
+            self._connect().execute(ddl)
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+CACHE_STORE = SQLiteStore()
+atexit.register(CACHE_STORE.close)
+
+# URL canonicalization for pages and images
+URL_CONFIG = {
+    # Query params dropped from every URL; a trailing * matches a prefix
+    'strip_params': ['utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid',
+                     '_ga', '_gl', 'igshid', 'ref_src'],
+}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def _is_tracking_param(name):
+    for pattern in URL_CONFIG['strip_params']:
+        if name == pattern or (pattern.endswith('*') and name.startswith(pattern[:-1])):
+            return True
+    return False
+
+def normalize_url(url):
+    """
+    Canonical form of a page or image URL, used to fetch, cache and
+    coalesce: strip whitespace and fragment, lowercase scheme and host,
+    drop the default port and the tracking params in URL_CONFIG.
+    Other query params keep their order and encoding.
+    """
+    parsed = urlsplit(url.strip())
+    scheme, netloc = parsed.scheme.lower(), parsed.netloc.lower()
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    if port is not None and port == DEFAULT_PORTS.get(scheme) and '@' not in netloc:
+        netloc = netloc.rsplit(':', 1)[0]
+    query = parsed.query
+    if query:
+        query = '&'.join(
+            param for param in query.split('&')
+            if param and not _is_tracking_param(unquote_plus(param.split('=', 1)[0]))
+        )
+    path = parsed.path or ('/' if netloc else '')
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+def host_key(url):
+    """Canonical host for per-host limits: case, default port and www. don't split a site."""
+    host = urlsplit(normalize_url(url)).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key: the first caller runs
+    the function, callers arriving while it runs wait for its result.
+    do() returns (result, shared), shared being True for those callers.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            count('coalesced', kind=self.kind)
+            return future.result(), True
+        try:
+            result = fn(*args)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._tasks = {}
+
+    async def do(self, key, coro_fn, *args):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            count('coalesced', kind=self.kind)
+        # A cancelled caller must not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+# Image measurement cache: in-memory LRU in front of the SQLite store
+IMAGE_CACHE_CONFIG = {
+    'enabled': True,
+    'memory_entries': 10000,
+    'disk_max_entries': 200000,
+    'ttl': 7 * 24 * 3600,             # measured dimensions
+    'failure_ttl': 6 * 3600,          # download/decode failures are retried sooner
+}
+
+class ImageCache:
+    """
+    Normalized image URL -> measured dimensions or failure reason.
+    Lookups go memory LRU, then disk; entries expire after their TTL and
+    the disk tier is trimmed to disk_max_entries (least recently used first).
+    """
+
+    def __init__(self, store=None, config=None):
+        self.store = store or CACHE_STORE
+        self.config = config if config is not None else IMAGE_CACHE_CONFIG
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._writes = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.store.ensure_table(
+                'CREATE TABLE IF NOT EXISTS image_cache ('
+                'url TEXT PRIMARY KEY, width INTEGER, height INTEGER, error TEXT, '
+                'expires_at REAL, accessed_at REAL)'
+            )
+            self._table_ready = True
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.config['memory_entries']:
+                self._memory.popitem(last=False)
+
+    def get(self, url):
+        if not self.config['enabled']:
+            return None
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry['expires_at'] > now:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return entry
+                del self._memory[key]
+
+        self._ensure_table()
+        rows = self.store.execute(
+            'SELECT width, height, error, expires_at FROM image_cache WHERE url = ?', (key,)
+        )
+        if rows and rows[0][3] > now:
+            width, height, error, expires_at = rows[0]
+            entry = {'width': width, 'height': height, 'error': error, 'expires_at': expires_at}
+            self.store.execute('UPDATE image_cache SET accessed_at = ? WHERE url = ?', (now, key))
+            self._remember(key, entry)
+            with self._lock:
+                self.counters['disk_hits'] += 1
+            return entry
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, url, probe):
+        if not self.config['enabled']:
+            return
+        key = normalize_url(url)
+        now = time.time()
+        ttl = self.config['failure_ttl'] if probe['error'] else self.config['ttl']
+        entry = {'width': probe['width'], 'height': probe['height'], 'error': probe['error'], 'expires_at': now + ttl}
+        self._remember(key, entry)
+
+        self._ensure_table()
+        self.store.execute(
+            'INSERT OR REPLACE INTO image_cache (url, width, height, error, expires_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (key, entry['width'], entry['height'], entry['error'], entry['expires_at'], now)
+        )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self.evict()
+
+    def evict(self):
+        self._ensure_table()
+        self.store.execute('DELETE FROM image_cache WHERE expires_at <= ?', (time.time(),))
+        self.store.execute(
+            'DELETE FROM image_cache WHERE url IN ('
+            'SELECT url FROM image_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.config['disk_max_entries'],)
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+IMAGE_CACHE = ImageCache()
+
+IMAGE_FLIGHTS = SingleFlight('image')
+
+def _probe_and_cache(img_url, cancelled):
+    probe = probe_image_size(img_url, cancelled)
+    if probe['error'] != 'cancelled':
+        try:
+            IMAGE_CACHE.put(img_url, probe)
+        except sqlite3.Error as exc:
+            # A failed cache write must not turn a measured image into a rejection
+            logger.warning("    Image cache write failed (%s), using the probe anyway: %s", exc, img_url)
+            count('cache_errors', cache='image', op='write')
+    return probe
+
+def measure_image(img_url, cancelled=None):
+    """
+    Cached probe_image_size on the canonical URL: returns the cached
+    entry when present, otherwise probes the network and stores the
+    outcome. Concurrent probes of the same image share one transfer;
+    callers that joined one get method 'shared' and bytes 0.
+    """
+    img_url = normalize_url(img_url)
+    start = time.perf_counter()
     try:
-        # Download image
-        image_content = download_image(img_url)
-        if not image_content:
-            print(f"    Failed to download image: {img_url}")
+        cached = IMAGE_CACHE.get(img_url)
+    except sqlite3.Error as exc:
+        logger.warning("    Image cache read failed (%s), probing instead: %s", exc, img_url)
+        count('cache_errors', cache='image', op='read')
+        cached = None
+    if cached is not None:
+        count('cache_hits', cache='image')
+        probe = dict(cached, bytes=0, method='cache')
+    elif PAGE_CACHE_CONFIG['offline']:
+        # Offline re-runs never touch the network; uncached images are unknown
+        probe = {'width': None, 'height': None, 'bytes': 0, 'method': None, 'error': 'offline'}
+    else:
+        probe, shared = IMAGE_FLIGHTS.do(img_url, _probe_and_cache, img_url, cancelled)
+        # Joined a probe whose owner gave up: probe again unless we were cancelled too
+        while shared and probe['error'] == 'cancelled' and not (cancelled is not None and cancelled.is_set()):
+            probe, shared = IMAGE_FLIGHTS.do(img_url, _probe_and_cache, img_url, cancelled)
+        if shared:
+            probe = dict(probe, bytes=0, method='shared')
+    record_probe(img_url, probe, time.perf_counter() - start)
+    return probe
+
+def check_size(img_url, cancelled=None):
+    try:
+        probe = measure_image(img_url, cancelled)
+        if probe['error'] == 'cancelled':
             return False
-        
-        # Determine file extension from URL or content type
-        file_ext = '.jpg'  # default
-        if img_url.lower().endswith('.png'):
-            file_ext = '.png'
-        elif img_url.lower().endswith('.gif'):
-            file_ext = '.gif'
-        elif img_url.lower().endswith('.webp'):
-            file_ext = '.webp'
-        
-        # Create a temporary file with appropriate extension
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-            temp_file = tmp_file.name
-            tmp_file.write(image_content)
-        
-        # Read image using OpenCV
-        img = cv2.imread(temp_file)
-        if img is None:
-            print(f"    OpenCV failed to read image: {img_url}")
+        if probe['error']:
+            logger.debug("    Failed to measure image (%s): %s", probe['error'], img_url)
             return False
         
-        # Get image dimensions (height, width, channels)
-        height, width = img.shape[:2]
-        print(f"    Image dimensions: {width}x{height}")
+        width, height = probe['width'], probe['height']
+        logger.debug("    Image dimensions: %sx%s (%s, %s bytes)", width, height, probe['method'], probe['bytes'])
         
         # Check if both dimensions are greater than 150
         if width > 150 and height > 150:
-            print(f"    ✓ Image meets size requirement")
+            logger.debug("    ✓ Image meets size requirement")
             return True
         else:
-            print(f"    ✗ Image too small: {width}x{height} (need >150x150)")
+            logger.debug("    ✗ Image too small: %sx%s (need >150x150)", width, height)
             return False
             
     except Exception as e:
-        # Print error for debugging
-        print(f"    Exception in check_size: {type(e).__name__}: {str(e)}")
+        logger.warning("    Exception in check_size: %s: %s", type(e).__name__, e)
         return False
-    finally:
-        # Clean up temporary file
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except Exception:
-                pass
 
-def is_ad_div(div):
-       
-    # Common ad-related keywords in attributes
-    ad_keywords = ['ad', 'banner', 'sponsor', 'advertisement', 'promo', 'promotion', 
-                   'adsbygoogle', 'doubleclick', 'adserver', 'advert']
-    
-    # Get class attribute and convert to list of strings
-    div_class = div.get('class', [])
-    if div_class:
-        # Convert BeautifulSoup's AttributeValueList to regular list of strings
-        div_class = [str(cls) for cls in div_class] if isinstance(div_class, list) else [str(div_class)]
-    else:
-        div_class = []
-    
-    # Check class and id attributes
-    div_attrs = ' '.join([
-        ' '.join(div_class),
-        str(div.get('id', ''))
-    ]).lower()
-    
-    # Check if any ad keyword is present
-    if any(keyword in div_attrs for keyword in ad_keywords):
-        return True
-    
-    return False
+# Ad/container filter. Class and id values are split into tokens
+# (separators and camelCase: 'adSlot-top' -> ad, slot, top) and each
+# token must match AD_TOKEN_PATTERN as a whole, so 'ad' no longer hits
+# header/shadow/download/gradient. easylist_path adds EasyList-style
+# element hiding rules ('##.class', '###id', '##tag.class').
+AD_FILTER_CONFIG = {
+    'easylist_path': None,
+    'max_cached_verdicts': 100000,
+}
 
-def get_page_content(url):
+AD_TOKEN_PATTERN = re.compile(
+    r'(?:ads?|adv|adverts?|advertis\w*|banners?|sponsor\w*|promo\w*|'
+    r'adsbygoogle|doubleclick|adserver|dfp|'
+    r'ad(?:slot|unit|box|block|zone|space|frame|container|wrap\w*|holder|label|placement|sense|choices)s?)'
+)
+TOKEN_SPLIT_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+# Only selectors that name one class or id (optionally with a tag) are supported
+HIDING_RULE_PATTERN = re.compile(r'^##([a-zA-Z][\w-]*)?([.#])([\w-]+)$')
 
-    try:
-        # Use a longer timeout and set headers to mimic a browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = httpx.get(url, headers=headers, timeout=30.0, follow_redirects=True)
-        response.raise_for_status()
-        # Add delay to allow any server-side processing
-        time.sleep(10)
-        return response.text
-    except httpx.RequestError as e:
-        print(f"Request error for {url}: {e}")
-        print(f"  Trying Selenium fallback...")
-        try:
+def _name_tokens(value):
+    return [token.lower() for token in TOKEN_SPLIT_PATTERN.findall(value)]
+
+class AdFilter:
+    """
+    Compiled is_ad_div: keyword tokens plus hiding rules. Verdicts are
+    cached per class name and per id, so names repeated across a page
+    (or a crawl) cost one dict lookup.
+    """
+
+    def __init__(self, hidden_classes=(), hidden_ids=()):
+        self.hidden_classes = frozenset(hidden_classes)
+        self.hidden_ids = frozenset(hidden_ids)
+        self._class_verdicts = {}
+        self._id_verdicts = {}
+
+    @classmethod
+    def from_easylist(cls, path):
+        """
+        Read generic element hiding rules. Domain-specific rules
+        (example.com##...), exceptions (#@#) and complex selectors are
+        skipped; network rules are not element rules and are ignored.
+        """
+        hidden_classes, hidden_ids = set(), set()
+        skipped = 0
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if '##' not in line or line.startswith('!'):
+                    continue
+                match = HIDING_RULE_PATTERN.match(line)
+                if not match:
+                    skipped += 1
+                    continue
+                _, kind, name = match.groups()
+                (hidden_classes if kind == '.' else hidden_ids).add(name)
+        logger.info("Loaded %d class and %d id hiding rules from %s (%d unsupported skipped)",
+                    len(hidden_classes), len(hidden_ids), path, skipped)
+        return cls(hidden_classes, hidden_ids)
+
+    def is_ad(self, element):
+        classes = element.get('class') or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        for name in classes:
+            verdict = self._class_verdicts.get(name)
+            if verdict is None:
+                verdict = self._decide(self._class_verdicts, self.hidden_classes, str(name))
+            if verdict:
+                return True
+        element_id = element.get('id')
+        if element_id:
+            verdict = self._id_verdicts.get(element_id)
+            if verdict is None:
+                verdict = self._decide(self._id_verdicts, self.hidden_ids, str(element_id))
+            return verdict
+        return False
+
+    def _decide(self, verdicts, hidden, value):
+        if len(verdicts) >= AD_FILTER_CONFIG['max_cached_verdicts']:
+            verdicts.clear()
+        verdict = value in hidden or any(AD_TOKEN_PATTERN.fullmatch(token) for token in _name_tokens(value))
+        verdicts[value] = verdict
+        return verdict
+
+_ad_filter = None
+
+def get_ad_filter():
+    global _ad_filter
+    if _ad_filter is None:
+        path = AD_FILTER_CONFIG['easylist_path']
+        _ad_filter = AdFilter.from_easylist(path) if path else AdFilter()
+    return _ad_filter
+
+def reset_ad_filter():
+    """Drop the compiled filter so the next use rereads AD_FILTER_CONFIG."""
+    global _ad_filter
+    _ad_filter = None
+
+def is_ad_div(div):
+    """True if a div/figure's class or id marks it as an ad container (see AdFilter)."""
+    return get_ad_filter().is_ad(div)
+
+def selenium_fallback(url):
+    logger.info("  Trying Selenium fallback...")
+    count('fallbacks', kind='page_selenium')
+    try:
+        with timed('selenium'):
             selenium_result = get_page_content_selenium(url)
-            if selenium_result:
-                print(f"  ✓ Selenium fallback successful")
-                return selenium_result
-            else:
-                print(f"  ✗ Selenium fallback failed")
-                return None
-        except Exception as selenium_error:
-            print(f"  ✗ Selenium error: {selenium_error}")
+        if selenium_result:
+            logger.info("  ✓ Selenium fallback successful")
+            return selenium_result
+        else:
+            logger.warning("  ✗ Selenium fallback failed")
+            return None
+    except Exception as selenium_error:
+        logger.warning("  ✗ Selenium error: %s", selenium_error)
+        return None
+
+# Page cache: stored HTML with validators for conditional revalidation
+PAGE_CACHE_CONFIG = {
+    'enabled': True,
+    'fresh_for': 3600,                # serve without revalidating for this long
+    'selenium_fresh_for': 24 * 3600,  # browser-rendered pages have no validators
+    'max_age': 30 * 24 * 3600,        # drop entries older than this
+    'max_bytes': 512 * 1024 * 1024,   # total stored HTML before LRU eviction
+    'offline': False,                 # serve only from cache, never touch the network
+}
+
+class PageCache:
+    """
+    Normalized page URL -> HTML, its ETag/Last-Modified and where it came
+    from ('http' or 'selenium'). Entries inside their freshness window are
+    served directly; older http entries are revalidated with
+    If-None-Match/If-Modified-Since so a 304 reuses the stored body.
+    """
+
+    def __init__(self, store=None, config=None):
+        self.store = store or CACHE_STORE
+        self.config = config if config is not None else PAGE_CACHE_CONFIG
+        self._table_ready = False
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {'fresh_hits': 0, 'revalidated': 0, 'misses': 0, 'stores': 0}
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.store.ensure_table(
+                'CREATE TABLE IF NOT EXISTS page_cache ('
+                'url TEXT PRIMARY KEY, body TEXT, etag TEXT, last_modified TEXT, source TEXT, '
+                'fetched_at REAL, validated_at REAL, accessed_at REAL, size INTEGER)'
+            )
+            self._table_ready = True
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, url):
+        if not self.config['enabled']:
+            return None
+        self._ensure_table()
+        key = normalize_url(url)
+        rows = self.store.execute(
+            'SELECT body, etag, last_modified, source, fetched_at, validated_at FROM page_cache WHERE url = ?', (key,)
+        )
+        if not rows:
+            self._count('misses')
+            return None
+        body, etag, last_modified, source, fetched_at, validated_at = rows[0]
+        if not self.config['offline'] and time.time() - fetched_at > self.config['max_age']:
+            self._count('misses')
+            return None
+        self.store.execute('UPDATE page_cache SET accessed_at = ? WHERE url = ?', (time.time(), key))
+        return {
+            'body': body, 'etag': etag, 'last_modified': last_modified,
+            'source': source, 'fetched_at': fetched_at, 'validated_at': validated_at,
+        }
+
+    def is_fresh(self, entry):
+        window = self.config['selenium_fresh_for'] if entry['source'] == 'selenium' else self.config['fresh_for']
+        fresh = time.time() - entry['validated_at'] <= window
+        if fresh:
+            self._count('fresh_hits')
+        return fresh
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry and entry['source'] == 'http':
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def revalidated(self, url):
+        self._ensure_table()
+        self._count('revalidated')
+        self.store.execute('UPDATE page_cache SET validated_at = ? WHERE url = ?', (time.time(), normalize_url(url)))
+
+    def put(self, url, body, source, etag=None, last_modified=None):
+        if not self.config['enabled'] or not body:
+            return
+        self._ensure_table()
+        now = time.time()
+        self.store.execute(
+            'INSERT OR REPLACE INTO page_cache '
+            '(url, body, etag, last_modified, source, fetched_at, validated_at, accessed_at, size) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (normalize_url(url), body, etag, last_modified, source, now, now, now, len(body))
+        )
+        self._count('stores')
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def put_response(self, url, response, body):
+        # A prefix (see PartialPage) must not be served as the whole page later
+        if isinstance(body, PartialPage):
+            return
+        self.put(url, body, 'http', response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        self._ensure_table()
+        self.store.execute('DELETE FROM page_cache WHERE fetched_at < ?', (time.time() - self.config['max_age'],))
+        total = self.store.execute('SELECT COALESCE(SUM(size), 0) FROM page_cache')[0][0]
+        excess = total - self.config['max_bytes']
+        if excess <= 0:
+            return
+        doomed = []
+        for url, size in self.store.execute('SELECT url, size FROM page_cache ORDER BY accessed_at'):
+            if excess <= 0:
+                break
+            doomed.append((url,))
+            excess -= size
+        for params in doomed:
+            self.store.execute('DELETE FROM page_cache WHERE url = ?', params)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+PAGE_CACHE = PageCache()
+
+def _cached_page(url):
+    """
+    Return (entry, body) where body is set when the cache alone can answer
+    (fresh entry, or any entry in offline mode).
+    """
+    cached = PAGE_CACHE.get(url)
+    if cached and (PAGE_CACHE_CONFIG['offline'] or PAGE_CACHE.is_fresh(cached)):
+        count('cache_hits', cache='page')
+        return cached, cached['body']
+    return cached, None
+
+def _cache_selenium_page(url, html_content):
+    if html_content:
+        PAGE_CACHE.put(url, html_content, 'selenium')
+    return html_content
+
+# Streaming page fetch: bodies are read in chunks and capped at
+# max_body_bytes. With early_stop, reading also ends once the prefix
+# read so far already fixes the image, favicon and logo (see
+# prefix_resolves_page); such pages are not cached.
+STREAMING_FETCH_CONFIG = {
+    'max_body_bytes': 5 * 1024 * 1024,   # truncate pages beyond this
+    'early_stop': False,
+    'first_check_bytes': 16 * 1024,      # earliest early-stop check, doubled after each one
+}
+
+HEAD_END_PATTERN = re.compile(rb'</head\s*>|<body[\s>]', re.IGNORECASE)
+
+class PartialPage(str):
+    """Page HTML that is only a prefix of the body: `reason` is 'early_stop' or 'max_bytes'."""
+
+    def __new__(cls, text, reason, bytes_read):
+        page = super().__new__(cls, text)
+        page.reason = reason
+        page.bytes_read = bytes_read
+        return page
+
+    def __reduce__(self):
+        return PartialPage, (str(self), self.reason, self.bytes_read)
+
+def prefix_resolves_page(url, html_prefix):
+    """
+    True when a page prefix with a complete <head> already gives every
+    field without the rest: a metadata image accepted on its declared
+    size (no probe), and a logo nothing later in the page can outrank,
+    i.e. a JSON-LD logo or a hit of the domain's learned logo rule (a
+    full-search match could lose to a higher-priority element further
+    down). The favicon only depends on the head.
+    """
+    index = get_dom_index(parse_html(html_prefix))
+    for img_url, attrs in meta_image_candidates(url, index):
+        verdict = verify_image(img_url, attrs)
+        if verdict is None:
+            return False
+        if verdict:
+            break
+    else:
+        return False
+    if json_ld_logo(url, index):
+        return True
+    rule = EXTRACTION_RULES.get(rule_domain(url), 'logo')
+    return bool(rule) and find_logo(url, index, rule)[2]
+
+class PageReader:
+    """
+    Collects a streamed page body. feed() returns False once reading
+    should stop: the body reached max_body_bytes or, with early_stop,
+    prefix_resolves_page() says the rest isn't needed. Checks start when
+    the head is complete and repeat at doubling sizes, so the total
+    parsing stays O(n).
+    """
+
+    def __init__(self, url, response):
+        self.url = url
+        self.encoding = response.encoding or 'utf-8'
+        self.body = bytearray()
+        self.reason = None
+        self.head_done = False
+        self.next_check = STREAMING_FETCH_CONFIG['first_check_bytes']
+
+    def feed(self, chunk):
+        start = max(len(self.body) - 16, 0)
+        self.body.extend(chunk)
+        if len(self.body) >= STREAMING_FETCH_CONFIG['max_body_bytes']:
+            del self.body[STREAMING_FETCH_CONFIG['max_body_bytes']:]
+            self.reason = 'max_bytes'
+            return False
+        if not STREAMING_FETCH_CONFIG['early_stop']:
+            return True
+        if not self.head_done:
+            self.head_done = HEAD_END_PATTERN.search(self.body, start) is not None
+            if not self.head_done:
+                return True
+            self.next_check = 0
+        if len(self.body) >= self.next_check:
+            self.next_check = max(len(self.body) * 2, STREAMING_FETCH_CONFIG['first_check_bytes'])
+            with timed('early_stop_check'):
+                resolved = prefix_resolves_page(self.url, self.text())
+            if resolved:
+                self.reason = 'early_stop'
+                return False
+        return True
+
+    def text(self):
+        return bytes(self.body).decode(self.encoding, errors='replace')
+
+    def page(self):
+        """The decoded body; a PartialPage if reading stopped before the end."""
+        if self.reason is None:
+            return self.text()
+        logger.info("  Stopped reading %s after %d bytes (%s)", self.url, len(self.body), self.reason)
+        count('partial_pages', reason=self.reason)
+        return PartialPage(self.text(), self.reason, len(self.body))
+
+# Content classifier: 200 responses that still need a browser
+CONTENT_CLASSIFIER_CONFIG = {
+    'enabled': True,
+    'min_text_chars': 200,            # less visible text and no usable image: an SPA shell
+    'challenge_max_text_chars': 1000, # challenge markers only count on pages with less visible text
+}
+
+# Bot-challenge interstitials (Cloudflare, Akamai, Imperva, PerimeterX, DataDome)
+CHALLENGE_TITLES = (
+    'just a moment', 'attention required', 'access denied', 'are you a robot',
+    'security check', 'pardon our interruption', 'verify you are human',
+)
+# Interstitial-only signatures; Cloudflare also injects /cdn-cgi/challenge-platform/scripts/jsd/
+# into ordinary proxied pages, so only the challenge ('/h/') path counts
+CHALLENGE_MARKERS = (
+    'cf-browser-verification', 'cf_chl_opt', '/cdn-cgi/challenge-platform/h/', '_incapsula_resource',
+    'px-captcha', 'captcha-delivery.com', 'checking your browser before accessing',
+)
+
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title', re.IGNORECASE | re.DOTALL)
+META_IMAGE_PATTERN = re.compile(r'<meta\b[^>]*(?:og:image|twitter:image)', re.IGNORECASE)
+IMG_TAG_PATTERN = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+IMG_SRC_PATTERN = re.compile(r'\s(src|data-src|data-lazy-src)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+NON_TEXT_PATTERN = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]*>')
+PLACEHOLDER_IMAGE_PATTERN = re.compile(
+    r'^data:|blank\.(gif|png)|spacer\.gif|transparent\.(gif|png)|pixel\.gif|placeholder|loading\.(gif|svg)|1x1\.',
+    re.IGNORECASE
+)
+
+def _visible_text_length(html_content):
+    text = TAG_PATTERN.sub(' ', NON_TEXT_PATTERN.sub(' ', html_content))
+    return len(' '.join(text.split()))
+
+def classify_page(html_content):
+    """
+    Cheap regex look at a fetched page: 'challenge' for bot-check
+    interstitials, 'placeholder_images' when every <img> still shows a
+    lazy-load placeholder, 'spa_shell' for a near-empty page with no
+    image waiting for JavaScript, else 'ok'. Anything but 'ok' means
+    the browser should render it. A challenge needs a body marker plus
+    either a challenge title or little visible text; neither a title
+    like 'Access denied' nor a marker alone is enough.
+    """
+    lowered = html_content.lower()
+    if any(marker in lowered for marker in CHALLENGE_MARKERS):
+        title_match = TITLE_PATTERN.search(html_content)
+        title = ' '.join(title_match.group(1).split()).lower() if title_match else ''
+        if (any(marker in title for marker in CHALLENGE_TITLES)
+                or _visible_text_length(html_content) < CONTENT_CLASSIFIER_CONFIG['challenge_max_text_chars']):
+            return 'challenge'
+
+    # A declared metadata image needs no rendering
+    if META_IMAGE_PATTERN.search(html_content):
+        return 'ok'
+    sources = []
+    for img_tag in IMG_TAG_PATTERN.findall(html_content):
+        attrs = {name.lower(): ''.join(values).strip() for name, *values in IMG_SRC_PATTERN.findall(img_tag)}
+        sources.append(_image_src(attrs))
+    if any(src and not PLACEHOLDER_IMAGE_PATTERN.search(src) for src in sources):
+        return 'ok'
+    if sources:
+        return 'placeholder_images'
+    if _visible_text_length(html_content) < CONTENT_CLASSIFIER_CONFIG['min_text_chars']:
+        return 'spa_shell'
+    return 'ok'
+
+# Per-domain fetch mode: 'http' until pages keep needing the browser
+FETCH_MODE_CONFIG = {
+    'enabled': True,
+    'browser_after': 2,               # pages in a row that needed the browser before skipping httpx
+    'recheck_after': 7 * 24 * 3600,   # retry plain httpx for a browser domain after this long
+}
+
+class FetchModes:
+    """
+    domain -> cheapest fetch mode known to work ('http' or 'browser').
+    A domain switches to 'browser' after browser_after pages in a row
+    where httpx failed or returned a page classify_page() rejected but
+    Selenium succeeded. It goes back to 'http' when the browser fails, or
+    for one recheck every recheck_after seconds, and stays there if that
+    page comes back usable. Stored in the shared SQLite store behind a
+    memory dict.
+    """
+
+    def __init__(self, store=None, config=None):
+        self.store = store or CACHE_STORE
+        self.config = config if config is not None else FETCH_MODE_CONFIG
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.store.ensure_table(
+                'CREATE TABLE IF NOT EXISTS fetch_modes ('
+                'domain TEXT PRIMARY KEY, mode TEXT, streak INTEGER, updated_at REAL)'
+            )
+            self._table_ready = True
+
+    def _load(self, domain):
+        with self._lock:
+            if domain in self._memory:
+                return self._memory[domain]
+        self._ensure_table()
+        rows = self.store.execute('SELECT mode, streak, updated_at FROM fetch_modes WHERE domain = ?', (domain,))
+        entry = {'mode': rows[0][0], 'streak': rows[0][1], 'updated_at': rows[0][2]} if rows else None
+        with self._lock:
+            self._memory[domain] = entry
+        return entry
+
+    def _save(self, domain, mode, streak):
+        entry = {'mode': mode, 'streak': streak, 'updated_at': time.time()}
+        with self._lock:
+            self._memory[domain] = entry
+        self._ensure_table()
+        self.store.execute(
+            'INSERT OR REPLACE INTO fetch_modes (domain, mode, streak, updated_at) VALUES (?, ?, ?, ?)',
+            (domain, mode, streak, entry['updated_at'])
+        )
+
+    def get(self, domain):
+        if not self.config['enabled'] or not domain:
+            return 'http'
+        entry = self._load(domain)
+        if entry is None or entry['mode'] != 'browser':
+            return 'http'
+        if time.time() - entry['updated_at'] > self.config['recheck_after']:
+            logger.info("  Rechecking plain HTTP for %s", domain)
+            self._save(domain, 'http', self.config['browser_after'] - 1)
+            return 'http'
+        return 'browser'
+
+    def http_worked(self, domain):
+        if not self.config['enabled'] or not domain:
+            return
+        entry = self._load(domain)
+        if entry is None or entry['mode'] != 'http' or entry['streak']:
+            self._save(domain, 'http', 0)
+
+    def browser_needed(self, domain):
+        """httpx wasn't enough for this page but the browser was."""
+        if not self.config['enabled'] or not domain:
+            return
+        entry = self._load(domain)
+        streak = (entry['streak'] if entry else 0) + 1
+        if streak >= self.config['browser_after']:
+            logger.info("  %s needs the browser, skipping plain HTTP from now on", domain)
+            count('fetch_mode_switches', mode='browser')
+            self._save(domain, 'browser', 0)
+        else:
+            self._save(domain, 'http', streak)
+
+    def browser_failed(self, domain):
+        if not self.config['enabled'] or not domain:
+            return
+        entry = self._load(domain)
+        if entry is not None and entry['mode'] == 'browser':
+            count('fetch_mode_switches', mode='http')
+            self._save(domain, 'http', 0)
+
+    def list(self):
+        self._ensure_table()
+        return [
+            {'domain': row[0], 'mode': row[1], 'streak': row[2], 'updated_at': row[3]}
+            for row in self.store.execute('SELECT domain, mode, streak, updated_at FROM fetch_modes ORDER BY domain')
+        ]
+
+FETCH_MODES = FetchModes()
+
+# Browser sessions: cookies (and the user agent they belong to) captured
+# from Selenium page loads, shared with every httpx client
+BROWSER_SESSION_CONFIG = {
+    'enabled': True,
+    'max_age': 12 * 3600,             # drop a domain's session this long after capture
+}
+
+def _session_domain(domain):
+    """Session key for a cookie domain or host: no leading dot, no www."""
+    domain = domain.lstrip('.').lower()
+    return domain[4:] if domain.startswith('www.') else domain
+
+def browser_cookies(driver):
+    """
+    All cookies in the browser via CDP (so CDN cookies set by subresources
+    are included), else the current document's cookies. Normalised to
+    {name, value, domain, path, secure, expires} with expires None for
+    session cookies.
+    """
+    try:
+        raw = driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+    except (AttributeError, KeyError, TypeError, WebDriverException):
+        try:
+            raw = driver.get_cookies()
+        except WebDriverException:
+            return []
+    cookies = []
+    for cookie in raw:
+        expires = cookie.get('expiry', cookie.get('expires'))
+        if cookie.get('session') or not isinstance(expires, (int, float)) or expires <= 0:
+            expires = None
+        cookies.append({
+            'name': cookie['name'],
+            'value': cookie['value'],
+            'domain': cookie.get('domain') or '',
+            'path': cookie.get('path') or '/',
+            'secure': bool(cookie.get('secure')),
+            'expires': int(expires) if expires else None,
+        })
+    return [cookie for cookie in cookies if cookie['domain']]
+
+class BrowserSessions:
+    """
+    domain -> cookies and user agent from the last browser visit, so
+    plain httpx can reuse what a Selenium page load earned (consent,
+    bot-check clearance, CDN tokens) instead of launching the browser
+    again. The cookies live in one CookieJar shared by the sync and async
+    clients; requests to a domain with a session also send the browser's
+    User-Agent. A session is dropped after max_age or as soon as a request
+    carrying its cookies is answered with a blocked status. Persisted in
+    the shared SQLite store.
+    """
+
+    def __init__(self, store=None, config=None):
+        self.store = store or CACHE_STORE
+        self.config = config if config is not None else BROWSER_SESSION_CONFIG
+        self._sessions = None
+        self._jar = http.cookiejar.CookieJar()
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.store.ensure_table(
+                'CREATE TABLE IF NOT EXISTS browser_sessions ('
+                'domain TEXT PRIMARY KEY, cookies TEXT, user_agent TEXT, captured_at REAL)'
+            )
+            self._table_ready = True
+
+    def _loaded(self):
+        """Sessions dict, filled from the store (and the jar with it) on first use."""
+        if self._sessions is None:
+            self._ensure_table()
+            rows = self.store.execute('SELECT domain, cookies, user_agent, captured_at FROM browser_sessions '
+                                      'WHERE captured_at > ?', (time.time() - self.config['max_age'],))
+            with self._lock:
+                if self._sessions is None:
+                    self._sessions = {}
+                    for domain, cookies, user_agent, captured_at in rows:
+                        self._install(domain, json.loads(cookies), user_agent, captured_at)
+        return self._sessions
+
+    def _install(self, domain, cookies, user_agent, captured_at):
+        self._sessions[domain] = {'cookies': cookies, 'user_agent': user_agent, 'captured_at': captured_at}
+        for cookie in cookies:
+            cookie_domain = cookie['domain']
+            self._jar.set_cookie(http.cookiejar.Cookie(
+                version=0, name=cookie['name'], value=cookie['value'], port=None, port_specified=False,
+                domain=cookie_domain, domain_specified=cookie_domain.startswith('.'),
+                domain_initial_dot=cookie_domain.startswith('.'), path=cookie['path'], path_specified=True,
+                secure=cookie['secure'], discard=False, comment=None, comment_url=None, rest={},
+                # Browser session cookies get the session's lifetime
+                expires=cookie['expires'] or int(captured_at + self.config['max_age']),
+            ))
+
+    def _clear_jar(self, domain):
+        for cookie in list(self._jar):
+            if _session_domain(cookie.domain) == domain:
+                self._jar.clear(cookie.domain, cookie.path, cookie.name)
+
+    @property
+    def jar(self):
+        """CookieJar to hand to httpx clients."""
+        self._loaded()
+        return self._jar
+
+    def capture(self, driver):
+        """Store the driver's cookies, per domain, with its user agent."""
+        if not self.config['enabled']:
+            return
+        cookies = browser_cookies(driver)
+        if not cookies:
+            return
+        try:
+            user_agent = driver.execute_script('return navigator.userAgent;')
+        except WebDriverException:
+            user_agent = None
+        grouped = defaultdict(list)
+        for cookie in cookies:
+            grouped[_session_domain(cookie['domain'])].append(cookie)
+
+        sessions = self._loaded()
+        now = time.time()
+        changed = []
+        with self._lock:
+            for domain, group in grouped.items():
+                previous = sessions.get(domain)
+                values = sorted((cookie['name'], cookie['domain'], cookie['value']) for cookie in group)
+                if previous and sorted((c['name'], c['domain'], c['value']) for c in previous['cookies']) == values:
+                    continue  # unchanged since the last capture (e.g. a second page on the domain)
+                self._clear_jar(domain)
+                self._install(domain, group, user_agent, now)
+                changed.append((domain, json.dumps(group), user_agent, now))
+        if changed:
+            logger.debug("  Captured browser cookies for %s", ', '.join(row[0] for row in changed))
+            count('browser_sessions', len(changed), event='captured')
+            self._ensure_table()
+            for row in changed:
+                self.store.execute('INSERT OR REPLACE INTO browser_sessions (domain, cookies, user_agent, captured_at) '
+                                   'VALUES (?, ?, ?, ?)', row)
+
+    def lookup(self, host):
+        """(domain, session) for host or its closest parent domain with a live session, else (None, None)."""
+        if not self.config['enabled'] or not host:
+            return None, None
+        sessions = self._loaded()
+        labels = _session_domain(host).split('.')
+        for start in range(len(labels) - 1):
+            domain = '.'.join(labels[start:])
+            session = sessions.get(domain)
+            if session is None:
+                continue
+            if time.time() - session['captured_at'] > self.config['max_age']:
+                count('browser_sessions', event='expired')
+                self.forget(domain)
+                continue
+            return domain, session
+        return None, None
+
+    def rejected(self, host):
+        """A request carrying session cookies for host was blocked: drop that session."""
+        domain, session = self.lookup(host)
+        if session is not None:
+            logger.info("  Browser cookies for %s stopped working, dropping them", domain)
+            count('browser_sessions', event='invalidated')
+            self.forget(domain)
+
+    def forget(self, domain=None):
+        sessions = self._loaded()
+        with self._lock:
+            for key in [domain] if domain else list(sessions):
+                sessions.pop(key, None)
+                self._clear_jar(key)
+        self._ensure_table()
+        if domain:
+            self.store.execute('DELETE FROM browser_sessions WHERE domain = ?', (domain,))
+        else:
+            self.store.execute('DELETE FROM browser_sessions')
+
+    def list(self):
+        return sorted(
+            ({'domain': domain, 'cookies': len(session['cookies']), 'user_agent': session['user_agent'],
+              'captured_at': session['captured_at']} for domain, session in self._loaded().items()),
+            key=lambda entry: entry['domain']
+        )
+
+BROWSER_SESSIONS = BrowserSessions()
+
+def _apply_browser_session(request):
+    # The browser's cookies are only honoured together with its user agent
+    _, session = BROWSER_SESSIONS.lookup(request.url.host)
+    if session is not None and session['user_agent']:
+        request.headers['User-Agent'] = session['user_agent']
+
+def _check_browser_session(response):
+    if response.status_code in BLOCKED_STATUS_CODES and 'cookie' in response.request.headers:
+        BROWSER_SESSIONS.rejected(response.request.url.host)
+
+async def _apply_browser_session_async(request):
+    _apply_browser_session(request)
+
+async def _check_browser_session_async(response):
+    _check_browser_session(response)
+
+def usable_http_page(url, html_content):
+    """classify_page() verdict as a bool, logging and counting rejections."""
+    if not CONTENT_CLASSIFIER_CONFIG['enabled']:
+        return True
+    verdict = classify_page(html_content)
+    if verdict == 'ok':
+        return True
+    logger.info("  HTTP response for %s looks like %s, escalating to the browser", url, verdict)
+    count('escalations', reason=verdict)
+    return False
+
+# Status codes that mean "blocked", not "missing": the browser may get through
+BLOCKED_STATUS_CODES = (401, 403, 429, 503)
+
+def escalated_page(url, domain, html_content, learn=True):
+    """
+    Cache a browser fetch that followed a failed or rejected httpx one;
+    with `learn`, a success counts towards switching the domain to the browser.
+    """
+    if html_content and learn:
+        FETCH_MODES.browser_needed(domain)
+    return _cache_selenium_page(url, html_content)
+
+PAGE_FLIGHTS = SingleFlight('page')
+ASYNC_PAGE_FLIGHTS = AsyncSingleFlight('page')
+
+def get_page_content(url):
+    """
+    Fetch the page at the canonical form of url (see normalize_url).
+    Concurrent requests for the same page share one fetch.
+    """
+    url = normalize_url(url)
+    return PAGE_FLIGHTS.do(url, _fetch_page, url)[0]
+
+def _fetch_page(url):
+    cached, body = _cached_page(url)
+    if body is not None:
+        return body
+    if PAGE_CACHE_CONFIG['offline']:
+        logger.warning("  ✗ Offline mode and page not cached: %s", url)
+        return None
+
+    domain = rule_domain(url)
+    if FETCH_MODES.get(domain) == 'browser':
+        html_content = selenium_fallback(url)
+        if html_content:
+            return _cache_selenium_page(url, html_content)
+        FETCH_MODES.browser_failed(domain)
+
+    try:
+        with timed('fetch'):
+            HOST_SCHEDULER.wait(url)
+            # Shared client already carries browser-like default headers
+            with get_http_client().stream(
+                'GET', url, headers=PAGE_CACHE.conditional_headers(cached), timeout=HTTP_CLIENT_CONFIG['page_timeout']
+            ) as response:
+                if response.status_code == 304 and cached:
+                    count('cache_hits', cache='page_revalidated')
+                    PAGE_CACHE.revalidated(url)
+                    return cached['body']
+                response.raise_for_status()
+                reader = PageReader(url, response)
+                for chunk in response.iter_bytes():
+                    if not reader.feed(chunk):
+                        break
+        page = reader.page()
+        if usable_http_page(url, page):
+            # Only accepted bodies are cached: a stored interstitial would be
+            # served fresh (and revalidated) without ever escalating again
+            PAGE_CACHE.put_response(url, response, page)
+            FETCH_MODES.http_worked(domain)
+            return page
+        return escalated_page(url, domain, selenium_fallback(url)) or page
+    except httpx.RequestError as e:
+        logger.warning("Request error for %s: %s", url, e)
+        return escalated_page(url, domain, selenium_fallback(url))
+    except httpx.HTTPStatusError as e:
+        logger.warning("HTTP status error for %s: %s", url, e)
+        blocked = e.response.status_code in BLOCKED_STATUS_CODES
+        return escalated_page(url, domain, selenium_fallback(url), learn=blocked)
+
+async def get_page_content_async(client, url):
+    """
+    Async counterpart of get_page_content built on a shared httpx.AsyncClient.
+    The Selenium fallback is blocking, so it runs in a worker thread.
+    """
+    url = normalize_url(url)
+    return await ASYNC_PAGE_FLIGHTS.do(url, _fetch_page_async, client, url)
+
+async def _fetch_page_async(client, url):
+    cached, body = _cached_page(url)
+    if body is not None:
+        return body
+    if PAGE_CACHE_CONFIG['offline']:
+        logger.warning("  ✗ Offline mode and page not cached: %s", url)
+        return None
+
+    loop = asyncio.get_running_loop()
+    domain = rule_domain(url)
+    if FETCH_MODES.get(domain) == 'browser':
+        html_content = await loop.run_in_executor(None, in_context(selenium_fallback, url))
+        if html_content:
+            return _cache_selenium_page(url, html_content)
+        FETCH_MODES.browser_failed(domain)
+
+    page, learn = None, True
+    try:
+        with timed('fetch'):
+            await HOST_SCHEDULER.wait_async(url)
+            async with client.stream(
+                'GET', url, headers=PAGE_CACHE.conditional_headers(cached), timeout=HTTP_CLIENT_CONFIG['page_timeout']
+            ) as response:
+                if response.status_code == 304 and cached:
+                    count('cache_hits', cache='page_revalidated')
+                    PAGE_CACHE.revalidated(url)
+                    return cached['body']
+                response.raise_for_status()
+                reader = PageReader(url, response)
+                async for chunk in response.aiter_bytes():
+                    if not reader.feed(chunk):
+                        break
+        page = reader.page()
+        if usable_http_page(url, page):
+            # Only accepted bodies are cached: a stored interstitial would be
+            # served fresh (and revalidated) without ever escalating again
+            PAGE_CACHE.put_response(url, response, page)
+            FETCH_MODES.http_worked(domain)
+            return page
+    except httpx.RequestError as e:
+        logger.warning("Request error for %s: %s", url, e)
+    except httpx.HTTPStatusError as e:
+        logger.warning("HTTP status error for %s: %s", url, e)
+        learn = e.response.status_code in BLOCKED_STATUS_CODES
+    html_content = await loop.run_in_executor(None, in_context(selenium_fallback, url))
+    return escalated_page(url, domain, html_content, learn) or page
+
+# Header/nav selectors in priority order, shared by check_header_image and get_logo
+HEADER_SELECTORS = [
+    ('tag', 'header'),
+    ('tag', 'nav'),
+    ('class', 'header'),
+    ('id', 'header'),
+    ('class', 'navbar'),
+    ('id', 'navbar'),
+    ('class', 'nav'),
+    ('id', 'nav'),
+    ('class', 'site-header'),
+    ('id', 'site-header'),
+    ('class', 'main-header'),
+    ('id', 'main-header'),
+]
+
+LOGO_SELECTORS = HEADER_SELECTORS + [
+    ('class', 'logo'),
+    ('id', 'logo'),
+    ('class', 'site-logo'),
+    ('id', 'site-logo'),
+    ('class', 'brand'),
+    ('id', 'brand'),
+    ('class', 'branding'),
+    ('id', 'branding'),
+]
+
+INDEXED_CONTAINER_TAGS = ('header', 'nav', 'figure', 'div')
+
+def _class_list(attrs):
+    classes = attrs.get('class') or []  # None for a valueless attribute under selectolax
+    if isinstance(classes, str):
+        return classes.split()
+    return [str(cls) for cls in classes]
+
+IMAGE_SRC_ATTRIBUTES = ('src', 'data-src', 'data-lazy-src')
+
+def _image_src(attrs):
+    return attrs.get('src') or attrs.get('data-src') or attrs.get('data-lazy-src')
+
+def _image_src_attribute(attrs):
+    """Which of IMAGE_SRC_ATTRIBUTES _image_src() took the URL from."""
+    return next((name for name in IMAGE_SRC_ATTRIBUTES if attrs.get(name)), None)
+
+class ImageCandidate:
+    """An <img> in document order with precomputed ancestor flags."""
+
+    __slots__ = ('node', 'attrs', 'src', 'order', 'parent_attrs', 'ancestors',
+                 'in_header', 'in_figure', 'in_ad', 'in_logo')
+
+    def __init__(self, node, attrs, order, parent_attrs, flags, ancestors=()):
+        self.node = node
+        self.attrs = attrs
+        self.src = _image_src(attrs)
+        self.order = order
+        self.parent_attrs = parent_attrs
+        self.ancestors = ancestors    # indexed elements containing it, outermost first
+        self.in_header, self.in_figure, self.in_ad, self.in_logo = flags
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    def __repr__(self):
+        return f"<img src={self.src!r} order={self.order}>"
+
+class SvgCandidate:
+    """An <svg> with its first <image> and <use> descendants."""
+
+    __slots__ = ('node', 'order', 'image_attrs', 'use_attrs')
+
+    def __init__(self, node, order):
+        self.node = node
+        self.order = order
+        self.image_attrs = None
+        self.use_attrs = None
+
+class IndexedElement:
+    """
+    An element the extractors care about (header/nav/figure/div or a
+    header/logo selector match) with the images and svgs inside it.
+    """
+
+    __slots__ = ('node', 'name', 'attrs', 'order', 'images', 'svgs', '_is_ad')
+
+    def __init__(self, node, name, attrs, order):
+        self.node = node
+        self.name = name
+        self.attrs = attrs
+        self.order = order
+        self.images = []
+        self.svgs = []
+        self._is_ad = None
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    @property
+    def is_ad(self):
+        if self._is_ad is None:
+            self._is_ad = is_ad_div(self)
+        return self._is_ad
+
+class DomIndex:
+    """
+    Compact view of one page built in a single traversal. The extractors
+    query these lists instead of re-walking the tree; every list is in
+    document order unless noted.
+
+    images         all <img> candidates
+    containers     {'header'|'nav'|'figure'|'div': [IndexedElement]}
+    header_elements  check_header_image order (selector priority, deduplicated)
+    logo_elements    get_logo order (selectors, then class*=logo, then id*=logo/brand)
+    head_links     <link> tags inside the first <head>
+    metas          attrs of every <meta> tag
+    json_ld        text of every <script type="application/ld+json">
+    partial        {'reason', 'bytes_read'} when built from a PartialPage
+    """
+
+    def __init__(self):
+        self.images = []
+        self.svgs = []
+        self.containers = {tag: [] for tag in INDEXED_CONTAINER_TAGS}
+        self.header_elements = []
+        self.logo_elements = []
+        self.head_links = []
+        self.metas = []
+        self.json_ld = []
+        self.json_ld_objects = None    # parsed on first use, see json_ld_objects()
+        self.partial = None
+        self.probe_budget = ProbeBudget()
+
+def _selector_matches(name, attrs, classes):
+    element_id = attrs.get('id')
+    matches = []
+    for position, (kind, value) in enumerate(LOGO_SELECTORS):
+        if kind == 'tag':
+            if name == value:
+                matches.append(position)
+        elif kind == 'class':
+            if value in classes:
+                matches.append(position)
+        elif element_id == value:
+            matches.append(position)
+    return matches
+
+def _dedupe(elements):
+    seen = set()
+    ordered = []
+    for element in elements:
+        if id(element) not in seen:
+            seen.add(id(element))
+            ordered.append(element)
+    return ordered
+
+def _bs4_elements(soup):
+    for order, node in enumerate(soup.descendants):
+        if isinstance(node, Tag):
+            yield node, id(node), id(node.parent), node.name, node.attrs, order
+
+def _lexbor_elements(tree):
+    for order, node in enumerate(tree.root.traverse(include_text=False)):
+        parent = node.parent
+        attrs = node.attributes
+        if None in attrs.values():
+            # Valueless attributes (<div class>, <img alt>) are None here but '' under bs4
+            attrs = {name: '' if value is None else value for name, value in attrs.items()}
+        yield node, node.mem_id, parent.mem_id if parent is not None else None, node.tag, attrs, order
+
+def _node_text(node):
+    return node.get_text() if isinstance(node, Tag) else node.text()
+
+def build_dom_index(soup):
+    """Walk a BeautifulSoup tree once and build its DomIndex."""
+    return index_elements(_bs4_elements(soup))
+
+def index_elements(elements):
+    """
+    Build a DomIndex from (node, key, parent_key, name, attrs, order)
+    tuples in document order. Parser backends only have to provide this
+    stream; keys identify nodes so children can find their parent's context.
+
+    Each element inherits a context from its parent: the tuple of indexed
+    ancestors, the enclosing <svg>s, and the header/figure/ad/logo flags.
+    Images and svgs are appended to every indexed ancestor, which replaces
+    the per-container find_all('img') calls.
+    """
+    index = DomIndex()
+    by_selector = [[] for _ in LOGO_SELECTORS]
+    logo_class_elements = []
+    logo_id_elements = []
+    first_head = None
+
+    # key -> (indexed ancestors, svg ancestors, in_header, in_figure, in_ad, in_logo, in_head, attrs)
+    root_context = ((), (), False, False, False, False, False, {})
+    contexts = {}
+
+    for node, key, parent_key, name, attrs, order in elements:
+        parent_context = contexts.get(parent_key, root_context)
+        ancestors, svgs, in_header, in_figure, in_ad, in_logo, in_head, parent_attrs = parent_context
+        if name == 'head' and first_head is None:
+            first_head = key
+
+        if name == 'img':
+            candidate = ImageCandidate(node, attrs, order, parent_attrs, (in_header, in_figure, in_ad, in_logo), ancestors)
+            index.images.append(candidate)
+            for element in ancestors:
+                element.images.append(candidate)
+        elif name in ('image', 'use'):
+            slot = 'image_attrs' if name == 'image' else 'use_attrs'
+            for svg in svgs:
+                if getattr(svg, slot) is None:
+                    setattr(svg, slot, attrs)
+        elif name == 'link':
+            if in_head:
+                index.head_links.append(attrs)
+        elif name == 'meta':
+            index.metas.append(attrs)
+        elif name == 'script' and str(attrs.get('type') or '').strip().lower() == 'application/ld+json':
+            index.json_ld.append(_node_text(node))
+
+        classes = _class_list(attrs) if 'class' in attrs else []
+        matches = _selector_matches(name, attrs, classes) if (classes or 'id' in attrs or name in ('header', 'nav')) else []
+        has_logo_class = any('logo' in cls.lower() for cls in classes)
+        element_id = str(attrs.get('id') or '').lower()
+        has_logo_id = 'logo' in element_id or 'brand' in element_id
+
+        element = None
+        if matches or has_logo_class or has_logo_id or name in INDEXED_CONTAINER_TAGS:
+            element = IndexedElement(node, name, attrs, order)
+            for position in matches:
+                by_selector[position].append(element)
+            if has_logo_class:
+                logo_class_elements.append(element)
+            if has_logo_id:
+                logo_id_elements.append(element)
+            if name in index.containers:
+                index.containers[name].append(element)
+
+        if name == 'svg':
+            svg = SvgCandidate(node, order)
+            index.svgs.append(svg)
+            for ancestor in ancestors:
+                ancestor.svgs.append(svg)
+            svgs = svgs + (svg,)
+
+        if element is not None:
+            ancestors = ancestors + (element,)
+            in_header = in_header or any(position < len(HEADER_SELECTORS) for position in matches)
+            in_figure = in_figure or name == 'figure'
+            in_ad = in_ad or (name in ('div', 'figure') and element.is_ad)
+            in_logo = in_logo or has_logo_class or has_logo_id
+        contexts[key] = (ancestors, svgs, in_header, in_figure, in_ad, in_logo, in_head or key == first_head, attrs)
+
+    index.header_elements = _dedupe(
+        element for position in range(len(HEADER_SELECTORS)) for element in by_selector[position]
+    )
+    index.logo_elements = _dedupe(
+        [element for position in range(len(LOGO_SELECTORS)) for element in by_selector[position]]
+        + logo_class_elements + logo_id_elements
+    )
+    return index
+
+def get_dom_index(soup):
+    """Return the DomIndex for soup, building it on first use."""
+    if soup is None or isinstance(soup, DomIndex):
+        return soup
+    # Read/write the instance dict directly: bs4 turns unknown attribute
+    # lookups into find() calls
+    index = vars(soup).get('_dom_index')
+    if index is None:
+        index = build_dom_index(soup)
+        vars(soup)['_dom_index'] = index
+    return index
+
+def _rel_matches(rel, rel_type):
+    # Same test bs4 applied for rel=lambda: each token, then the joined value
+    if not rel:
+        return False
+    values = [str(value) for value in rel] if isinstance(rel, list) else [str(rel)]
+    return any(rel_type in value.lower() for value in values) or rel_type in ' '.join(values).lower()
+
+# Default favicon cache: whether each origin serves /favicon.ico, shared across pages and runs
+FAVICON_CACHE_CONFIG = {
+    'enabled': True,
+    'ttl': 7 * 24 * 3600,             # /favicon.ico exists
+    'failure_ttl': 24 * 3600,         # it doesn't; checked again sooner
+    'validate_default': True,         # check /favicon.ico exists before returning it
+}
+
+def url_origin(url):
+    parsed = urlsplit(normalize_url(url))
+    return parsed.scheme + '://' + parsed.netloc
+
+class FaviconCache:
+    """
+    Origin -> its validated /favicon.ico URL, or None when it has none.
+    Memory dict in front of the SQLite store; entries expire after their TTL.
+    """
+
+    def __init__(self, store=None, config=None):
+        self.store = store or CACHE_STORE
+        self.config = config if config is not None else FAVICON_CACHE_CONFIG
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.store.ensure_table(
+                'CREATE TABLE IF NOT EXISTS favicon_cache ('
+                'origin TEXT PRIMARY KEY, favicon TEXT, expires_at REAL)'
+            )
+            self._table_ready = True
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, origin):
+        """The cached entry {'favicon': url or None}, or None on a miss."""
+        if not self.config['enabled']:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(origin)
+        if entry is not None and entry['expires_at'] > now:
+            self._count('memory_hits')
+            return entry
+        self._ensure_table()
+        rows = self.store.execute(
+            'SELECT favicon, expires_at FROM favicon_cache WHERE origin = ? AND expires_at > ?', (origin, now)
+        )
+        if not rows:
+            self._count('misses')
+            return None
+        entry = {'favicon': rows[0][0], 'expires_at': rows[0][1]}
+        with self._lock:
+            self._memory[origin] = entry
+        self._count('disk_hits')
+        return entry
+
+    def put(self, origin, favicon):
+        if not self.config['enabled']:
+            return
+        ttl = self.config['ttl'] if favicon else self.config['failure_ttl']
+        entry = {'favicon': favicon, 'expires_at': time.time() + ttl}
+        with self._lock:
+            self._memory[origin] = entry
+        self._ensure_table()
+        self.store.execute(
+            'INSERT OR REPLACE INTO favicon_cache (origin, favicon, expires_at) VALUES (?, ?, ?)',
+            (origin, favicon, entry['expires_at'])
+        )
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+FAVICON_CACHE = FaviconCache()
+FAVICON_FLIGHTS = SingleFlight('favicon')
+
+def favicon_exists(favicon_url):
+    """
+    Cheap existence check: HEAD, or a one-byte ranged GET when the server
+    refuses HEAD. True for an image answer, False only for definitive
+    misses (404/410, or an HTML soft 404 page), None when the check
+    proved nothing (transport error, 5xx, rate limiting, ...).
+    """
+    client = get_http_client()
+    headers = image_request_headers(favicon_url)
+    timeout = HTTP_CLIENT_CONFIG['image_timeout']
+    try:
+        HOST_SCHEDULER.wait(favicon_url)
+        response = client.head(favicon_url, headers=headers, timeout=timeout)
+        if response.status_code in (403, 405, 501):
+            with client.stream('GET', favicon_url, headers=dict(headers, Range='bytes=0-0'), timeout=timeout) as response:
+                pass  # status and headers are all we need; closing skips the body
+    except httpx.HTTPError:
+        return None
+    if response.status_code in (404, 410):
+        return False
+    if response.status_code not in (200, 206):
+        return None
+    return 'html' not in response.headers.get('Content-Type', '').lower()
+
+def _favicon_sizes_score(sizes):
+    # Largest declared edge; 'any' (scalable) beats every fixed size
+    best = 0
+    for size in str(sizes or '').lower().split():
+        if size == 'any':
+            return float('inf')
+        width, _, height = size.partition('x')
+        if width.isdigit() and height.isdigit():
+            best = max(best, int(width), int(height))
+    return best
+
+def declared_favicon(url, soup):
+    """
+    Network-free half of get_favicon: the best <link> icon in one pass
+    over the head links. Icons rank by rel type, then by declared sizes
+    (largest first), then document order. None when the page declares none.
+    """
+    if not soup:
+        return None
+    index = get_dom_index(soup)
+    
+    # Priority order for favicon rel attributes
+    favicon_rel_types = [
+        'icon',
+        'shortcut icon',
+        'apple-touch-icon',
+        'apple-touch-icon-precomposed',
+        'mask-icon',
+        'fluid-icon'
+    ]
+    
+    best_key, best_url = None, None
+    for order, link_attrs in enumerate(index.head_links):
+        href = link_attrs.get('href')
+        if not href:
+            continue
+        priority = next(
+            (rank for rank, rel_type in enumerate(favicon_rel_types) if _rel_matches(link_attrs.get('rel'), rel_type)),
+            None
+        )
+        if priority is None:
+            continue
+        favicon_url = urljoin(url, href)
+        # Skip data URLs
+        if favicon_url.startswith('data:'):
+            continue
+        key = (priority, -_favicon_sizes_score(link_attrs.get('sizes')), order)
+        if best_key is None or key < best_key:
+            best_key, best_url = key, favicon_url
+    if best_url:
+        logger.debug("  ✓ Found favicon via link tag (rel=%s): %s", favicon_rel_types[best_key[0]], best_url)
+    return best_url
+
+def resolve_favicon(url, declared):
+    """
+    I/O half of get_favicon: the page's declared icon if it has one,
+    otherwise /favicon.ico if it exists. That check is cached per origin,
+    so each origin costs at most one lookup across pages and runs.
+    """
+    if declared:
+        return declared
+    origin = url_origin(url)
+    cached = FAVICON_CACHE.get(origin)
+    if cached is not None:
+        count('cache_hits', cache='favicon')
+        return cached['favicon']
+    return FAVICON_FLIGHTS.do(origin, _default_favicon, origin)[0]
+
+def _default_favicon(origin):
+    # Fallback: the common favicon path (/favicon.ico), if it exists
+    favicon_url = origin + '/favicon.ico'
+    if PAGE_CACHE_CONFIG['offline'] or not FAVICON_CACHE_CONFIG['validate_default']:
+        logger.debug("  ? Using default favicon path (not validated): %s", favicon_url)
+        return favicon_url
+    exists = favicon_exists(favicon_url)
+    if exists:
+        logger.debug("  ✓ Default favicon path exists: %s", favicon_url)
+        FAVICON_CACHE.put(origin, favicon_url)
+        return favicon_url
+    if exists is None:
+        # Transient failure: answer without a favicon now, ask again next time
+        logger.debug("  ? Could not check default favicon path: %s", favicon_url)
+        return None
+    logger.debug("  ✗ Default favicon path missing: %s", favicon_url)
+    FAVICON_CACHE.put(origin, None)
+    return None
+
+def get_favicon(url, soup):
+    """
+    Extract favicon URL from the page.
+    Checks link tags with various rel attributes and formats, falling
+    back to /favicon.ico when it exists (checked once per origin).
+    Returns the favicon URL or None if not found.
+    """
+    if not soup:
+        return None
+    return resolve_favicon(url, declared_favicon(url, soup))
+
+# Learned extraction rules: per domain, where the accepted image and logo
+# were found, tried first on the domain's next pages
+EXTRACTION_RULES_CONFIG = {
+    'enabled': True,
+    'max_misses': 3,                  # consecutive misses before a rule is dropped
+    'max_idle': 30 * 24 * 3600,       # rules not confirmed for this long expire
+}
+
+def rule_domain(url):
+    host = urlsplit(normalize_url(url)).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def element_signature(name, attrs):
+    """
+    tag#id.class.class for an element, leaving out id and class tokens
+    with digits (post-123, wp-image-456) so it matches across pages.
+    """
+    signature = name
+    element_id = str(attrs.get('id', '') or '')
+    if element_id and not any(ch.isdigit() for ch in element_id):
+        signature += '#' + element_id
+    for cls in sorted(set(_class_list(attrs))):
+        if not any(ch.isdigit() for ch in cls):
+            signature += '.' + cls
+    return signature
+
+class ExtractionRules:
+    """
+    (domain, kind) -> learned rule, kind being 'image' or 'logo'. A rule
+    is the source that produced the accepted result: for images the step
+    plus container signature and src attribute (see image_source), for
+    logos the get_logo method plus element signature and attribute.
+
+    A hit confirms the rule. A miss (the rule found nothing but the full
+    search did) counts against it, and max_misses in a row drop it so
+    the next page learns a new one. Rules idle for max_idle expire.
+    Stored in the shared SQLite store behind a memory dict.
+    """
+
+    def __init__(self, store=None, config=None):
+        self.store = store or CACHE_STORE
+        self.config = config if config is not None else EXTRACTION_RULES_CONFIG
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.counters = {'hit': 0, 'miss': 0, 'learned': 0, 'dropped': 0, 'expired': 0}
+
+    def _count(self, kind, outcome):
+        with self._lock:
+            self.counters[outcome] += 1
+        count('rules', kind=kind, outcome=outcome)
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            self.store.ensure_table(
+                'CREATE TABLE IF NOT EXISTS extraction_rules ('
+                'domain TEXT, kind TEXT, rule TEXT, hits INTEGER, misses INTEGER, '
+                'learned_at REAL, confirmed_at REAL, PRIMARY KEY (domain, kind))'
+            )
+            self._table_ready = True
+
+    def _load(self, domain, kind):
+        key = (domain, kind)
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+        self._ensure_table()
+        rows = self.store.execute(
+            'SELECT rule, hits, misses, learned_at, confirmed_at FROM extraction_rules WHERE domain = ? AND kind = ?',
+            key
+        )
+        entry = None
+        if rows:
+            rule, hits, misses, learned_at, confirmed_at = rows[0]
+            entry = {'rule': json.loads(rule), 'hits': hits, 'misses': misses,
+                     'learned_at': learned_at, 'confirmed_at': confirmed_at}
+        with self._lock:
+            self._memory[key] = entry
+        return entry
+
+    def _save(self, domain, kind, entry):
+        with self._lock:
+            self._memory[(domain, kind)] = entry
+        self._ensure_table()
+        if entry is None:
+            self.store.execute('DELETE FROM extraction_rules WHERE domain = ? AND kind = ?', (domain, kind))
+            return
+        self.store.execute(
+            'INSERT OR REPLACE INTO extraction_rules '
+            '(domain, kind, rule, hits, misses, learned_at, confirmed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (domain, kind, json.dumps(entry['rule'], sort_keys=True), entry['hits'], entry['misses'],
+             entry['learned_at'], entry['confirmed_at'])
+        )
+
+    def get(self, domain, kind):
+        """The rule to try first for this domain, or None."""
+        if not self.config['enabled'] or not domain:
+            return None
+        entry = self._load(domain, kind)
+        if entry is None:
+            return None
+        if time.time() - entry['confirmed_at'] > self.config['max_idle']:
+            self._save(domain, kind, None)
+            self._count(kind, 'expired')
+            return None
+        return entry['rule']
+
+    def record(self, domain, kind, rule, rule_hit, source):
+        """
+        Update after one page: `rule` is what get() returned, `rule_hit`
+        whether it produced the result, `source` where the result came
+        from (None when nothing was found).
+        """
+        if not self.config['enabled'] or not domain:
+            return
+        now = time.time()
+        entry = self._load(domain, kind)
+        if rule is not None and entry is not None and entry['rule'] == rule:
+            if rule_hit:
+                entry = dict(entry, hits=entry['hits'] + 1, misses=0, confirmed_at=now)
+                self._count(kind, 'hit')
+            elif source is not None:
+                entry = dict(entry, misses=entry['misses'] + 1)
+                self._count(kind, 'miss')
+                if entry['misses'] >= self.config['max_misses']:
+                    logger.info("  Dropping learned %s rule for %s: %s", kind, domain, entry['rule'])
+                    self._count(kind, 'dropped')
+                    entry = None
+            else:
+                return
+            self._save(domain, kind, entry)
+        elif entry is None and source is not None:
+            self._save(domain, kind, {'rule': source, 'hits': 0, 'misses': 0, 'learned_at': now, 'confirmed_at': now})
+            self._count(kind, 'learned')
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def forget(self, domain=None):
+        """Drop the rules of one domain, or all of them."""
+        self._ensure_table()
+        with self._lock:
+            self._memory.clear()
+        if domain is None:
+            self.store.execute('DELETE FROM extraction_rules')
+        else:
+            self.store.execute('DELETE FROM extraction_rules WHERE domain = ?', (domain,))
+
+    def list(self, domain=None):
+        """Stored rules with their hit/miss counts, for inspection."""
+        self._ensure_table()
+        sql = 'SELECT domain, kind, rule, hits, misses, learned_at, confirmed_at FROM extraction_rules'
+        params = ()
+        if domain is not None:
+            sql += ' WHERE domain = ?'
+            params = (domain,)
+        return [
+            {'domain': row[0], 'kind': row[1], 'rule': json.loads(row[2]), 'hits': row[3], 'misses': row[4],
+             'learned_at': row[5], 'confirmed_at': row[6]}
+            for row in self.store.execute(sql + ' ORDER BY domain, kind', params)
+        ]
+
+EXTRACTION_RULES = ExtractionRules()
+
+def _logo_methods(url, logo_element):
+    """
+    Logo URLs one logo element offers, in get_logo's order, as
+    (logo_url, method, attribute) tuples.
+    """
+    # Check if the element itself is an anchor tag with logo
+    if logo_element.name == 'a' and logo_element.images:
+        # Check for img inside anchor
+        img_src = logo_element.images[0].src
+        if img_src:
+            logo_url = urljoin(url, img_src)
+            if not logo_url.startswith('data:'):
+                yield logo_url, 'anchor_img', _image_src_attribute(logo_element.images[0].attrs)
+    
+    # Check for img tags (anywhere within logo element)
+    for img_tag in logo_element.images:
+        img_src = img_tag.src
+        if img_src:
+            logo_url = urljoin(url, img_src)
+            if not logo_url.startswith('data:'):
+                yield logo_url, 'img', _image_src_attribute(img_tag.attrs)
+    
+    # Check for SVG tags (inline or referenced)
+    for svg_tag in logo_element.svgs:
+        # Check for SVG with image inside, then SVG with use tag (referencing external SVG)
+        for method, svg_attrs in (('svg_image', svg_tag.image_attrs), ('svg_use', svg_tag.use_attrs)):
+            if svg_attrs is None:
+                continue
+            attribute = 'href' if svg_attrs.get('href') else 'xlink:href'
+            href = svg_attrs.get(attribute)
+            if href:
+                logo_url = urljoin(url, href)
+                if not logo_url.startswith('data:'):
+                    yield logo_url, method, attribute
+        
+        # Inline SVG without a reference needs special handling; skip
+    
+    # Check for background-image in style attribute
+    style = logo_element.get('style', '')
+    if style and 'background-image' in style:
+        # Extract URL from background-image: url(...)
+        bg_match = re.search(r'url\(["\']?([^"\']+)["\']?\)', style)
+        if bg_match:
+            logo_url = urljoin(url, bg_match.group(1))
+            if not logo_url.startswith('data:'):
+                yield logo_url, 'background', 'style'
+    
+    # Check for CSS class that might have background-image
+    # (This would require CSS parsing, skip for now)
+
+def _header_logo_images(url, header_element):
+    """Fallback: imgs in a header/nav whose own or parent attributes mention logo/brand."""
+    for img_tag in header_element.images:
+        # Check if img tag or parent has logo-related attributes
+        img_attrs = ' '.join([
+            ' '.join(_class_list(img_tag.attrs)),
+            str(img_tag.get('id') or ''),
+            str(img_tag.get('alt') or '')
+        ]).lower()
+        
+        parent_attrs = ' '.join([
+            ' '.join(_class_list(img_tag.parent_attrs)),
+            str(img_tag.parent_attrs.get('id') or '')
+        ]).lower()
+        img_attrs += ' ' + parent_attrs
+        
+        if 'logo' in img_attrs or 'brand' in img_attrs:
+            img_src = img_tag.src
+            if img_src:
+                logo_url = urljoin(url, img_src)
+                if not logo_url.startswith('data:'):
+                    yield logo_url, 'header_img', _image_src_attribute(img_tag.attrs)
+
+def _logo_sources(url, index):
+    """Every (logo_url, source) get_logo would consider, in priority order."""
+    # Check each logo element (header/nav/logo/brand selectors, then any
+    # class containing 'logo', then any id containing 'logo'/'brand')
+    for logo_element in index.logo_elements:
+        for logo_url, method, attribute in _logo_methods(url, logo_element):
+            yield logo_url, {'method': method, 'container': element_signature(logo_element.name, logo_element.attrs),
+                             'attribute': attribute}
+    
+    # Fallback: Check all img tags in header/nav areas more broadly
+    for header_element in index.containers['header'] + index.containers['nav']:
+        for logo_url, method, attribute in _header_logo_images(url, header_element):
+            yield logo_url, {'method': method, 'container': element_signature(header_element.name, header_element.attrs),
+                             'attribute': attribute}
+
+def find_logo(url, index, rule=None):
+    """
+    Network-free logo search: a JSON-LD logo, the learned `rule`, then
+    the full get_logo order. Returns (logo_url, source, rule_hit), where
+    source is the rule that would find logo_url again (None for JSON-LD).
+    """
+    logo_url = json_ld_logo(url, index)
+    if logo_url:
+        return logo_url, None, False
+    if rule:
+        header_img = rule['method'] == 'header_img'
+        elements = index.containers['header'] + index.containers['nav'] if header_img else index.logo_elements
+        methods = _header_logo_images if header_img else _logo_methods
+        for element in elements:
+            if element_signature(element.name, element.attrs) != rule['container']:
+                continue
+            for logo_url, method, attribute in methods(url, element):
+                if method == rule['method'] and attribute == rule['attribute']:
+                    return logo_url, rule, True
+    for logo_url, source in _logo_sources(url, index):
+        return logo_url, source, False
+    return None, None, False
+
+def get_logo(url, soup):
+    """
+    Extract logo URL from the page.
+    Checks JSON-LD logo/publisher.logo, then header/nav areas and
+    elements with 'logo' in class/id attributes, trying the domain's
+    learned rule before the full search.
+    Returns the logo URL or None if not found.
+    """
+    if not soup:
+        return None
+    domain = rule_domain(url)
+    rule = EXTRACTION_RULES.get(domain, 'logo')
+    index = get_dom_index(soup)
+    logo_url, source, rule_hit = find_logo(url, index, rule)
+    if index.partial is None:  # a truncated document proves nothing about the rule
+        EXTRACTION_RULES.record(domain, 'logo', rule, rule_hit, source)
+    if logo_url:
+        method = source['method'] if source else 'json_ld'
+        logger.debug("  ✓ Found logo via %s (%s): %s", method, 'learned rule' if rule_hit else 'search', logo_url)
+    else:
+        logger.debug("  ✗ No logo found")
+    return logo_url
+
+# Speculative probing: while the serial order waits on one check_size,
+# the next `lookahead` undecided candidates are already being probed
+SPECULATIVE_PROBE_CONFIG = {
+    'enabled': True,
+    'lookahead': 4,                   # probes in flight per selection (1 = serial)
+    'page_probe_budget': None,        # max network probes per page (None = unlimited)
+    'workers': 16,                    # shared probe thread pool size
+}
+
+_probe_executor = None
+_probe_executor_lock = threading.Lock()
+
+def get_probe_executor():
+    global _probe_executor
+    if _probe_executor is None:
+        with _probe_executor_lock:
+            if _probe_executor is None:
+                _probe_executor = ThreadPoolExecutor(
+                    max_workers=SPECULATIVE_PROBE_CONFIG['workers'], thread_name_prefix='probe'
+                )
+    return _probe_executor
+
+class ProbeBudget:
+    """Network probes spent on one page, checked against page_probe_budget."""
+
+    def __init__(self):
+        self.started = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Spend one probe; False when the budget is exhausted."""
+        limit = SPECULATIVE_PROBE_CONFIG['page_probe_budget']
+        if limit is None:
+            return True
+        with self._lock:
+            if self.started >= limit:
+                return False
+            self.started += 1
+            return True
+
+def first_passing_position(candidates, budget=None, verdicts=None):
+    """
+    Return the position of the first img_url in `candidates` (ordered
+    (img_url, img_tag) pairs) that the serial verify_image/check_size
+    loop would accept, or None.
+    `verdicts` may carry precomputed verify_image results (the tags are
+    then unused).
+
+    Candidates verify_image can't decide are probed up to `lookahead` at a
+    time ahead of the cursor, but results are committed strictly in list
+    order, so the winner is the same as in serial mode. Once it is known,
+    queued probes are cancelled and running ones are told to stop.
+    """
+    lookahead = SPECULATIVE_PROBE_CONFIG['lookahead'] if SPECULATIVE_PROBE_CONFIG['enabled'] else 1
+    verdicts = dict(enumerate(verdicts)) if verdicts is not None else {}
+
+    def verdict(position):
+        if position not in verdicts:
+            verdicts[position] = verify_image(*candidates[position])
+            count('candidates')
+        return verdicts[position]
+
+    def take_probe():
+        return budget is None or budget.take()
+
+    if lookahead <= 1:
+        for position, (img_url, _) in enumerate(candidates):
+            result = verdict(position)
+            if result is True:
+                return position
+            if result is None and take_probe() and check_size(img_url):
+                return position
+        return None
+
+    executor = get_probe_executor()
+    cancelled = threading.Event()
+    futures = {}
+    next_launch = 0
+    try:
+        for position, (img_url, _) in enumerate(candidates):
+            # Keep up to `lookahead` probes in flight at or after the cursor,
+            # never past a candidate that verify_image already accepts
+            next_launch = max(next_launch, position)
+            while next_launch < len(candidates) and len(futures) < lookahead:
+                launch_verdict = verdict(next_launch)
+                if launch_verdict is True:
+                    break
+                if launch_verdict is None and take_probe():
+                    futures[next_launch] = executor.submit(in_context(check_size, candidates[next_launch][0], cancelled))
+                next_launch += 1
+
+            result = verdict(position)
+            if result is True:
+                return position
+            future = futures.pop(position, None)
+            if future is not None and future.result():
+                return position
+        return None
+    finally:
+        cancelled.set()
+        for future in futures.values():
+            future.cancel()
+
+def select_first_passing(candidates, budget=None, verdicts=None):
+    """The img_url at first_passing_position(), or None."""
+    position = first_passing_position(candidates, budget, verdicts)
+    return candidates[position][0] if position is not None else None
+
+def _usable_image_url(url, img_tag):
+    img_src = img_tag.src
+    if not img_src:
+        return None
+    img_url = urljoin(url, img_src)
+    if img_url.startswith('data:'):
+        return None
+    return img_url
+
+def header_image_candidates(url, index, max_images_to_check=10):
+    """Header/nav images in selector priority order, as (img_url, img_tag) pairs."""
+    candidates = []
+    for header_element in index.header_elements:
+        for img_tag in header_element.images:
+            if len(candidates) >= max_images_to_check:
+                return candidates
+            img_url = _usable_image_url(url, img_tag)
+            if img_url:
+                candidates.append((img_url, img_tag))
+    return candidates
+
+def container_image_candidates(url, index, container_tag, max_images_to_check=20):
+    """
+    Images inside non-ad containers of one tag (one of
+    INDEXED_CONTAINER_TAGS), as (img_url, img_tag) pairs. Images inside
+    an ad div/figure nested in the container are skipped too.
+    """
+    candidates = []
+    for container in index.containers[container_tag]:
+        # Check if the container has ad keywords in class or id
+        if container.is_ad:
+            continue
+        for img_tag in container.images:
+            if img_tag.in_ad:
+                continue
+            if len(candidates) >= max_images_to_check:
+                return candidates
+            img_url = _usable_image_url(url, img_tag)
+            if img_url:
+                candidates.append((img_url, img_tag))
+    return candidates
+
+def all_image_candidates(url, index, max_images_to_check=30):
+    """
+    Every image on the page as (img_url, img_tag) pairs, plus the fallback
+    list of non-SVG images whose HTML attributes say > 150x150.
+    """
+    candidates = []
+    fallback_images = []  # Store images with HTML attributes > 150x150 for fallback
+    
+    for img_tag in index.images:
+        if len(candidates) >= max_images_to_check:
+            break
+        
+        img_url = _usable_image_url(url, img_tag)
+        if not img_url:
+            continue
+        
+        candidates.append((img_url, img_tag))
+        
+        logger.debug("Checking image %d: %s", len(candidates), img_url)
+        
+        # Check if not SVG and has HTML attributes > 150x150 for fallback
+        if not img_url.lower().endswith('.svg'):
+            width = img_tag.get('width')
+            height = img_tag.get('height')
+            if width and height:
+                try:
+                    w = int(width)
+                    h = int(height)
+                    if w > 150 and h > 150:
+                        fallback_images.append(img_url)
+                        logger.debug("    Stored as fallback candidate (HTML: %sx%s)", w, h)
+                except (ValueError, TypeError):
+                    pass
+    return candidates, fallback_images
+
+def check_header_image(url, soup, max_images_to_check=10):
+    if not soup:
+        return None
+    index = get_dom_index(soup)
+    candidates = header_image_candidates(url, index, max_images_to_check)
+    # verify_image (skip SVG, 150x150, etc.), then check_size if undecided
+    return select_first_passing(candidates, index.probe_budget)
+
+def check_container_images(url, soup, container_tag, max_images_to_check=20):
+    if not soup:
+        return None
+    index = get_dom_index(soup)
+    candidates = container_image_candidates(url, index, container_tag, max_images_to_check)
+    # verify_image (skip SVG, 150x150, etc.), then check_size if undecided
+    return select_first_passing(candidates, index.probe_budget)
+
+def _all_images_result(img_url, fallback_images):
+    if img_url:
+        logger.debug("  ✓ Found suitable image: %s", img_url)
+        return img_url
+    
+    # If no image found via download, use fallback (first image with HTML attributes > 150x150)
+    if fallback_images:
+        logger.debug("  Using fallback image (HTML attributes > 150x150): %s", fallback_images[0])
+        count('fallbacks', kind='html_attributes')
+        return fallback_images[0]
+    
+    return None
+
+def check_all_images(url, soup, max_images_to_check=30):
+    if not soup:
+        return None
+    index = get_dom_index(soup)
+    candidates, fallback_images = all_image_candidates(url, index, max_images_to_check)
+    # Verify image based on extension and HTML attributes, download if undecided
+    img_url = select_first_passing(candidates, index.probe_budget)
+    return _all_images_result(img_url, fallback_images)
+
+# Metadata fast path: og:image / twitter:image meta tags and JSON-LD,
+# read before any DOM scanning. og:image:width/height apply to the
+# og:image declared just before them.
+META_IMAGE_PROPERTIES = ('og:image', 'og:image:url', 'og:image:secure_url', 'twitter:image', 'twitter:image:src')
+
+# JSON-LD types whose `image` describes the site or a person, not the page
+JSON_LD_SITE_TYPES = ('Organization', 'NewsMediaOrganization', 'Corporation', 'Person', 'WebSite', 'Brand')
+
+def _declared_dimension(value):
+    """Pixels from a declared width/height (1200, '1200', '1200px', {'value': 1200}), or None."""
+    if isinstance(value, dict):
+        value = value.get('value')
+    if value is None or isinstance(value, bool):
+        return None
+    match = re.match(r'\s*(\d+)(?:\.\d+)?\s*(?:px)?\s*$', str(value))
+    return int(match.group(1)) if match else None
+
+def json_ld_objects(index):
+    """Every top-level and @graph object of the page's JSON-LD blocks, parsed once per index."""
+    if index.json_ld_objects is None:
+        objects = []
+        for text in index.json_ld:
+            try:
+                data = json.loads(text)
+            except ValueError:
+                logger.debug("  ✗ Skipping invalid JSON-LD block")
+                continue
+            for item in data if isinstance(data, list) else [data]:
+                if not isinstance(item, dict):
+                    continue
+                objects.append(item)
+                graph = item.get('@graph')
+                if isinstance(graph, list):
+                    objects.extend(node for node in graph if isinstance(node, dict))
+        index.json_ld_objects = objects
+    return index.json_ld_objects
+
+def _json_ld_types(obj):
+    types = obj.get('@type', [])
+    return types if isinstance(types, list) else [types]
+
+def _json_ld_images(value, by_id):
+    """(src, width, height) for a JSON-LD image/logo value: URL, ImageObject, @id reference or a list."""
+    if isinstance(value, str):
+        yield value, None, None
+    elif isinstance(value, list):
+        for item in value:
+            yield from _json_ld_images(item, by_id)
+    elif isinstance(value, dict):
+        if 'url' not in value and 'contentUrl' not in value:
+            value = by_id.get(value.get('@id'), value)
+        src = value.get('url') or value.get('contentUrl')
+        if isinstance(src, str):
+            yield src, _declared_dimension(value.get('width')), _declared_dimension(value.get('height'))
+
+def _json_ld_ids(objects):
+    return {obj['@id']: obj for obj in objects if isinstance(obj.get('@id'), str)}
+
+def meta_image_candidates(url, index):
+    """
+    Images the page declares in meta tags, then JSON-LD `image`, as
+    (img_url, attrs) pairs. attrs carries declared width/height the way
+    an <img> would, so verify_image accepts or rejects them without a download.
+    """
+    declared = []
+    last_og = None
+    for attrs in index.metas:
+        key = str(attrs.get('property') or attrs.get('name') or '').strip().lower()
+        content = str(attrs.get('content') or '').strip()
+        if not content:
+            continue
+        if key in META_IMAGE_PROPERTIES:
+            entry = {'src': content}
+            declared.append(entry)
+            last_og = entry if key.startswith('og:') else None
+        elif key in ('og:image:width', 'og:image:height') and last_og is not None:
+            last_og[key[len('og:image:'):]] = _declared_dimension(content)
+
+    objects = json_ld_objects(index)
+    by_id = _json_ld_ids(objects)
+    for obj in objects:
+        if 'image' not in obj or any(t in JSON_LD_SITE_TYPES for t in _json_ld_types(obj)):
+            continue
+        for src, width, height in _json_ld_images(obj['image'], by_id):
+            declared.append({'src': src, 'width': width, 'height': height})
+
+    candidates = {}
+    for entry in declared:
+        img_url = urljoin(url, entry['src'])
+        if img_url.startswith('data:'):
+            continue
+        dimensions = candidates.setdefault(img_url, {})
+        # A later declaration of the same URL can still supply the size
+        if entry.get('width') and entry.get('height') and not dimensions:
+            dimensions.update(width=str(entry['width']), height=str(entry['height']))
+    return list(candidates.items())
+
+def json_ld_logo(url, index):
+    """The first JSON-LD `logo` or `publisher.logo` URL, or None."""
+    objects = json_ld_objects(index)
+    by_id = _json_ld_ids(objects)
+    for obj in objects:
+        owners = [obj]
+        publisher = obj.get('publisher')
+        if isinstance(publisher, dict):
+            owners.append(publisher if 'logo' in publisher else by_id.get(publisher.get('@id'), publisher))
+        for owner in owners:
+            for src, _, _ in _json_ld_images(owner.get('logo'), by_id):
+                logo_url = urljoin(url, src.strip())
+                if not logo_url.startswith('data:'):
+                    return logo_url
+    return None
+
+IMAGE_STEPS = ('meta', 'header', 'figure', 'div', 'all')
+
+def image_step_candidates(url, index, step, max_images_to_check=20):
+    """(candidates, fallback_images) for one scrape_first_image step."""
+    if step == 'meta':
+        return meta_image_candidates(url, index)[:max_images_to_check], []
+    if step == 'header':
+        return header_image_candidates(url, index, max_images_to_check), []
+    if step == 'all':
+        return all_image_candidates(url, index, max_images_to_check)
+    return container_image_candidates(url, index, step, max_images_to_check), []
+
+def image_source(index, step, img_tag):
+    """
+    The rule that finds img_tag again: its step, the signature of the
+    innermost container that step looks in, and the src attribute used.
+    None for metadata candidates, which need no rule.
+    """
+    if step == 'meta':
+        return None
+    if step == 'header':
+        header_ids = {id(element) for element in index.header_elements}
+        containers = [element for element in img_tag.ancestors if id(element) in header_ids]
+    elif step == 'all':
+        containers = list(img_tag.ancestors)
+    else:
+        containers = [element for element in img_tag.ancestors if element.name == step and not element.is_ad]
+    container = element_signature(containers[-1].name, containers[-1].attrs) if containers else None
+    return {'step': step, 'container': container, 'attribute': _image_src_attribute(img_tag.attrs)}
+
+def rule_image_candidates(url, index, rule, max_images_to_check=20):
+    """Images a learned image rule points at, as (img_url, img_tag) pairs."""
+    candidates = []
+    for img_tag in index.images:
+        if len(candidates) >= max_images_to_check:
+            break
+        if _image_src_attribute(img_tag.attrs) != rule['attribute']:
+            continue
+        if img_tag.in_ad and rule['step'] in ('figure', 'div'):
+            continue
+        if image_source(index, rule['step'], img_tag) != rule:
+            continue
+        img_url = _usable_image_url(url, img_tag)
+        if img_url:
+            candidates.append((img_url, img_tag))
+    return candidates
+
+def image_steps(url, index, max_images_to_check=20, rule=None):
+    """
+    (step, collect) pairs in search order: page metadata, the learned
+    `rule`, then header/nav, figure tags, divs and every image on the
+    page. collect() returns (candidates, fallback_images).
+    """
+    steps = [(step, functools.partial(image_step_candidates, url, index, step, max_images_to_check))
+             for step in IMAGE_STEPS]
+    if rule:
+        steps.insert(1, ('rule', lambda: (rule_image_candidates(url, index, rule, max_images_to_check), [])))
+    return steps
+
+def find_first_image(url, index, max_images_to_check=20, rule=None):
+    """
+    Run the image_steps() in order. Returns (img_url, source, rule_hit);
+    source is None for metadata and the HTML-attribute fallback, which
+    aren't learned.
+    """
+    for step, collect in image_steps(url, index, max_images_to_check, rule):
+        with timed(step):
+            candidates, fallback_images = collect()
+            # verify_image (skip SVG, 150x150, etc.), then check_size if undecided
+            position = first_passing_position(candidates, index.probe_budget)
+            img_url = candidates[position][0] if position is not None else None
+            if step == 'all':
+                img_url = _all_images_result(img_url, fallback_images)
+        if position is not None and step == 'rule':
+            return img_url, rule, True
+        if position is not None:
+            return img_url, image_source(index, step, candidates[position][1]), False
+        if img_url:
+            return img_url, None, False
+    return None, None, False
+
+def scrape_first_image(url, soup, max_images_to_check=20):
+    if not soup:
+        return None
+    domain = rule_domain(url)
+    rule = EXTRACTION_RULES.get(domain, 'image')
+    index = get_dom_index(soup)
+    img_url, source, rule_hit = find_first_image(url, index, max_images_to_check, rule)
+    if index.partial is None:  # a truncated document proves nothing about the rule
+        EXTRACTION_RULES.record(domain, 'image', rule, rule_hit, source)
+    return img_url
+
+def plan_first_image(url, soup, max_images_to_check=20, rule=None):
+    """
+    Network-free half of scrape_first_image: the candidate lists of all
+    image_steps() with their verify_image verdicts and sources, as plain
+    picklable data. resolve_first_image() later runs the probes in the
+    same order.
+    """
+    index = get_dom_index(soup)
+    plan = []
+    for step, collect in image_steps(url, index, max_images_to_check, rule):
+        with timed(step):
+            candidates, fallback = collect()
+            plan.append({
+                'step': step,
+                'urls': [img_url for img_url, _ in candidates],
+                'verdicts': [verify_image(img_url, img_tag) for img_url, img_tag in candidates],
+                'sources': [rule if step == 'rule' else image_source(index, step, img_tag)
+                            for _, img_tag in candidates],
+                'fallback': fallback,
+                'rule': rule if step == 'rule' else None,
+            })
+        count('candidates', len(candidates))
+    return plan
+
+def resolve_first_image(plan, domain=None):
+    """
+    Run the probes a plan_first_image() plan still needs; same answer as
+    scrape_first_image. With `domain`, the outcome updates its learned rule.
+    """
+    budget = ProbeBudget()
+    rule = next((step['rule'] for step in plan if step['step'] == 'rule'), None)
+    img_url, source, rule_hit = None, None, False
+    for step in plan:
+        candidates = [(img_url, None) for img_url in step['urls']]
+        with timed(step['step']):
+            position = first_passing_position(candidates, budget, step['verdicts'])
+            img_url = candidates[position][0] if position is not None else None
+            if step['step'] == 'all':
+                img_url = _all_images_result(img_url, step['fallback'])
+        if img_url:
+            source = step['sources'][position] if position is not None else None
+            rule_hit = position is not None and step['step'] == 'rule'
+            break
+    if domain is not None:
+        EXTRACTION_RULES.record(domain, 'image', rule, rule_hit, source)
+    return img_url
+
+# HTML parser backend used by scrape_page.
+#   'html.parser'  BeautifulSoup with the stdlib parser (slowest, no extra deps)
+#   'lxml'         BeautifulSoup with lxml
+#   'selectolax'   lexbor via selectolax; builds the DomIndex directly, no soup
+PARSER_CONFIG = {
+    'backend': 'html.parser',
+}
+
+PARSER_BACKENDS = ('html.parser', 'lxml', 'selectolax')
+
+def parse_html(html_content, backend=None):
+    """
+    Parse html_content with the given (or configured) backend. Returns
+    something every extractor accepts: a BeautifulSoup for the bs4
+    backends, or a ready DomIndex for selectolax.
+    """
+    backend = backend or PARSER_CONFIG['backend']
+    if backend == 'html.parser':
+        return BeautifulSoup(html_content, 'html.parser')
+    if backend == 'lxml':
+        if importlib.util.find_spec('lxml') is None:
+            raise RuntimeError("Parser backend 'lxml' requires the lxml package")
+        return BeautifulSoup(html_content, 'lxml')
+    if backend == 'selectolax':
+        if LexborHTMLParser is None:
+            raise RuntimeError("Parser backend 'selectolax' requires the selectolax package")
+        return index_elements(_lexbor_elements(LexborHTMLParser(html_content)))
+    raise ValueError(f"Unknown parser backend: {backend}")
+
+def parse_page(html_content, backend=None):
+    if not html_content:
+        return None
+    with timed('parse'):
+        document = parse_html(html_content, backend)
+        # Build the index here so its cost is reported as parsing
+        index = get_dom_index(document)
+    if isinstance(html_content, PartialPage):
+        index.partial = {'reason': html_content.reason, 'bytes_read': html_content.bytes_read}
+    return document
+
+def scrape_page(url):
+    html_content = get_page_content(url)
+    return parse_page(html_content)
+
+def build_result(idx, url, soup):
+    """
+    Run the extractors on a parsed page and build the result row.
+    A missing soup produces the "not found" row. Links resolve against
+    the canonical page URL; the row keeps the URL as given.
+    """
+    if not soup:
+        logger.warning("  ✗ Failed to retrieve page content (timeout or error)")
+        count('pages', outcome='failed')
+        return result_row(idx, url, None, None, None)
+
+    page_url = normalize_url(url)
+    image_url = scrape_first_image(page_url, soup)
+    with timed('favicon'):
+        favicon = get_favicon(page_url, soup)
+    with timed('logo'):
+        logo = get_logo(page_url, soup)
+    count('pages', outcome='ok')
+    return result_row(idx, url, image_url, favicon, logo, get_dom_index(soup).partial)
+
+def result_row(idx, url, image_url, favicon, logo, partial=None):
+    if image_url:
+        logger.info("  ✓ Found image: %s", image_url)
+    else:
+        logger.info("  ✗ No image found")
+
+    if favicon:
+        logger.info("  ✓ Found favicon: %s", favicon)
+    else:
+        logger.info("  ✗ No favicon found")
+
+    if logo:
+        logger.info("  ✓ Found logo: %s", logo)
+    else:
+        logger.info("  ✗ No logo found")
+
+    row = {
+        "id": idx,
+        "url": url,
+        "image_path": image_url if image_url else "No image found",
+        "favicon": favicon if favicon else "No favicon found",
+        "logo": logo if logo else "No logo found"
+    }
+    if partial:
+        # Only part of the body was read: list the fields found in that prefix
+        found = (("image_path", image_url), ("favicon", favicon), ("logo", logo))
+        row["partial_document"] = dict(partial, fields=[name for name, value in found if value])
+    return row
+
+def iter_scrape_results(entries):
+    """
+    Sequential crawl over (id, url) entries, yielding each result as soon
+    as it is built.
+    """
+    for idx, url in entries:
+        logger.info("Processing [%s]: %s", idx, url)
+        with url_trace() as trace:
+            result = build_result(idx, url, scrape_page(url))
+        yield attach_metrics(result, trace)
+
+def scrape_images_from_links(links):
+    """
+    Sequential crawl: one URL at a time. Kept as the fallback for
+    scrape_images_from_links_async.
+    """
+    return list(iter_scrape_results(enumerate(links, start=1)))
+
+_MARKDOWN_LINK = re.compile(r'<(https?://[^>\s]+)>')
+_BARE_LINK = re.compile(r'https?://\S+')
+
+def iter_links(source):
+    """
+    Lazily read (id, url) entries from a file path, or stdin for '-'.
+
+    Each line may be JSON ({"url": ..., "id": ...}, as in a JSONL export),
+    a links.md-style line with <https://...> links, or a plain URL.
+    Entries without an explicit id are numbered by position.
+    Blank lines and lines without a URL are skipped.
+    """
+    f = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        position = 0
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = {}
+                url = record.get('url')
+                if url:
+                    position += 1
+                    yield record.get('id', record.get('request_id', position)), url
+                continue
+            urls = _MARKDOWN_LINK.findall(line) or _BARE_LINK.findall(line)[:1]
+            for url in urls:
+                position += 1
+                yield position, url
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+class Checkpoint:
+    """
+    Resume point for a streaming run: how many input entries have been
+    written and the output file size after the last complete line.
+    Constant size regardless of input length; saved atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.position = 0
+        self.output_offset = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.position = state.get('position', 0)
+            self.output_offset = state.get('output_offset', 0)
+        return self
+
+    def save(self, position, output_offset):
+        self.position = position
+        self.output_offset = output_offset
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'position': position, 'output_offset': output_offset}, f)
+        os.replace(tmp_path, self.path)
+
+def run_streaming(source, output_path, checkpoint_path=None, resume=True, sequential=False,
+                  max_concurrency=None, per_host_concurrency=None, processes=0):
+    """
+    Stream URLs from `source` (see iter_links) and append one JSON line
+    per result to output_path as soon as it is ready, in input order.
+
+    The checkpoint records consumed entries and the output offset; on
+    restart the output is truncated back to the last checkpointed line and
+    already finished entries are skipped. Nothing is accumulated in memory.
+    processes > 0 runs the process-pool pipeline instead of the thread-only
+    async crawl. With thumbnails enabled, rows are written in batches of
+    THUMBNAIL_CONFIG['batch_size'] once their thumbnails exist.
+    Returns the number of rows written in this run.
+    """
+    checkpoint = Checkpoint(checkpoint_path or output_path + '.checkpoint')
+    if resume:
+        checkpoint.load()
+    if checkpoint.position:
+        logger.info("Resuming after %d completed entries", checkpoint.position)
+
+    entries = itertools.islice(iter_links(source), checkpoint.position, None)
+    mode = 'r+b' if os.path.exists(output_path) else 'wb'
+    written = 0
+    thumbnails = ThumbnailStage() if THUMBNAIL_CONFIG['enabled'] else None
+    batch = []
+    with open(output_path, mode) as out, thumbnails or nullcontext():
+        # Drop anything written after the last checkpoint (e.g. a torn line)
+        out.seek(checkpoint.output_offset)
+        out.truncate()
+
+        def write(result):
+            nonlocal written
+            out.write((json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8'))
+            out.flush()
+            written += 1
+            checkpoint.save(checkpoint.position + 1, out.tell())
+
+        def emit(result):
+            """Write result, or queue it for thumbnails; True once a batch is due for flush()."""
+            if thumbnails is None:
+                write(result)
+                return False
+            batch.append(result)
+            return len(batch) >= THUMBNAIL_CONFIG['batch_size']
+
+        def flush():
+            if batch:
+                for result in thumbnails.process(batch):
+                    write(result)
+                batch.clear()
+
+        if sequential:
+            for result in iter_scrape_results(entries):
+                if emit(result):
+                    flush()
+        elif processes:
+            stats = {}
+            async def consume():
+                async for result in iter_scrape_results_pipeline(entries, max_concurrency, per_host_concurrency,
+                                                                 processes, stats=stats):
+                    if emit(result):
+                        await asyncio.to_thread(flush)  # keep the crawl running meanwhile
+            asyncio.run(consume())
+            print_pipeline_stats(stats)
+        else:
+            async def consume():
+                async for result in iter_scrape_results_async(entries, max_concurrency, per_host_concurrency):
+                    if emit(result):
+                        await asyncio.to_thread(flush)
+            asyncio.run(consume())
+        if thumbnails is not None:
+            flush()
+    return written
+
+# Distributed mode: workers pull URLs from a shared queue under leases
+WORK_QUEUE_CONFIG = {
+    'lease_seconds': 120.0,      # a claimed URL returns to the queue if not renewed in time
+    'max_attempts': 3,           # failures (or expired leases) before an item is dead-lettered
+    'poll_interval': 2.0,        # idle worker wait when everything left is leased elsewhere
+}
+
+class WorkQueue(ABC):
+    """
+    Interface for a shared queue of (id, url) entries with leases. The
+    SQLite backend below works across processes on one machine; a broker
+    backed queue (Redis, SQS, ...) only has to implement these methods.
+    """
+
+    @abstractmethod
+    def enqueue(self, entries):
+        """Add (id, url) entries; returns how many were added."""
+
+    @abstractmethod
+    def claim(self, worker_id, lease_seconds):
+        """Lease the next available item; returns (item_id, entry_id, url) or None."""
+
+    @abstractmethod
+    def heartbeat(self, worker_id, item_id, lease_seconds):
+        """Extend a lease; returns False if the worker no longer holds it."""
+
+    @abstractmethod
+    def complete(self, worker_id, item_id):
+        """Mark a leased item done; returns False if the lease was lost."""
+
+    @abstractmethod
+    def fail(self, worker_id, item_id, error):
+        """Release a leased item for retry, or dead-letter it after max_attempts."""
+
+    @abstractmethod
+    def counts(self):
+        """{'pending': n, 'leased': n, 'done': n, 'failed': n}"""
+
+class ResultSink(ABC):
+    """Where workers put finished result rows. Writes must be idempotent per id."""
+
+    @abstractmethod
+    def write(self, result):
+        """Store one result row."""
+
+class _SQLiteBackend:
+    # One connection per thread; SQLite's file locking coordinates processes
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+class SQLiteWorkQueue(_SQLiteBackend, WorkQueue):
+    """
+    Leased work queue in a SQLite file. An item is 'pending', 'leased'
+    (with owner and expiry), 'done' or 'failed'. A leased item whose
+    lease has expired is claimable again, which is how a dead worker's
+    URLs get re-queued.
+    """
+
+    def __init__(self, path, max_attempts=None):
+        super().__init__(path)
+        self.max_attempts = max_attempts or WORK_QUEUE_CONFIG['max_attempts']
+        self.connection().execute(
+            'CREATE TABLE IF NOT EXISTS work_queue ('
+            'item_id INTEGER PRIMARY KEY AUTOINCREMENT, entry_id TEXT, url TEXT, '
+            'state TEXT DEFAULT \'pending\', worker TEXT, lease_expires REAL, '
+            'attempts INTEGER DEFAULT 0, error TEXT)'
+        )
+        self.connection().execute('CREATE INDEX IF NOT EXISTS work_queue_state ON work_queue (state, lease_expires)')
+
+    def enqueue(self, entries):
+        conn = self.connection()
+        added = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for entry_id, url in entries:
+                conn.execute('INSERT INTO work_queue (entry_id, url) VALUES (?, ?)', (json.dumps(entry_id), url))
+                added += 1
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def claim(self, worker_id, lease_seconds):
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Expired leases past max_attempts are dead-lettered rather than retried forever
+            conn.execute(
+                "UPDATE work_queue SET state = 'failed', error = 'lease expired' "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT item_id, entry_id, url FROM work_queue "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                "ORDER BY item_id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE work_queue SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE item_id = ?",
+                    (worker_id, now + lease_seconds, row[0])
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def _update_owned(self, sql, params):
+        cursor = self.connection().execute(sql + " WHERE item_id = ? AND worker = ? AND state = 'leased'", params)
+        return cursor.rowcount == 1
+
+    def heartbeat(self, worker_id, item_id, lease_seconds):
+        return self._update_owned(
+            'UPDATE work_queue SET lease_expires = ?', (time.time() + lease_seconds, item_id, worker_id)
+        )
+
+    def complete(self, worker_id, item_id):
+        return self._update_owned("UPDATE work_queue SET state = 'done', lease_expires = NULL", (item_id, worker_id))
+
+    def fail(self, worker_id, item_id, error):
+        return self._update_owned(
+            "UPDATE work_queue SET error = ?, lease_expires = NULL, "
+            "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END",
+            (error, self.max_attempts, item_id, worker_id)
+        )
+
+    def counts(self):
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for state, count in self.connection().execute('SELECT state, COUNT(*) FROM work_queue GROUP BY state'):
+            counts[state] = count
+        return counts
+
+class SQLiteResultSink(_SQLiteBackend, ResultSink):
+    """Result rows keyed by entry id, so a re-processed URL overwrites its row."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.connection().execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'entry_id TEXT PRIMARY KEY, url TEXT, result TEXT, finished_at REAL)'
+        )
+
+    def write(self, result):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO results (entry_id, url, result, finished_at) VALUES (?, ?, ?, ?)',
+            (json.dumps(result['id']), result['url'], json.dumps(result, ensure_ascii=False), time.time())
+        )
+
+    def export_jsonl(self, output_path):
+        """Write all results to a JSONL file in completion order; returns the row count."""
+        count = 0
+        with open(output_path, 'w', encoding='utf-8') as out:
+            for (result,) in self.connection().execute('SELECT result FROM results ORDER BY finished_at'):
+                out.write(result + '\n')
+                count += 1
+        return count
+
+def run_worker(queue, sink, worker_id=None, lease_seconds=None, exit_when_idle=True):
+    """
+    Claim URLs from `queue` one at a time, scrape them and write the rows
+    to `sink`. A heartbeat thread renews the lease while a URL is being
+    processed. The row is written before the item is marked done
+    (at-least-once; sinks are idempotent per id). Returns the number of
+    items this worker completed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    lease_seconds = lease_seconds or WORK_QUEUE_CONFIG['lease_seconds']
+    completed = 0
+
+    while True:
+        claimed = queue.claim(worker_id, lease_seconds)
+        if claimed is None:
+            counts = queue.counts()
+            if counts['leased'] == 0 and exit_when_idle:
+                return completed
+            # Work is leased elsewhere; wait in case a lease expires
+            time.sleep(WORK_QUEUE_CONFIG['poll_interval'])
+            continue
+
+        item_id, entry_id, url = claimed
+        logger.info("[%s] Processing [%s]: %s", worker_id, entry_id, url)
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(lease_seconds / 3):
+                if not queue.heartbeat(worker_id, item_id, lease_seconds):
+                    logger.warning("[%s] Lost lease on item %s", worker_id, item_id)
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            with url_trace() as trace:
+                result = build_result(entry_id, url, scrape_page(url))
+            sink.write(attach_metrics(result, trace))
+            if queue.complete(worker_id, item_id):
+                completed += 1
+        except Exception as exc:
+            logger.error("[%s] ✗ Failed %s: %s: %s", worker_id, url, type(exc).__name__, exc)
+            queue.fail(worker_id, item_id, f"{type(exc).__name__}: {exc}")
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+
+def read_links_markdown(path):
+    """Extract the <https://...> links from a links.md-style file."""
+    return [url for _, url in iter_links(path)]
+
+def compare_parser_backends(links, backends=None, repeats=3):
+    """
+    Equivalence check and timing for the parser backends.
+
+    Fetches each page once, then for every backend parses it `repeats`
+    times (best time is kept, index build included) and runs
+    scrape_first_image, declared_favicon and get_logo. Image probes go through
+    IMAGE_CACHE, so only the first backend pays for downloads. Learned
+    extraction rules are off for the run so every backend does the full search.
+    Returns {'pages': [...], 'parse_time': {backend: seconds}, 'mismatches': [urls]}.
+    """
+    rules_enabled = EXTRACTION_RULES_CONFIG['enabled']
+    EXTRACTION_RULES_CONFIG['enabled'] = False
+    try:
+        return _compare_parser_backends(links, backends, repeats)
+    finally:
+        EXTRACTION_RULES_CONFIG['enabled'] = rules_enabled
+
+def _compare_parser_backends(links, backends, repeats):
+    backends = backends or [backend for backend in PARSER_BACKENDS if _backend_available(backend)]
+    report = {'pages': [], 'parse_time': {backend: 0.0 for backend in backends}, 'mismatches': []}
+
+    for url in links:
+        html_content = get_page_content(url)
+        if not html_content:
+            logger.warning("  ✗ Could not fetch %s, skipping", url)
+            continue
+
+        page = {'url': url, 'results': {}, 'parse_time': {}}
+        for backend in backends:
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                document = get_dom_index(parse_html(html_content, backend))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            page['parse_time'][backend] = best
+            report['parse_time'][backend] += best
+            page['results'][backend] = {
+                'image_path': scrape_first_image(url, document),
+                'favicon': declared_favicon(url, document),
+                'logo': get_logo(url, document),
+            }
+
+        baseline = page['results'][backends[0]]
+        page['identical'] = all(result == baseline for result in page['results'].values())
+        if not page['identical']:
+            report['mismatches'].append(url)
+        report['pages'].append(page)
+
+        timings = ', '.join(f"{backend}={page['parse_time'][backend] * 1000:.1f}ms" for backend in backends)
+        print(f"{'✓' if page['identical'] else '✗'} {url}: {timings}")
+        if not page['identical']:
+            for backend, result in page['results'].items():
+                print(f"    {backend}: {result}")
+
+    print(f"\nTotal parse time over {len(report['pages'])} pages:")
+    for backend, total in report['parse_time'].items():
+        print(f"  {backend}: {total * 1000:.1f}ms")
+    print(f"Mismatching pages: {len(report['mismatches'])}")
+    return report
+
+def _backend_available(backend):
+    if backend == 'lxml':
+        return importlib.util.find_spec('lxml') is not None
+    if backend == 'selectolax':
+        return LexborHTMLParser is not None
+    return True
+
+# Concurrency limits for the async crawl
+CRAWL_CONFIG = {
+    'max_concurrency': 16,       # URLs processed at the same time
+    'per_host_concurrency': 2,   # page fetches in flight per host
+    'window_factor': 4,          # streaming: entries in flight = max_concurrency * this
+}
+
+async def iter_scrape_results_async(entries, max_concurrency=None, per_host_concurrency=None, window=None):
+    """
+    Concurrent crawl over an iterable of (id, url) entries.
+
+    Pages are fetched with httpx.AsyncClient under a global and a per-host
+    limit; parsing and image checks (which block on check_size) run in a
+    thread pool sized to the global limit. Entries are pulled lazily and at
+    most `window` are in flight, so memory stays flat for any input length.
+    Results are yielded in input order.
+    """
+    max_concurrency = max_concurrency or CRAWL_CONFIG['max_concurrency']
+    per_host_concurrency = per_host_concurrency or CRAWL_CONFIG['per_host_concurrency']
+    window = window or max_concurrency * CRAWL_CONFIG['window_factor']
+
+    global_limit = asyncio.Semaphore(max_concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host_concurrency))
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def process(client, idx, url):
+        async with global_limit:
+            logger.info("Processing [%s]: %s", idx, url)
+            with url_trace() as trace:
+                async with host_limits[host_key(url)]:
+                    html_content = await get_page_content_async(client, url)
+                soup = await loop.run_in_executor(executor, in_context(parse_page, html_content))
+                result = await loop.run_in_executor(executor, in_context(build_result, idx, url, soup))
+            return attach_metrics(result, trace)
+
+    pending = deque()
+    try:
+        async with create_async_http_client() as client:
+            entries = iter(entries)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < window:
+                    entry = next(entries, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    pending.append(asyncio.ensure_future(process(client, *entry)))
+                if not pending:
+                    break
+                yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        executor.shutdown(wait=False)
+
+# Process-pool pipeline: I/O stage (fetch + image probes) in the event
+# loop and threads, CPU stage (parse + candidate extraction) in processes
+PIPELINE_CONFIG = {
+    'processes': os.cpu_count() or 1,
+    'cpu_queue_factor': 2,       # pages queued per worker process before fetching stalls
+}
+
+def extract_page_plan(url, html_content, backend, rules=None):
+    """
+    CPU stage, run in a worker process: parse the page and do all the
+    extraction that needs no network. Returns plain data: the image plan
+    (see plan_first_image), the declared favicon (resolve_favicon does
+    the lookup and validation in the I/O stage), logo, the time spent and, with
+    metrics enabled, the worker-side trace for merge_trace().
+    `rules` are the domain's learned {'image': rule, 'logo': rule}; the
+    parent looks them up and records the outcome, workers never touch the store.
+    """
+    start = time.perf_counter()
+    url = normalize_url(url)
+    rules = rules or {}
+    with url_trace() as trace:
+        document = parse_page(html_content, backend)
+        if document is None:
             return None
-    except httpx.HTTPStatusError as e:
-        print(f"HTTP status error for {url}: {e}")
-        print(f"  Trying Selenium fallback...")
+        image_plan = plan_first_image(url, document, rule=rules.get('image'))
+        with timed('favicon'):
+            declared = declared_favicon(url, document)
+        with timed('logo'):
+            logo, logo_source, logo_rule_hit = find_logo(url, get_dom_index(document), rules.get('logo'))
+    return {
+        'image_plan': image_plan,
+        'declared_favicon': declared,
+        'logo': logo,
+        'logo_rule': rules.get('logo'),
+        'logo_source': logo_source,
+        'logo_rule_hit': logo_rule_hit,
+        'partial': get_dom_index(document).partial,
+        'elapsed': time.perf_counter() - start,
+        'metrics': trace.as_dict() if trace is not None else None,
+    }
+
+def config_snapshot():
+    """Copies of every *_CONFIG dict, to hand to spawned worker processes."""
+    return {name: dict(value) for name, value in globals().items()
+            if name.endswith('_CONFIG') and isinstance(value, dict)}
+
+def _init_pipeline_worker(configs):
+    # Spawned workers start from the module defaults; apply the parent's
+    # settings (URL canonicalization, parser, rules, ad filter, metrics, ...)
+    for name, config in configs.items():
+        globals()[name].update(config)
+
+def merge_trace(metrics):
+    """Fold a trace recorded in a worker process into this process and URL."""
+    if not metrics:
+        return
+    for stage, seconds in metrics['timings'].items():
+        record_time(stage, seconds)
+    for name, value in metrics['counters'].items():
+        count(name, value)
+
+def finish_page_plan(idx, url, plan):
+    """I/O stage: run the image probes and favicon lookup the plan needs and build the row."""
+    if plan is None:
+        logger.warning("  ✗ Failed to retrieve page content (timeout or error)")
+        count('pages', outcome='failed')
+        return result_row(idx, url, None, None, None)
+    # Rules learn only from complete documents
+    domain = rule_domain(url) if plan['partial'] is None else None
+    image_url = resolve_first_image(plan['image_plan'], domain)
+    if domain is not None:
+        EXTRACTION_RULES.record(domain, 'logo', plan['logo_rule'], plan['logo_rule_hit'], plan['logo_source'])
+    with timed('favicon'):
+        favicon = resolve_favicon(normalize_url(url), plan['declared_favicon'])
+    count('pages', outcome='ok')
+    return result_row(idx, url, image_url, favicon, plan['logo'], plan['partial'])
+
+class StageStats:
+    """Busy time, task count and backpressure wait for one pipeline stage."""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.tasks = 0
+        self.busy = 0.0
+        self.waited = 0.0
+
+    @contextmanager
+    def track(self):
+        start = time.perf_counter()
         try:
-            selenium_result = get_page_content_selenium(url)
-            if selenium_result:
-                print(f"  ✓ Selenium fallback successful")
-                return selenium_result
-            else:
-                print(f"  ✗ Selenium fallback failed")
-                return None
-        except Exception as selenium_error:
-            print(f"  ✗ Selenium error: {selenium_error}")
-            return None
+            yield
+        finally:
+            self.tasks += 1
+            self.busy += time.perf_counter() - start
 
-def get_favicon(url, soup):
+    def report(self, wall_time):
+        utilisation = self.busy / (wall_time * self.capacity) if wall_time > 0 else 0.0
+        return {
+            'tasks': self.tasks,
+            'busy_seconds': round(self.busy, 3),
+            'capacity': self.capacity,
+            'utilisation': round(utilisation, 3),
+            'backpressure_wait_seconds': round(self.waited, 3),
+        }
+
+async def iter_scrape_results_pipeline(entries, max_concurrency=None, per_host_concurrency=None,
+                                       processes=None, window=None, stats=None):
     """
-    Extract favicon URL from the page.
-    Checks link tags with various rel attributes and formats.
-    Returns the favicon URL or None if not found.
+    Like iter_scrape_results_async, but parsing and extraction run in a
+    process pool sized to the cores, so CPU work scales past one core.
+    Image probes the plan still needs come back to the I/O threads.
+
+    At most processes * cpu_queue_factor pages wait for or occupy the CPU
+    stage; fetches hold their global slot while they wait, which throttles
+    the I/O stage when extraction falls behind. If `stats` is a dict it
+    is filled with per-stage utilisation when the run ends.
     """
-    if not soup:
-        return None
-    
-    # Priority order for favicon rel attributes
-    favicon_rel_types = [
-        'icon',
-        'shortcut icon',
-        'apple-touch-icon',
-        'apple-touch-icon-precomposed',
-        'mask-icon',
-        'fluid-icon'
-    ]
-    
-    # Check link tags in head first
-    head = soup.find('head')
-    if head:
-        for rel_type in favicon_rel_types:
-            link_tags = head.find_all('link', rel=lambda x: x and rel_type.lower() in str(x).lower())
-            for link_tag in link_tags:
-                href = link_tag.get('href')
-                if href:
-                    favicon_url = urljoin(url, href)
-                    # Skip data URLs
-                    if not favicon_url.startswith('data:'):
-                        print(f"  ✓ Found favicon via link tag (rel={rel_type}): {favicon_url}")
-                        return favicon_url
-    
-    # Check for SVG favicons in head (some sites use inline SVG)
-    if head:
-        svg_tags = head.find_all('svg')
-        for svg_tag in svg_tags:
-            # Check if this SVG might be a favicon (usually small, in head)
-            parent = svg_tag.find_parent()
-            if parent:
-                parent_attrs = ' '.join([
-                    ' '.join(parent.get('class', [])),
-                    str(parent.get('id', ''))
-                ]).lower()
-                if 'favicon' in parent_attrs or 'icon' in parent_attrs:
-                    # For inline SVG, we can't return a URL, but we could return the SVG data
-                    # For now, skip inline SVGs as they need special handling
-                    pass
-    
-    # Fallback: Try common favicon path (/favicon.ico)
-    # Most websites have favicon.ico at root, so we return it as fallback
-    # Note: This might return a 404, but it's the standard location
-    favicon_url = urljoin(url, '/favicon.ico')
-    print(f"  ? Using default favicon path: {favicon_url}")
-    return favicon_url
+    max_concurrency = max_concurrency or CRAWL_CONFIG['max_concurrency']
+    per_host_concurrency = per_host_concurrency or CRAWL_CONFIG['per_host_concurrency']
+    processes = processes or PIPELINE_CONFIG['processes']
+    window = window or max_concurrency * CRAWL_CONFIG['window_factor']
+    backend = PARSER_CONFIG['backend']
 
-def get_logo(url, soup):
+    global_limit = asyncio.Semaphore(max_concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host_concurrency))
+    cpu_slots = asyncio.Semaphore(processes * PIPELINE_CONFIG['cpu_queue_factor'])
+    # spawn, not fork: the parent already runs client, probe and pool threads
+    process_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_pipeline_worker, initargs=(config_snapshot(),))
+    io_executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    loop = asyncio.get_running_loop()
+    stages = {
+        'fetch': StageStats('fetch', max_concurrency),
+        'extract': StageStats('extract', processes),
+        'probe': StageStats('probe', max_concurrency),
+    }
+    started = time.perf_counter()
+
+    async def process(client, idx, url):
+        async with global_limit:
+            logger.info("Processing [%s]: %s", idx, url)
+            with url_trace() as trace:
+                with stages['fetch'].track():
+                    async with host_limits[host_key(url)]:
+                        html_content = await get_page_content_async(client, url)
+
+                plan = None
+                if html_content:
+                    wait_start = time.perf_counter()
+                    async with cpu_slots:
+                        stages['extract'].waited += time.perf_counter() - wait_start
+                        domain = rule_domain(url)
+                        rules = {kind: EXTRACTION_RULES.get(domain, kind) for kind in ('image', 'logo')}
+                        plan = await loop.run_in_executor(process_pool, extract_page_plan, url, html_content, backend, rules)
+                    if plan is not None:
+                        # Count worker-side time so IPC and queueing don't inflate utilisation
+                        stages['extract'].tasks += 1
+                        stages['extract'].busy += plan['elapsed']
+                        merge_trace(plan['metrics'])
+
+                with stages['probe'].track():
+                    result = await loop.run_in_executor(io_executor, in_context(finish_page_plan, idx, url, plan))
+            return attach_metrics(result, trace)
+
+    pending = deque()
+    try:
+        async with create_async_http_client() as client:
+            entries = iter(entries)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < window:
+                    entry = next(entries, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    pending.append(asyncio.ensure_future(process(client, *entry)))
+                if not pending:
+                    break
+                yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        io_executor.shutdown(wait=False)
+        process_pool.shutdown(wait=False, cancel_futures=True)
+        if stats is not None:
+            wall_time = time.perf_counter() - started
+            stats['wall_seconds'] = round(wall_time, 3)
+            stats['stages'] = {name: stage.report(wall_time) for name, stage in stages.items()}
+
+def print_pipeline_stats(stats):
+    print(f"Pipeline wall time: {stats['wall_seconds']}s")
+    for name, report in stats['stages'].items():
+        print(f"  {name:8s} tasks={report['tasks']} busy={report['busy_seconds']}s "
+              f"capacity={report['capacity']} utilisation={report['utilisation']:.0%} "
+              f"backpressure_wait={report['backpressure_wait_seconds']}s")
+
+async def scrape_images_from_links_async(links, max_concurrency=None, per_host_concurrency=None):
     """
-    Extract logo URL from the page.
-    Checks header/nav areas and elements with 'logo' in class/id attributes.
-    Returns the logo URL or None if not found.
+    Concurrent version of scrape_images_from_links: same result dicts, in
+    input order.
     """
-    if not soup:
+    entries = enumerate(links, start=1)
+    return [result async for result in iter_scrape_results_async(entries, max_concurrency, per_host_concurrency)]
+
+# Thumbnails: optional output stage for the selected image, logo and favicon
+THUMBNAIL_CONFIG = {
+    'enabled': False,
+    'dir': 'thumbnails',               # content-addressed files: DIR/ab/<sha256>.<format>
+    'size': 256,                       # every thumbnail is exactly size x size (padded, transparent)
+    'format': 'webp',                  # webp or png; both keep the alpha channel
+    'quality': 85,                     # webp quality
+    'workers': None,                   # decode/resize/encode processes (None: one per core)
+    'fetch_concurrency': 8,            # downloads in flight for bodies the probes didn't keep
+    'batch_size': 32,                  # rows per batch in streaming runs
+    'retain_bytes': 64 * 1024 * 1024,  # memory for image bodies the probes read in full
+}
+
+# Row field -> key the thumbnail path is written to
+THUMBNAIL_FIELDS = {'image_path': 'image_thumbnail', 'logo': 'logo_thumbnail', 'favicon': 'favicon_thumbnail'}
+
+class RetainedImageBytes:
+    """
+    Image bodies the probes read in full, kept (LRU, bounded by
+    THUMBNAIL_CONFIG['retain_bytes'] in total) so the thumbnail stage
+    doesn't download them again. Only fills while thumbnails are enabled.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def put(self, url, data):
+        limit = THUMBNAIL_CONFIG['retain_bytes']
+        if not THUMBNAIL_CONFIG['enabled'] or not data or len(data) > limit:
+            return
+        data = bytes(data)
+        with self.lock:
+            previous = self.entries.pop(url, None)
+            if previous is not None:
+                self.total -= len(previous)
+            self.entries[url] = data
+            self.total += len(data)
+            while self.total > limit:
+                _, evicted = self.entries.popitem(last=False)
+                self.total -= len(evicted)
+
+    def get(self, url):
+        with self.lock:
+            data = self.entries.get(url)
+            if data is not None:
+                self.entries.move_to_end(url)
+            return data
+
+RETAINED_IMAGE_BYTES = RetainedImageBytes()
+
+def data_url_bytes(url):
+    """Payload of a data: URI (base64 or percent-encoded), or None if malformed."""
+    header, _, payload = url.partition(',')
+    try:
+        if header.endswith(';base64'):
+            return base64.b64decode(payload)
+        return unquote_to_bytes(payload)
+    except ValueError:
         return None
-    
-    # Common header/nav selectors (similar to check_header_image)
-    header_selectors = [
-        'header',
-        'nav',
-        {'class': 'header'},
-        {'id': 'header'},
-        {'class': 'navbar'},
-        {'id': 'navbar'},
-        {'class': 'nav'},
-        {'id': 'nav'},
-        {'class': 'site-header'},
-        {'id': 'site-header'},
-        {'class': 'main-header'},
-        {'id': 'main-header'},
-        {'class': 'logo'},
-        {'id': 'logo'},
-        {'class': 'site-logo'},
-        {'id': 'site-logo'},
-        {'class': 'brand'},
-        {'id': 'brand'},
-        {'class': 'branding'},
-        {'id': 'branding'}
-    ]
-    
-    # Collect header/nav/logo elements
-    logo_elements = []
-    seen_ids = set()
-    
-    for selector in header_selectors:
-        if isinstance(selector, str):
-            found_elements = soup.find_all(selector)
-        else:
-            found_elements = soup.find_all(attrs=selector)
-        
-        for element in found_elements:
-            element_id = id(element)
-            if element_id not in seen_ids:
-                seen_ids.add(element_id)
-                logo_elements.append(element)
-    
-    # Also search for elements with 'logo' in class or id anywhere on page
-    # Search by class containing 'logo'
-    logo_class_elements = soup.find_all(class_=lambda x: x and any('logo' in str(cls).lower() for cls in (x if isinstance(x, list) else [x])))
-    for element in logo_class_elements:
-        element_id = id(element)
-        if element_id not in seen_ids:
-            seen_ids.add(element_id)
-            logo_elements.append(element)
-    
-    # Search by id containing 'logo'
-    all_elements = soup.find_all(id=True)
-    for element in all_elements:
-        element_id_obj = id(element)
-        if element_id_obj not in seen_ids:
-            elem_id = str(element.get('id', '')).lower()
-            if 'logo' in elem_id or 'brand' in elem_id:
-                seen_ids.add(element_id_obj)
-                logo_elements.append(element)
-    
-    # Check each logo element for images
-    for logo_element in logo_elements:
-        # Check if the element itself is an anchor tag with logo
-        if logo_element.name == 'a':
-            # Check for img inside anchor
-            img_in_anchor = logo_element.find('img')
-            if img_in_anchor:
-                img_src = img_in_anchor.get('src') or img_in_anchor.get('data-src') or img_in_anchor.get('data-lazy-src')
-                if img_src:
-                    logo_url = urljoin(url, img_src)
-                    if not logo_url.startswith('data:'):
-                        print(f"  ✓ Found logo via anchor img tag: {logo_url}")
-                        return logo_url
-        
-        # Check for img tags (search recursively within logo element)
-        img_tags = logo_element.find_all('img', recursive=True)
-        for img_tag in img_tags:
-            img_src = img_tag.get('src') or img_tag.get('data-src') or img_tag.get('data-lazy-src')
-            if img_src:
-                logo_url = urljoin(url, img_src)
-                if not logo_url.startswith('data:'):
-                    print(f"  ✓ Found logo via img tag: {logo_url}")
-                    return logo_url
-        
-        # Check for SVG tags (inline or referenced) - search recursively
-        svg_tags = logo_element.find_all('svg', recursive=True)
-        for svg_tag in svg_tags:
-            # Check for SVG with image inside
-            svg_img = svg_tag.find('image')
-            if svg_img:
-                href = svg_img.get('href') or svg_img.get('xlink:href')
-                if href:
-                    logo_url = urljoin(url, href)
-                    if not logo_url.startswith('data:'):
-                        print(f"  ✓ Found logo via SVG image: {logo_url}")
-                        return logo_url
-            
-            # Check for SVG with use tag (referencing external SVG)
-            svg_use = svg_tag.find('use')
-            if svg_use:
-                href = svg_use.get('href') or svg_use.get('xlink:href')
-                if href:
-                    logo_url = urljoin(url, href)
-                    if not logo_url.startswith('data:'):
-                        print(f"  ✓ Found logo via SVG use: {logo_url}")
-                        return logo_url
-            
-            # Check if SVG itself is a link (some sites wrap logo SVG in <a>)
-            svg_parent = svg_tag.find_parent('a')
-            if svg_parent and svg_parent.get('href'):
-                # This is likely a logo link, but we want the SVG content
-                # For now, if it's an inline SVG, we'll skip (would need special handling)
-                pass
-            
-            # For inline SVG, we could return a data URL, but for now skip
-            # as it requires special handling
-        
-        # Check for background-image in style attribute
-        style = logo_element.get('style', '')
-        if style and 'background-image' in style:
-            # Extract URL from background-image: url(...)
-            bg_match = re.search(r'url\(["\']?([^"\']+)["\']?\)', style)
-            if bg_match:
-                logo_url = urljoin(url, bg_match.group(1))
-                if not logo_url.startswith('data:'):
-                    print(f"  ✓ Found logo via background-image: {logo_url}")
-                    return logo_url
-        
-        # Check for CSS class that might have background-image
-        # (This would require CSS parsing, skip for now)
-    
-    # Fallback: Check all img tags in header/nav areas more broadly
-    header_elements = []
-    for selector in ['header', 'nav']:
-        header_elements.extend(soup.find_all(selector))
-    
-    for header_element in header_elements:
-        img_tags = header_element.find_all('img')
-        for img_tag in img_tags:
-            # Check if img tag or parent has logo-related attributes
-            img_attrs = ' '.join([
-                ' '.join(img_tag.get('class', [])),
-                str(img_tag.get('id', '')),
-                str(img_tag.get('alt', ''))
-            ]).lower()
-            
-            parent = img_tag.find_parent()
-            if parent:
-                parent_attrs = ' '.join([
-                    ' '.join(parent.get('class', [])),
-                    str(parent.get('id', ''))
-                ]).lower()
-                img_attrs += ' ' + parent_attrs
-            
-            if 'logo' in img_attrs or 'brand' in img_attrs:
-                img_src = img_tag.get('src') or img_tag.get('data-src') or img_tag.get('data-lazy-src')
-                if img_src:
-                    logo_url = urljoin(url, img_src)
-                    if not logo_url.startswith('data:'):
-                        print(f"  ✓ Found logo in header/nav: {logo_url}")
-                        return logo_url
-    
-    print(f"  ✗ No logo found")
-    return None
 
-def check_header_image(url, soup, max_images_to_check=10):
-    if not soup:
+def fetch_image_body(url):
+    """Plain HTTP download of url, capped at IMAGE_PROBE_CONFIG['max_bytes']. None on failure."""
+    buf = bytearray()
+    try:
+        HOST_SCHEDULER.wait(url)
+        with get_http_client().stream('GET', url, headers=image_request_headers(url),
+                                      timeout=HTTP_CLIENT_CONFIG['image_timeout']) as response:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(chunk_size=16384):
+                buf.extend(chunk)
+                if len(buf) > IMAGE_PROBE_CONFIG['max_bytes']:
+                    return None
+    except (httpx.RequestError, httpx.HTTPStatusError):
         return None
-    
-    # Common header/nav selectors
-    header_selectors = [
-        'header',
-        'nav',
-        {'class': 'header'},
-        {'id': 'header'},
-        {'class': 'navbar'},
-        {'id': 'navbar'},
-        {'class': 'nav'},
-        {'id': 'nav'},
-        {'class': 'site-header'},
-        {'id': 'site-header'},
-        {'class': 'main-header'},
-        {'id': 'main-header'}
-    ]
-    
-    # Collect header/nav elements, preserving order and avoiding duplicates
-    header_elements = []
-    seen_ids = set()
-    for selector in header_selectors:
-        if isinstance(selector, str):
-            found_elements = soup.find_all(selector)
+    return bytes(buf)
+
+def thumbnail_source_bytes(url):
+    """Bytes to thumbnail for url: inline data: URI, a retained probe body, or a fresh download."""
+    if url.startswith('data:'):
+        count('thumbnail_sources', source='inline')
+        return data_url_bytes(url)
+    # Probes run (and retain bodies) on the canonical URL, not the row's spelling
+    url = normalize_url(url)
+    data = RETAINED_IMAGE_BYTES.get(url)
+    if data is not None:
+        count('thumbnail_sources', source='retained')
+        return data
+    data = fetch_image_body(url)
+    count('thumbnail_sources', source='fetched' if data else 'failed')
+    return data
+
+def decode_ico(data):
+    """
+    Decode the largest image of an ICO file, which cv2.imdecode can't
+    read: embedded PNGs are decoded as they are, BMP entries get a file
+    header and their 1-bit AND mask applied as alpha. Returns a BGRA
+    array, or None.
+    """
+    try:
+        count_entries = struct.unpack('<H', data[4:6])[0]
+        entries = []
+        for position in range(count_entries):
+            entry = data[6 + position * 16:22 + position * 16]
+            width, height = entry[0] or 256, entry[1] or 256
+            bits, length, offset = struct.unpack('<HII', entry[6:16])
+            entries.append((width * height, bits, length, offset))
+        if not entries:
+            return None
+        _, _, length, offset = max(entries)
+        image = data[offset:offset + length]
+        if image[:8] == b'\x89PNG\r\n\x1a\n':
+            return cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_UNCHANGED)
+
+        # BMP without its file header; the DIB height covers the XOR image plus the AND mask
+        header_size, width, double_height, _, bits, _, _, _, _, colors_used = struct.unpack('<IiiHHIIiiI', image[:36])
+        height = abs(double_height) // 2
+        palette = (colors_used or (1 << bits)) * 4 if bits <= 8 else 0
+        if bits == 32:
+            # BGRA rows, bottom-up (cv2 would drop the alpha channel)
+            img = np.frombuffer(image, np.uint8, count=width * height * 4, offset=header_size)
+            img = img.reshape(height, width, 4)[::-1].copy()
+            if img[:, :, 3].any():
+                return img
         else:
-            found_elements = soup.find_all(attrs=selector)
-        
-        for element in found_elements:
-            element_id = id(element)
-            if element_id not in seen_ids:
-                seen_ids.add(element_id)
-                header_elements.append(element)
-    
-    if not header_elements:
-        return None
-    
-    images_checked = 0
-    
-    for header_element in header_elements:
-        img_tags = header_element.find_all('img')
-        for img_tag in img_tags:
-            if images_checked >= max_images_to_check:
+            dib = bytearray(image)
+            dib[8:12] = struct.pack('<i', height)
+            bmp = b'BM' + struct.pack('<IHHI', 14 + len(dib), 0, 0, 14 + header_size + palette) + bytes(dib)
+            img = cv2.imdecode(np.frombuffer(bmp, np.uint8), cv2.IMREAD_UNCHANGED)
+            if img is None:
                 return None
-            
-            img_src = img_tag.get('src') or img_tag.get('data-src') or img_tag.get('data-lazy-src')
-            if not img_src:
-                continue
-            
-            img_url = urljoin(url, img_src)
-            
-            if img_url.startswith('data:'):
-                continue
-            
-            images_checked += 1
-            
-            # Verify image before downloading (skip SVG, 150x150, etc.)
-            verify_result = verify_image(img_url, img_tag)
-            if verify_result is False:
-                continue  # Skip this image
-            if verify_result is True:
-                return img_url  # Use this image (size > 150x150 from HTML attributes)
-            
-            # If verify returns None, need to download and check
-            if check_size(img_url):
-                return img_url
-    
-    return None
-
-def check_container_images(url, soup, container_tag, max_images_to_check=20):
-    if not soup:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA if img.ndim == 2 else cv2.COLOR_BGR2BGRA)
+        # Transparency from the AND mask: 1 bit per pixel, rows padded to 4 bytes, bottom-up
+        mask_offset = header_size + palette + ((width * bits + 31) // 32) * 4 * height
+        stride = ((width + 31) // 32) * 4
+        mask = np.frombuffer(image, np.uint8, count=stride * height, offset=mask_offset)
+        mask = np.unpackbits(mask.reshape(height, stride), axis=1)[:, :width][::-1]
+        img[:, :, 3] = np.where(mask, 0, 255)
+        return img
+    except (struct.error, ValueError, IndexError):
         return None
-    
-    containers = soup.find_all(container_tag, recursive=True)
-    images_checked = 0
-    
-    for container in containers:
-        # Check if the container has ad keywords in class or id
-        if is_ad_div(container):
-            continue
-        
-        img_tags = container.find_all('img')
-        if not img_tags:
-            continue
-        
-        for img_tag in img_tags:
-            if images_checked >= max_images_to_check:
-                return None
-            
-            img_src = img_tag.get('src') or img_tag.get('data-src') or img_tag.get('data-lazy-src')
-            if not img_src:
-                continue
-            
-            img_url = urljoin(url, img_src)
-            
-            if img_url.startswith('data:'):
-                continue
-            
-            images_checked += 1
-            
-            # Verify image before downloading (skip SVG, 150x150, etc.)
-            verify_result = verify_image(img_url, img_tag)
-            if verify_result is False:
-                continue  # Skip this image
-            if verify_result is True:
-                return img_url  # Use this image (size > 150x150 from HTML attributes)
-            
-            # If verify returns None, need to download and check
-            if not check_size(img_url):
-                continue
-            
-            return img_url
-    
-    return None
 
-def check_all_images(url, soup, max_images_to_check=30):
-    if not soup:
+def render_thumbnail(data, size, fmt, quality):
+    """
+    Process-pool task: decode image bytes in memory, fit them into a
+    size x size box (centred, transparent padding) and encode as fmt.
+    SVG is rasterized with cairosvg when it is installed; ICO goes
+    through decode_ico.
+    Returns the encoded bytes, or None if the image can't be decoded.
+    """
+    if b'<svg' in data[:2048].lower():
+        if cairosvg is None:
+            return None
+        try:
+            data = cairosvg.svg2png(bytestring=data, output_width=size)
+        except Exception:
+            return None
+    if data[:4] == b'\x00\x00\x01\x00':
+        img = decode_ico(data)
+    else:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None or img.size == 0:
         return None
-    
-    # Get all img tags from the entire page
-    all_img_tags = soup.find_all('img', recursive=True)
-   
-    if not all_img_tags:
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    elif img.dtype != np.uint8:
         return None
-    
-    images_checked = 0
-    fallback_images = []  # Store images with HTML attributes > 150x150 for fallback
-    
-    print(f"---------------check_all_images-----------------"*10)
-    for img_tag in all_img_tags:
-        print(f"--------------------------------"*10)
-        print(img_tag)
-        if images_checked >= max_images_to_check:
-            break
-        
-        # Get image source
-        img_src = img_tag.get('src') or img_tag.get('data-src') or img_tag.get('data-lazy-src')
-        if not img_src:
-            continue
-        
-        img_url = urljoin(url, img_src)
-        
-        # Skip data URLs
-        if img_url.startswith('data:'):
-            continue
-        
-        images_checked += 1
-        
-        print(f"Checking image {images_checked}: {img_url}")
-        
-        # Check if not SVG and has HTML attributes > 150x150 for fallback
-        # (Collect these before verify_image so we have them as fallback)
-        if not img_url.lower().endswith('.svg'):
-            width = img_tag.get('width')
-            height = img_tag.get('height')
-            if width and height:
-                try:
-                    w = int(width)
-                    h = int(height)
-                    if w > 150 and h > 150:
-                        fallback_images.append(img_url)
-                        print(f"    Stored as fallback candidate (HTML: {w}x{h})")
-                except (ValueError, TypeError):
-                    pass
-        
-        # Verify image based on extension and HTML attributes
-        verify_result = verify_image(img_url, img_tag)
-        
-        # If verify returns False, skip this image
-        if verify_result is False:
-            continue
-        
-        # If verify returns True, use this image (size > 150x150 from HTML attributes)
-        if verify_result is True:
-            print(f"  ✓ Found suitable image from HTML attributes: {img_url}")
-            return img_url
-        
-        # If verify returns None, need to download and check
-        
-        # Try to download and check size
-        size_result = check_size(img_url)
-        print(f"  Size check result: {size_result}")
-        if size_result:
-            print(f"  ✓ Found suitable image: {img_url}")
-            return img_url
-        else:
-            print(f"  ✗ Image failed size check or download")
-    
-    # If no image found via download, use fallback (first image with HTML attributes > 150x150)
-    if fallback_images:
-        print(f"  Using fallback image (HTML attributes > 150x150): {fallback_images[0]}")
-        return fallback_images[0]
-    
-    return None
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    elif img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
 
-def scrape_first_image(url, soup, max_images_to_check=20):
-    if not soup:
-        return None
-    
-    # Step 1: First check header/nav for images
-    header_image = check_header_image(url, soup, max_images_to_check)
-    if header_image:
-        return header_image
-    
-    # Step 2: Check figure tags for images (often used for main content images)
-    figure_image = check_container_images(url, soup, 'figure', max_images_to_check)
-    if figure_image:
-        return figure_image
-    
-    # Step 3: Check divs for images
-    div_image = check_container_images(url, soup, 'div', max_images_to_check)
-    if div_image:
-        return div_image
-    
-    # Step 4: Get all image tags and check first suitable image
-    all_images_result = check_all_images(url, soup, max_images_to_check)
-    if all_images_result:
-        return all_images_result
-    
-    return None
+    height, width = img.shape[:2]
+    scale = min(size / width, size / height)
+    new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    img = cv2.resize(img, (new_width, new_height), interpolation=interpolation)
+    canvas = np.zeros((size, size, 4), np.uint8)
+    top, left = (size - new_height) // 2, (size - new_width) // 2
+    canvas[top:top + new_height, left:left + new_width] = img
 
-def scrape_page(url):
-    html_content = get_page_content(url)
-    if not html_content:
-        return None
-    soup = BeautifulSoup(html_content, 'html.parser')
-    return soup
+    params = [cv2.IMWRITE_WEBP_QUALITY, quality] if fmt == 'webp' else []
+    ok, encoded = cv2.imencode('.' + fmt, canvas, params)
+    return encoded.tobytes() if ok else None
 
-def scrape_images_from_links(links):
-   
-    results = []
-    
-    for idx, url in enumerate(links, start=1):
-        print(f"Processing [{idx}/{len(links)}]: {url}")        
-        soup = scrape_page(url)
-
-        # Check if page content was successfully retrieved
-        if not soup:
-            print(f"  ✗ Failed to retrieve page content (timeout or error)")
-            result_item = {
-                "id": idx,
-                "url": url,
-                "image_path": "No image found",
-                "favicon": "No favicon found",
-                "logo": "No logo found"
-            }
-            results.append(result_item)
-            print()  # Empty line for readability
-            continue
+def write_thumbnail(encoded, directory, fmt):
+    """Store encoded under its content hash; returns the path (existing files are reused)."""
+    digest = hashlib.sha256(encoded).hexdigest()
+    path = os.path.join(directory, digest[:2], f'{digest}.{fmt}')
+    if os.path.exists(path):
+        count('thumbnails', outcome='existing')
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(encoded)
+    os.replace(tmp_path, path)
+    count('thumbnails', outcome='written')
+    return path
 
-        image_url = scrape_first_image(url, soup)
-        favicon = get_favicon(url, soup)
-        logo = get_logo(url, soup)
-        
-        result_item = {
-            "id": idx,
-            "url": url,
-            "image_path": image_url if image_url else "No image found",
-            "favicon": favicon if favicon else "No favicon found",
-            "logo": logo if logo else "No logo found"
-        }
-        
-        results.append(result_item)
-        
-        if image_url:
-            print(f"  ✓ Found image: {image_url}")
-        else:
-            print(f"  ✗ No image found")
-        
-        if favicon:
-            print(f"  ✓ Found favicon: {favicon}")
-        else:
-            print(f"  ✗ No favicon found")
-        
-        if logo:
-            print(f"  ✓ Found logo: {logo}")
-        else:
-            print(f"  ✗ No logo found")
-        
-        print()  # Empty line for readability
-    
-    return results
+class ThumbnailStage:
+    """
+    Batched thumbnails for result rows. For each batch the unique image,
+    logo and favicon URLs are gathered, their bytes taken from
+    RETAINED_IMAGE_BYTES or downloaded on a thread pool, and all of them
+    decoded, resized and encoded in one go on a process pool.
+    Each row gains image_thumbnail, logo_thumbnail and favicon_thumbnail
+    (file path, or None). Use as a context manager to release the pools.
+    """
+
+    def __init__(self):
+        self.fetch_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_CONFIG['fetch_concurrency'])
+        self.process_pool = None  # started on the first batch with something to render
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        self.fetch_pool.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _render(self, bodies):
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_CONFIG['workers'] or os.cpu_count(),
+                                                    mp_context=multiprocessing.get_context('spawn'))
+        size, fmt = THUMBNAIL_CONFIG['size'], THUMBNAIL_CONFIG['format']
+        return self.process_pool.map(render_thumbnail, bodies, itertools.repeat(size), itertools.repeat(fmt),
+                                     itertools.repeat(THUMBNAIL_CONFIG['quality']))
+
+    def process(self, rows):
+        """Add thumbnail paths to rows (in place) and return them."""
+        urls = list(dict.fromkeys(
+            row[field] for row in rows for field in THUMBNAIL_FIELDS
+            if isinstance(row.get(field), str) and row[field].startswith(('http://', 'https://', 'data:'))
+        ))
+        with timed('thumbnail_fetch'):
+            bodies = dict(zip(urls, self.fetch_pool.map(thumbnail_source_bytes, urls)))
+        bodies = {url: data for url, data in bodies.items() if data}
+        paths = {}
+        if bodies:
+            with timed('thumbnail_render'):
+                for url, encoded in zip(bodies, self._render(bodies.values())):
+                    if encoded:
+                        paths[url] = write_thumbnail(encoded, THUMBNAIL_CONFIG['dir'], THUMBNAIL_CONFIG['format'])
+                    else:
+                        logger.info("  ✗ Could not render thumbnail for %s", url[:120])
+                        count('thumbnails', outcome='undecodable')
+        for row in rows:
+            for field, key in THUMBNAIL_FIELDS.items():
+                row[key] = paths.get(row.get(field))
+        return rows
 
+def add_thumbnails(rows):
+    """Run a finished result list through a ThumbnailStage, batch_size rows at a time."""
+    batch_size = THUMBNAIL_CONFIG['batch_size']
+    with ThumbnailStage() as stage:
+        for start in range(0, len(rows), batch_size):
+            stage.process(rows[start:start + batch_size])
+    return rows
 
 if __name__ == "__main__":
     # Scrape images from all URLs in links.md
@@ -902,14 +4660,142 @@ if __name__ == "__main__":
         
     ]
     
-    results = scrape_images_from_links(links)
+    parser = argparse.ArgumentParser(description="Scrape hero image, favicon and logo for each link")
+    parser.add_argument('--sequential', action='store_true', help="process URLs one at a time (fallback mode)")
+    parser.add_argument('--concurrency', type=int, default=CRAWL_CONFIG['max_concurrency'], help="max URLs in flight")
+    parser.add_argument('--per-host', type=int, default=CRAWL_CONFIG['per_host_concurrency'], help="max page fetches in flight per host")
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, default=PARSER_CONFIG['backend'], help="HTML parser backend")
+    parser.add_argument('--compare-parsers', metavar='LINKS_MD', nargs='?', const='links.md', help="check that every parser backend gives identical results on the links in LINKS_MD and compare parse times")
+    parser.add_argument('--probe-lookahead', type=int, default=SPECULATIVE_PROBE_CONFIG['lookahead'], help="image probes in flight per candidate list (1 = serial)")
+    parser.add_argument('--probe-budget', type=int, default=SPECULATIVE_PROBE_CONFIG['page_probe_budget'], help="max image probes per page")
+    parser.add_argument('--offline', action='store_true', help="serve pages and image sizes from the cache only (re-run extraction on stored HTML)")
+    parser.add_argument('--no-page-cache', action='store_true', help="always fetch pages from the network")
+    parser.add_argument('--input', metavar='PATH', help="stream URLs from PATH ('-' for stdin): plain lines, links.md-style markdown or JSONL")
+    parser.add_argument('--output', metavar='PATH', default='result.jsonl', help="JSONL output for --input runs")
+    parser.add_argument('--checkpoint', metavar='PATH', help="checkpoint file for --input runs (default: OUTPUT.checkpoint)")
+    parser.add_argument('--no-resume', action='store_true', help="ignore an existing checkpoint and start over")
+    parser.add_argument('--processes', type=int, nargs='?', const=PIPELINE_CONFIG['processes'], default=0, help="parse and extract in a process pool of N workers (default: one per core)")
+    parser.add_argument('--queue', metavar='DB', help="shared work queue (SQLite file) for distributed mode")
+    parser.add_argument('--enqueue', metavar='PATH', help="with --queue: add the URLs from PATH (see --input) to the queue")
+    parser.add_argument('--worker', action='store_true', help="with --queue: run a worker until the queue is drained")
+    parser.add_argument('--export', metavar='PATH', help="with --queue: write the collected results to PATH as JSONL")
+    parser.add_argument('--min-interval', type=float, default=POLITENESS_CONFIG['default_min_interval'], help="minimum seconds between requests to the same host")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="DEBUG shows every candidate and probe decision")
+    parser.add_argument('--metrics-file', metavar='PATH', help="write counters and stage histograms to PATH in Prometheus text format when the run ends")
+    parser.add_argument('--metrics-in-results', action='store_true', help="add a per-URL timing/probe breakdown to each result row")
+    parser.add_argument('--max-page-bytes', type=int, default=STREAMING_FETCH_CONFIG['max_body_bytes'], help="stop reading page bodies after this many bytes")
+    parser.add_argument('--early-stop', action='store_true', help="stop reading a page once its head and first bytes give the image, favicon and logo")
+    parser.add_argument('--full-browser', action='store_true', help="let Selenium load every resource and wait for the full page load (no lean mode)")
+    parser.add_argument('--no-escalation', action='store_true', help="only use the browser after HTTP errors, never for challenge/shell pages, and forget nothing per domain")
+    parser.add_argument('--no-browser-sessions', action='store_true', help="don't reuse cookies from browser page loads in plain HTTP requests")
+    parser.add_argument('--show-sessions', action='store_true', help="print the browser cookie sessions stored per domain")
+    parser.add_argument('--forget-sessions', metavar='DOMAIN', nargs='?', const='', help="drop the stored browser cookie sessions (all domains, or DOMAIN)")
+    parser.add_argument('--show-fetch-modes', action='store_true', help="print the fetch mode remembered for each domain")
+    parser.add_argument('--ad-filter-list', metavar='PATH', help="EasyList-style file whose generic ##.class / ###id element hiding rules also mark ad containers")
+    parser.add_argument('--thumbnails', metavar='DIR', nargs='?', const=THUMBNAIL_CONFIG['dir'], help="write content-addressed thumbnails of each image, logo and favicon to DIR (default: thumbnails) and add their paths to the rows")
+    parser.add_argument('--thumbnail-size', type=int, default=THUMBNAIL_CONFIG['size'], help="thumbnail width and height in pixels")
+    parser.add_argument('--thumbnail-format', choices=['webp', 'png'], default=THUMBNAIL_CONFIG['format'], help="thumbnail file format")
+    parser.add_argument('--no-rules', action='store_true', help="don't use or learn per-domain extraction rules")
+    parser.add_argument('--show-rules', metavar='DOMAIN', nargs='?', const='', help="print the learned extraction rules (all domains, or DOMAIN)")
+    parser.add_argument('--forget-rules', metavar='DOMAIN', nargs='?', const='', help="drop the learned extraction rules (all domains, or DOMAIN)")
+    args = parser.parse_args()
+    # Third-party loggers (httpx logs every request at INFO) stay at WARNING
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(args.log_level)
+    METRICS_CONFIG['enabled'] = bool(args.metrics_file or args.metrics_in_results)
+    METRICS_CONFIG['include_in_results'] = args.metrics_in_results
+    POLITENESS_CONFIG['default_min_interval'] = args.min_interval
+    PARSER_CONFIG['backend'] = args.parser
+    SPECULATIVE_PROBE_CONFIG['lookahead'] = args.probe_lookahead
+    PAGE_CACHE_CONFIG['offline'] = args.offline
+    PAGE_CACHE_CONFIG['enabled'] = not args.no_page_cache
+    SPECULATIVE_PROBE_CONFIG['page_probe_budget'] = args.probe_budget
+    EXTRACTION_RULES_CONFIG['enabled'] = not args.no_rules
+    STREAMING_FETCH_CONFIG['max_body_bytes'] = args.max_page_bytes
+    STREAMING_FETCH_CONFIG['early_stop'] = args.early_stop
+    CONTENT_CLASSIFIER_CONFIG['enabled'] = FETCH_MODE_CONFIG['enabled'] = not args.no_escalation
+    BROWSER_LEAN_CONFIG['enabled'] = not args.full_browser
+    BROWSER_SESSION_CONFIG['enabled'] = not args.no_browser_sessions
+    AD_FILTER_CONFIG['easylist_path'] = args.ad_filter_list
+    THUMBNAIL_CONFIG['enabled'] = args.thumbnails is not None
+    THUMBNAIL_CONFIG['dir'] = args.thumbnails or THUMBNAIL_CONFIG['dir']
+    THUMBNAIL_CONFIG['size'] = args.thumbnail_size
+    THUMBNAIL_CONFIG['format'] = args.thumbnail_format
+    reset_ad_filter()
+
+    results = None
+    if args.show_rules is not None or args.forget_rules is not None:
+        if args.forget_rules is not None:
+            EXTRACTION_RULES.forget(args.forget_rules or None)
+            print(f"Forgot extraction rules for {args.forget_rules or 'all domains'}")
+        if args.show_rules is not None:
+            for entry in EXTRACTION_RULES.list(args.show_rules or None):
+                learned = time.strftime('%Y-%m-%d', time.localtime(entry['learned_at']))
+                print(f"{entry['domain']} {entry['kind']}: {json.dumps(entry['rule'], sort_keys=True)} "
+                      f"(hits={entry['hits']}, misses={entry['misses']}, learned {learned})")
+    elif args.show_sessions or args.forget_sessions is not None:
+        if args.forget_sessions is not None:
+            BROWSER_SESSIONS.forget(args.forget_sessions or None)
+            print(f"Forgot browser sessions for {args.forget_sessions or 'all domains'}")
+        if args.show_sessions:
+            for entry in BROWSER_SESSIONS.list():
+                captured = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['captured_at']))
+                print(f"{entry['domain']}: {entry['cookies']} cookies, captured {captured} ({entry['user_agent']})")
+    elif args.show_fetch_modes:
+        for entry in FETCH_MODES.list():
+            updated = time.strftime('%Y-%m-%d', time.localtime(entry['updated_at']))
+            print(f"{entry['domain']}: {entry['mode']} (streak={entry['streak']}, since {updated})")
+    elif args.compare_parsers:
+        report = compare_parser_backends(read_links_markdown(args.compare_parsers))
+        raise SystemExit(1 if report['mismatches'] else 0)
+    elif args.queue:
+        queue = SQLiteWorkQueue(args.queue)
+        sink = SQLiteResultSink(args.queue)
+        if args.enqueue:
+            print(f"Enqueued {queue.enqueue(iter_links(args.enqueue))} URLs")
+        if args.worker:
+            print(f"Worker finished {run_worker(queue, sink)} URLs")
+        if args.export:
+            print(f"Exported {sink.export_jsonl(args.export)} results to {args.export}")
+        print(f"Queue: {queue.counts()}")
+    elif args.input:
+        written = run_streaming(args.input, args.output, args.checkpoint, resume=not args.no_resume,
+                                sequential=args.sequential, max_concurrency=args.concurrency,
+                                per_host_concurrency=args.per_host, processes=args.processes)
+        print(f"\nWrote {written} results to {args.output}")
+        print(f"Image cache: {IMAGE_CACHE.stats()}")
+        print(f"Page cache: {PAGE_CACHE.stats()}")
+        print(f"Favicon cache: {FAVICON_CACHE.stats()}")
+        print(f"Extraction rules: {EXTRACTION_RULES.stats()}")
+    elif args.sequential:
+        results = scrape_images_from_links(links)
+    elif args.processes:
+        stats = {}
+        async def collect():
+            entries = enumerate(links, start=1)
+            return [result async for result in iter_scrape_results_pipeline(
+                entries, args.concurrency, args.per_host, args.processes, stats=stats)]
+        results = asyncio.run(collect())
+        print_pipeline_stats(stats)
+    else:
+        results = asyncio.run(scrape_images_from_links_async(links, args.concurrency, args.per_host))
     
+    if results and THUMBNAIL_CONFIG['enabled']:
+        results = add_thumbnails(results)
+
     if results: 
         # Save results to JSON
-        import json
         with open('result.json', 'w', encoding='utf-8') as f:
             json.dump(results, f, indent=2, ensure_ascii=False)
         
         print(f"\nResults saved to result.json")
+        print(f"Image cache: {IMAGE_CACHE.stats()}")
+        print(f"Page cache: {PAGE_CACHE.stats()}")
+        print(f"Favicon cache: {FAVICON_CACHE.stats()}")
+        print(f"Extraction rules: {EXTRACTION_RULES.stats()}")
         print(f"Total URLs processed: {len(results)}")
-        print(f"Images found: {results}")
\ No newline at end of file
+        print(f"Images found: {results}")
+
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
\ No newline at end of file
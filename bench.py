@@ -0,0 +1,622 @@
+"""
+Offline benchmarks for app.py.
+
+    python bench.py record [--links links.md]    # fetch pages and their images once
+    python bench.py run [--latency 0.05 --bandwidth 500000 --error-rate 0.02 ...]
+    python bench.py serve                         # fixture server only, for manual runs
+    python bench.py adfilter [--corpus ad_filter_corpus.txt]  # ad filter corpus + heavy pages
+    python bench.py parsers                       # parser backends agree on edge-case markup
+
+`run` starts a local fixture server that replays the recording, points
+every httpx request at it (HTTP_CLIENT_CONFIG['replay_server']) with
+Selenium disabled, then measures end-to-end throughput and per-URL
+latency, microbenchmarks the hot functions and checks the answers
+against result.json. Answers that later changes altered on purpose are
+listed with a note in bench_expected_diffs.json (see --record-diffs);
+only differences not listed there fail the run. `adfilter` needs no recording: it checks is_ad_div
+against the false-positive corpus and times it on synthetic heavy pages.
+`parsers` runs PARSER_EDGE_CASES through every installed parser backend.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlsplit
+
+# Keep benchmark probes out of the real cache file
+os.environ.setdefault('SCRAPER_CACHE_DB', os.path.join(tempfile.mkdtemp(prefix='scraper-bench-'), 'cache.sqlite3'))
+
+import app
+
+FIXTURE_DIR = 'bench_fixtures'
+
+# Fault injection for the fixture server
+SERVER_CONFIG = {
+    'latency': 0.0,               # seconds added before every response
+    'jitter': 0.0,                # plus uniform random 0..jitter seconds
+    'bandwidth': None,            # bytes per second per response (None = unlimited)
+    'error_rate': 0.0,            # fraction of requests answered with 503
+    'timeout_rate': 0.0,          # fraction of requests that hang, then drop the connection
+    'timeout_seconds': 15.0,      # how long a hanging request stalls (> client timeouts)
+    'seed': 0,                    # fault sequence is reproducible per seed
+}
+
+RECORD_CONFIG = {
+    'max_asset_bytes': 8 * 1024 * 1024,
+}
+
+def fixture_key(url):
+    """Host + path + query, the part of a URL the replay server can see."""
+    parts = urlsplit(url.strip())
+    key = parts.netloc.lower() + (parts.path or '/')
+    return key + '?' + parts.query if parts.query else key
+
+def _manifest_path(fixture_dir):
+    return os.path.join(fixture_dir, 'manifest.json')
+
+def load_manifest(fixture_dir):
+    path = _manifest_path(fixture_dir)
+    if not os.path.exists(path):
+        raise SystemExit(f"No recording in {fixture_dir}; run 'python bench.py record' first")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _store(fixture_dir, manifest, url, status, content_type, body):
+    key = fixture_key(url)
+    entry = {'status': status, 'content_type': content_type, 'file': None}
+    if body is not None:
+        entry['file'] = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.bin'
+        with open(os.path.join(fixture_dir, entry['file']), 'wb') as f:
+            f.write(body)
+    manifest['responses'][key] = entry
+
+def asset_urls(url, document):
+    """Every URL the extractors may request for one page."""
+    index = app.get_dom_index(document)
+    urls = [urljoin(url, img_tag.src) for img_tag in index.images if img_tag.src]
+    urls += [urljoin(url, link['href']) for link in index.head_links if link.get('href')]
+    urls += [app.declared_favicon(url, document), app.get_logo(url, document), urljoin(url, '/favicon.ico')]
+    return list(dict.fromkeys(u for u in urls if u and not u.startswith('data:')))
+
+def record(links, fixture_dir):
+    """
+    Fetch each page (Selenium fallback included) and every image it
+    references, and write them with a manifest to fixture_dir.
+    Failed requests are recorded too and replayed as dropped connections.
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    app.PAGE_CACHE_CONFIG['enabled'] = False
+    manifest = {'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pages': [], 'responses': {}}
+    client = app.get_http_client()
+    for url in links:
+        print(f"Recording {url}")
+        manifest['pages'].append(url)
+        html_content = app.get_page_content(url)
+        if not html_content:
+            _store(fixture_dir, manifest, url, None, None, None)
+            continue
+        _store(fixture_dir, manifest, url, 200, 'text/html; charset=utf-8', html_content.encode('utf-8'))
+        for asset in asset_urls(url, app.parse_page(html_content)):
+            if fixture_key(asset) in manifest['responses']:
+                continue
+            try:
+                with client.stream('GET', asset, headers=app.image_request_headers(asset),
+                                   timeout=app.HTTP_CLIENT_CONFIG['image_timeout']) as response:
+                    body = bytearray()
+                    for chunk in response.iter_bytes():
+                        body += chunk
+                        if len(body) >= RECORD_CONFIG['max_asset_bytes']:
+                            break
+                    _store(fixture_dir, manifest, asset, response.status_code,
+                           response.headers.get('Content-Type'), bytes(body))
+            except app.httpx.HTTPError as exc:
+                print(f"  ✗ {asset}: {type(exc).__name__}")
+                _store(fixture_dir, manifest, asset, None, None, None)
+    with open(_manifest_path(fixture_dir), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Recorded {len(manifest['pages'])} pages, {len(manifest['responses'])} responses in {fixture_dir}")
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves recorded responses by Host + path, with Range support and injected faults."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _roll(self):
+        with self.server.rng_lock:
+            return self.server.rng.random(), self.server.rng.uniform(0, SERVER_CONFIG['jitter'])
+
+    def _respond(self, send_body):
+        roll, jitter = self._roll()
+        if SERVER_CONFIG['latency'] or jitter:
+            time.sleep(SERVER_CONFIG['latency'] + jitter)
+        if roll < SERVER_CONFIG['timeout_rate']:
+            time.sleep(SERVER_CONFIG['timeout_seconds'])
+            self.close_connection = True
+            return
+        if roll < SERVER_CONFIG['timeout_rate'] + SERVER_CONFIG['error_rate']:
+            self.send_error(503)
+            return
+
+        entry = self.server.manifest['responses'].get(fixture_key(self.headers.get('Host', '') + self.path))
+        if entry is None:
+            self.send_error(404)
+            return
+        if entry['status'] is None:
+            # Recorded as a network error: drop the connection without a response
+            self.close_connection = True
+            return
+
+        body = self.server.body(entry)
+        status, start, end = entry['status'], 0, len(body) - 1
+        byte_range = self.headers.get('Range', '')
+        if status == 200 and byte_range.startswith('bytes=') and body:
+            first, _, last = byte_range[len('bytes='):].partition('-')
+            if first.isdigit() and int(first) < len(body):
+                start = int(first)
+                end = min(int(last), end) if last.isdigit() else end
+                status = 206
+
+        self.send_response(status)
+        if entry['content_type']:
+            self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+        self.send_header('Content-Length', str(end - start + 1 if body else 0))
+        self.end_headers()
+        if send_body and body:
+            self._write_throttled(memoryview(body)[start:end + 1])
+
+    def _write_throttled(self, payload):
+        bandwidth = SERVER_CONFIG['bandwidth']
+        chunk_size = max(1, bandwidth // 20) if bandwidth else len(payload)
+        try:
+            for offset in range(0, len(payload), chunk_size):
+                chunk = payload[offset:offset + chunk_size]
+                self.wfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            # Probes close the stream as soon as they have the header
+            self.close_connection = True
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixture_dir):
+        super().__init__(address, FixtureHandler)
+        self.fixture_dir = fixture_dir
+        self.manifest = load_manifest(fixture_dir)
+        self.rng = random.Random(SERVER_CONFIG['seed'])
+        self.rng_lock = threading.Lock()
+        self._bodies = {}
+
+    def body(self, entry):
+        if entry['file'] is None:
+            return b''
+        if entry['file'] not in self._bodies:
+            with open(os.path.join(self.fixture_dir, entry['file']), 'rb') as f:
+                self._bodies[entry['file']] = f.read()
+        return self._bodies[entry['file']]
+
+def serve_fixtures(fixture_dir, server_config, port=0, ready=None):
+    """Run the fixture server; sends the bound port through `ready` (a Connection) if given."""
+    SERVER_CONFIG.update(server_config)
+    server = FixtureServer(('127.0.0.1', port), fixture_dir)
+    if ready is not None:
+        ready.send(server.server_address[1])
+    server.serve_forever()
+
+def start_fixture_server(fixture_dir):
+    """Start the server in its own process (so it doesn't share our GIL); returns (process, port)."""
+    parent_end, child_end = multiprocessing.Pipe()
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve_fixtures, args=(fixture_dir, dict(SERVER_CONFIG), 0, child_end), daemon=True
+    )
+    process.start()
+    if not parent_end.poll(30):
+        process.terminate()
+        raise RuntimeError("Fixture server did not start")
+    return process, parent_end.recv()
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def summarize(samples):
+    if not samples:
+        return {'n': 0}
+    return {
+        'n': len(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'max': max(samples),
+    }
+
+def _fmt(summary, scale=1000.0, unit='ms'):
+    if not summary['n']:
+        return "n=0"
+    return (f"n={summary['n']} mean={summary['mean'] * scale:.2f}{unit} "
+            f"p50={summary['p50'] * scale:.2f}{unit} p95={summary['p95'] * scale:.2f}{unit} "
+            f"max={summary['max'] * scale:.2f}{unit}")
+
+def _cold_caches():
+    app.PAGE_CACHE_CONFIG['enabled'] = False
+    app.IMAGE_CACHE_CONFIG['enabled'] = False
+    app.FAVICON_CACHE_CONFIG['enabled'] = False
+    app.EXTRACTION_RULES_CONFIG['enabled'] = False
+
+def bench_end_to_end(pages, repeat):
+    """
+    Sequential scrape_images_from_links (per-URL latency from the
+    streaming generator it wraps) and the async crawl (throughput only).
+    Caches are off so every repeat does the same network work.
+    """
+    _cold_caches()
+    latencies, sequential_wall, async_wall, results = [], [], [], None
+    for _ in range(repeat):
+        rows = []
+        started = last = time.perf_counter()
+        for row in app.iter_scrape_results(enumerate(pages, start=1)):
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+            rows.append(row)
+        sequential_wall.append(time.perf_counter() - started)
+        results = results or rows
+
+        started = time.perf_counter()
+        asyncio.run(app.scrape_images_from_links_async(pages))
+        async_wall.append(time.perf_counter() - started)
+    return {
+        'urls': len(pages) * repeat,
+        'sequential_urls_per_second': len(pages) * repeat / sum(sequential_wall),
+        'async_urls_per_second': len(pages) * repeat / sum(async_wall),
+        'latency': summarize(latencies),
+        'results': results,
+    }
+
+def _time_calls(fn, args_list, iterations):
+    """Per-call seconds for fn(*args) over every args tuple, `iterations` times."""
+    samples = []
+    for _ in range(iterations):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def bench_micro(pages, iterations):
+    """Microbenchmarks on the recorded pages: parsing, verify_image, get_logo, check_size."""
+    _cold_caches()
+    html_by_url = {url: app.get_page_content(url) for url in pages}
+    html_by_url = {url: html for url, html in html_by_url.items() if html}
+    report = {'parse': {}}
+
+    for backend in app.PARSER_BACKENDS:
+        if app._backend_available(backend):
+            samples = _time_calls(lambda html: app.get_dom_index(app.parse_html(html, backend)),
+                                  [(html,) for html in html_by_url.values()], iterations)
+            report['parse'][backend] = summarize(samples)
+
+    documents = {url: app.parse_page(html) for url, html in html_by_url.items()}
+    candidates = []
+    for url, document in documents.items():
+        candidates += app.all_image_candidates(url, app.get_dom_index(document), max_images_to_check=10**6)[0]
+    report['verify_image'] = summarize(_time_calls(app.verify_image, candidates, iterations))
+    report['get_logo'] = summarize(_time_calls(app.get_logo, list(documents.items()), iterations))
+
+    undecided = [(img_url,) for img_url, img_tag in candidates if app.verify_image(img_url, img_tag) is None]
+    report['check_size_cold'] = summarize(_time_calls(app.check_size, undecided, 1))
+    app.IMAGE_CACHE_CONFIG['enabled'] = True
+    _time_calls(app.check_size, undecided, 1)  # fill the cache
+    report['check_size_cached'] = summarize(_time_calls(app.check_size, undecided, iterations))
+    app.IMAGE_CACHE_CONFIG['enabled'] = False
+    return report
+
+EXPECTED_DIFFS = 'bench_expected_diffs.json'
+
+def load_expected_diffs(path):
+    """{(url, field, got): note} for answers that differ from the reference on purpose."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {(entry['url'].strip(), entry['field'], entry['got']): entry['note'] for entry in json.load(f)}
+
+def record_expected_diffs(path, mismatches, note):
+    """Add mismatches to the expected-diffs file under note (existing entries are kept)."""
+    entries = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    known = {(entry['url'].strip(), entry['field'], entry['got']) for entry in entries}
+    for mismatch in mismatches:
+        if (mismatch['url'].strip(), mismatch['field'], mismatch['got']) not in known:
+            entries.append({'url': mismatch['url'].strip(), 'field': mismatch['field'],
+                            'expected': mismatch['expected'], 'got': mismatch['got'], 'note': note})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    return len(entries) - len(known)
+
+def check_results(results, expected_path, expected_diffs=None):
+    """
+    Compare rows with the reference file by URL; returns the differing
+    fields. A difference listed in expected_diffs (same URL, field and new
+    answer) gets its note and counts as expected.
+    """
+    expected_diffs = expected_diffs or {}
+    with open(expected_path, encoding='utf-8') as f:
+        expected = {row['url'].strip(): row for row in json.load(f)}
+    mismatches, compared = [], 0
+    for row in results:
+        reference = expected.get(row['url'].strip())
+        if reference is None:
+            continue
+        compared += 1
+        for field in ('image_path', 'favicon', 'logo'):
+            if row[field] != reference[field]:
+                note = expected_diffs.get((row['url'].strip(), field, row[field]))
+                mismatches.append({'url': row['url'], 'field': field, 'expected': reference[field],
+                                   'got': row[field], 'note': note})
+    return compared, mismatches
+
+def run(fixture_dir, repeat, iterations, expected_path, expected_diffs_path=EXPECTED_DIFFS):
+    manifest = load_manifest(fixture_dir)
+    pages = manifest['pages']
+    server, port = start_fixture_server(fixture_dir)
+    app.HTTP_CLIENT_CONFIG['replay_server'] = f"127.0.0.1:{port}"
+    app.WEBDRIVER_POOL_CONFIG['enabled'] = False
+    try:
+        print(f"Replaying {len(pages)} pages recorded {manifest.get('recorded_at', '?')} "
+              f"(faults: {SERVER_CONFIG})")
+        end_to_end = bench_end_to_end(pages, repeat)
+        micro = bench_micro(pages, iterations)
+    finally:
+        app.close_http_client()
+        server.terminate()
+
+    print(f"\nEnd to end over {end_to_end['urls']} URLs:")
+    print(f"  scrape_images_from_links:       {end_to_end['sequential_urls_per_second']:.2f} URLs/s")
+    print(f"  scrape_images_from_links_async: {end_to_end['async_urls_per_second']:.2f} URLs/s")
+    print(f"  per-URL latency: {_fmt(end_to_end['latency'])}")
+    print("\nMicrobenchmarks (per call):")
+    for backend, summary in micro['parse'].items():
+        print(f"  parse[{backend}]: {_fmt(summary)}")
+    print(f"  verify_image: {_fmt(micro['verify_image'], 1e6, 'us')}")
+    print(f"  get_logo: {_fmt(micro['get_logo'], 1e6, 'us')}")
+    print(f"  check_size (cold): {_fmt(micro['check_size_cold'])}")
+    print(f"  check_size (cached): {_fmt(micro['check_size_cached'], 1e6, 'us')}")
+
+    compared, mismatches = check_results(end_to_end['results'], expected_path, load_expected_diffs(expected_diffs_path))
+    unexpected = [mismatch for mismatch in mismatches if mismatch['note'] is None]
+    print(f"\nCompared {compared} URLs with {expected_path}: {len(mismatches)} differences, "
+          f"{len(mismatches) - len(unexpected)} expected")
+    for mismatch in mismatches:
+        print(f"  {'✗' if mismatch['note'] is None else '~'} {mismatch['url']} {mismatch['field']}: "
+              f"expected {mismatch['expected']!r}, got {mismatch['got']!r}"
+              + (f" ({mismatch['note']})" if mismatch['note'] else ''))
+    return {
+        'server': dict(SERVER_CONFIG),
+        'end_to_end': {key: value for key, value in end_to_end.items() if key != 'results'},
+        'micro': micro,
+        'mismatches': mismatches,
+        'unexpected_mismatches': unexpected,
+    }
+
+# Markup the parser backends must handle alike (selectolax reports
+# valueless attributes as None where bs4 gives '')
+PARSER_EDGE_CASES = {
+    'valueless attributes': (
+        '<html><head><title>t</title><link rel href="/a.png"><link rel="icon" sizes href="/favicon.png">'
+        '<meta content><meta name><meta property="og:image" content></head><body>'
+        '<header class id><a class="logo" href="/"><img src="/logo.png" alt class></a></header>'
+        '<nav id><svg class><use href></use></svg></nav>'
+        '<div class><figure id><img src="/hero.jpg" alt width height="600"></figure></div>'
+        '<div id class="content"><img src data-src="/lazy.jpg" alt></div>'
+        '<script type>var x;</script><script type="application/ld+json"></script></body></html>'
+    ),
+    'valueless logo markers': (
+        '<html><head><link rel="icon" href></head><body><div id="brand" class>'
+        '<img alt src="/brand.svg"></div><div class="logo"><svg id><image href></image></svg></div></body></html>'
+    ),
+}
+
+def check_parser_edge_cases(backends=None):
+    """
+    Extract from every PARSER_EDGE_CASES page with each available parser
+    backend; returns [(case, backend, problem)] for crashes and for
+    answers that differ from the first backend's.
+    """
+    backends = backends or [backend for backend in app.PARSER_BACKENDS if app._backend_available(backend)]
+    url = 'https://example.com/page'
+    problems = []
+    app.EXTRACTION_RULES_CONFIG['enabled'] = False
+    for case, html_content in PARSER_EDGE_CASES.items():
+        answers = {}
+        for backend in backends:
+            try:
+                document = app.get_dom_index(app.parse_html(html_content, backend))
+                answers[backend] = {
+                    'image_plan': app.plan_first_image(url, document),
+                    'favicon': app.declared_favicon(url, document),
+                    'logo': app.get_logo(url, document),
+                }
+            except Exception as exc:
+                problems.append((case, backend, f"{type(exc).__name__}: {exc}"))
+        baseline = next(iter(answers.values()), None)
+        for backend, answer in answers.items():
+            if answer != baseline:
+                problems.append((case, backend, f"differs from {backends[0]}: {answer}"))
+    return problems
+
+AD_CORPUS = 'ad_filter_corpus.txt'
+
+def legacy_is_ad_div(div):
+    """The substring matcher AdFilter replaced, kept for comparison."""
+    ad_keywords = ['ad', 'banner', 'sponsor', 'advertisement', 'promo', 'promotion',
+                   'adsbygoogle', 'doubleclick', 'adserver', 'advert']
+    div_class = div.get('class', [])
+    div_class = [str(cls) for cls in div_class] if isinstance(div_class, list) else [str(div_class)]
+    div_attrs = ' '.join([' '.join(div_class), str(div.get('id', ''))]).lower()
+    return any(keyword in div_attrs for keyword in ad_keywords)
+
+def load_ad_corpus(path):
+    """[(attrs, expected_is_ad, line)] from the false-positive corpus."""
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            verdict, value = line.split(None, 1)
+            attrs = {'id': value[1:]} if value.startswith('#') else {'class': value.split()}
+            corpus.append((attrs, verdict == 'ad', line))
+    return corpus
+
+# Class names for synthetic heavy pages: content, old false positives, ads
+HEAVY_PAGE_CLASSES = [
+    'content', 'entry-content', 'post', 'card', 'row', 'col', 'wrapper', 'container', 'gallery',
+    'header', 'shadow', 'download', 'gradient', 'lazyloaded', 'masthead', 'thread', 'badge',
+    'ad-slot', 'sponsored', 'promo', 'banner', 'adsbygoogle',
+]
+
+def heavy_page(seed, containers):
+    """A synthetic page with `containers` nested divs/figures and an image in every third one."""
+    rng = random.Random(seed)
+    parts, depth = ['<html><head><title>heavy</title></head><body>'], 0
+    for i in range(containers):
+        tag = 'figure' if rng.random() < 0.1 else 'div'
+        classes = ' '.join(rng.sample(HEAVY_PAGE_CLASSES, rng.randint(1, 3)))
+        parts.append(f'<{tag} class="{classes}" id="block-{i}">')
+        if i % 3 == 0:
+            parts.append(f'<img src="/img/{i}.jpg">')
+        if depth < 6 and rng.random() < 0.5:
+            depth += 1
+            continue
+        parts.append(f'</{tag}>')
+        while depth and rng.random() < 0.3:
+            parts.append('</div>')
+            depth -= 1
+    parts.append('</div>' * depth + '</body></html>')
+    return ''.join(parts)
+
+def bench_ad_filter(corpus_path, pages, containers, iterations):
+    """
+    Corpus verdicts and heavy-page cost for the compiled filter and the
+    legacy matcher: per-page time of all is_ad_div calls, DomIndex build
+    time (every div/figure gets a verdict), containers flagged, and
+    div-step candidates left to probe.
+    """
+    corpus = load_ad_corpus(corpus_path)
+    soups = [app.BeautifulSoup(heavy_page(seed, containers), 'html.parser') for seed in range(pages)]
+    elements = [[element for tag in ('div', 'figure') for element in app.build_dom_index(soup).containers[tag]]
+                for soup in soups]
+    report = {}
+    compiled_is_ad_div = app.is_ad_div
+    try:
+        for name, matcher in (('compiled', compiled_is_ad_div), ('legacy', legacy_is_ad_div)):
+            app.is_ad_div = matcher
+            app.reset_ad_filter()
+            wrong = [line for attrs, expected, line in corpus if matcher(attrs) != expected]
+            matching = _time_calls(lambda page: [matcher(element) for element in page],
+                                   [(page,) for page in elements], iterations)
+            index_build = _time_calls(app.build_dom_index, [(soup,) for soup in soups], iterations)
+            indexes = [app.build_dom_index(soup) for soup in soups]
+            report[name] = {
+                'corpus_wrong': wrong,
+                'matching': summarize(matching),
+                'index_build': summarize(index_build),
+                'flagged_containers': sum(element.is_ad for index in indexes
+                                          for tag in ('div', 'figure') for element in index.containers[tag]),
+                'div_candidates': sum(len(app.container_image_candidates('http://bench.local/', index, 'div', 10**6))
+                                      for index in indexes),
+            }
+    finally:
+        app.is_ad_div = compiled_is_ad_div
+        app.reset_ad_filter()
+    return report
+
+def run_ad_filter(corpus_path, pages, containers, iterations):
+    report = bench_ad_filter(corpus_path, pages, containers, iterations)
+    print(f"Ad filter on {pages} synthetic pages x {containers} containers:")
+    for name, result in report.items():
+        print(f"  {name}: is_ad_div per page {_fmt(result['matching'])}, index build {_fmt(result['index_build'])}, "
+              f"{result['flagged_containers']} containers flagged, {result['div_candidates']} div-step candidates, "
+              f"{len(result['corpus_wrong'])} corpus errors")
+    for line in report['compiled']['corpus_wrong']:
+        print(f"  ✗ {line}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record fixtures and benchmark the scraper offline")
+    parser.add_argument('command', choices=['record', 'run', 'serve', 'adfilter', 'parsers'])
+    parser.add_argument('--fixtures', default=FIXTURE_DIR, help="recording directory")
+    parser.add_argument('--links', default='links.md', help="record: URLs to record (see app.iter_links)")
+    parser.add_argument('--expected', default='result.json', help="run: reference results to compare with")
+    parser.add_argument('--repeat', type=int, default=3, help="run: end-to-end passes over the recording")
+    parser.add_argument('--iterations', type=int, default=20, help="run: microbenchmark passes")
+    parser.add_argument('--json', metavar='PATH', help="run: also write the report to PATH")
+    parser.add_argument('--expected-diffs', default=EXPECTED_DIFFS, help="run: differences from --expected that are intended, with notes")
+    parser.add_argument('--record-diffs', metavar='NOTE', help="run: add this run's differences to --expected-diffs with NOTE (e.g. the request that changed them)")
+    parser.add_argument('--corpus', default=AD_CORPUS, help="adfilter: class/id verdict corpus")
+    parser.add_argument('--heavy-pages', type=int, default=5, help="adfilter: synthetic pages to time")
+    parser.add_argument('--containers', type=int, default=5000, help="adfilter: containers per synthetic page")
+    parser.add_argument('--port', type=int, default=8765, help="serve: port to listen on")
+    parser.add_argument('--latency', type=float, default=SERVER_CONFIG['latency'])
+    parser.add_argument('--jitter', type=float, default=SERVER_CONFIG['jitter'])
+    parser.add_argument('--bandwidth', type=int, default=SERVER_CONFIG['bandwidth'], help="bytes/s per response")
+    parser.add_argument('--error-rate', type=float, default=SERVER_CONFIG['error_rate'])
+    parser.add_argument('--timeout-rate', type=float, default=SERVER_CONFIG['timeout_rate'])
+    parser.add_argument('--timeout-seconds', type=float, default=SERVER_CONFIG['timeout_seconds'])
+    parser.add_argument('--seed', type=int, default=SERVER_CONFIG['seed'])
+    args = parser.parse_args()
+    for name in ('latency', 'jitter', 'bandwidth', 'error_rate', 'timeout_rate', 'timeout_seconds', 'seed'):
+        SERVER_CONFIG[name] = getattr(args, name)
+    app.logger.setLevel('WARNING')
+
+    if args.command == 'record':
+        record([url for _, url in app.iter_links(args.links)], args.fixtures)
+    elif args.command == 'adfilter':
+        report = run_ad_filter(args.corpus, args.heavy_pages, args.containers, args.iterations)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        sys.exit(1 if report['compiled']['corpus_wrong'] else 0)
+    elif args.command == 'parsers':
+        problems = check_parser_edge_cases()
+        for case, backend, problem in problems:
+            print(f"  ✗ {case} [{backend}]: {problem}")
+        print(f"Parser edge cases: {len(PARSER_EDGE_CASES)} pages, {len(problems)} problems")
+        sys.exit(1 if problems else 0)
+    elif args.command == 'serve':
+        print(f"Serving {args.fixtures} on 127.0.0.1:{args.port}; use HTTP_CLIENT_CONFIG['replay_server']")
+        serve_fixtures(args.fixtures, SERVER_CONFIG, args.port)
+    else:
+        report = run(args.fixtures, args.repeat, args.iterations, args.expected, args.expected_diffs)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        if args.record_diffs:
+            added = record_expected_diffs(args.expected_diffs, report['unexpected_mismatches'], args.record_diffs)
+            print(f"Recorded {added} expected differences in {args.expected_diffs}")
+            sys.exit(0)
+        sys.exit(1 if report['unexpected_mismatches'] else 0)